@@ -1,8 +1,5 @@
 import sys
 from os.path import abspath, join, dirname
-from time import time
-
-_startup_time = time() * 1000
 
 # Make sure that pyglet can be found.
 sys.path.insert(0, abspath(join(dirname(__file__), 'thirdparty', 'pyglet')))
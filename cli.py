@@ -73,6 +73,38 @@ class Cli(object):
             '-p', '--profiler', dest='profiler', action='store_true',
             help='Run with profiler. Print stats on exit.',
         )
+        self.parser.add_argument(
+            '--profiler-mode', dest='profiler_mode', action='store',
+            choices=['cprofile', 'sampling'], default='cprofile',
+            help='Trace every call (cprofile) or take stack samples (sampling) which\n'
+                 'keeps the overhead low enough for long sessions.',
+        )
+        self.parser.add_argument(
+            '--sample-rate', dest='sample_rate', action='store',
+            type=int, default=200, metavar='HZ',
+            help='Samples per second in sampling mode.',
+        )
+        self.parser.add_argument(
+            '--sample-output', dest='sample_output', action='store',
+            default='profiler-samples.folded', metavar='FILE',
+            help='Write folded stacks (for flame graphs) into FILE in sampling mode.',
+        )
+
+    def add_frame_profiler(self):
+        self.parser.add_argument(
+            '--frame-profiler', dest='frame_profiler', action='store_true',
+            help='Measure engine zones per frame. Print stats on exit.',
+        )
+        self.parser.add_argument(
+            '--trace', dest='trace', action='store', default=None,
+            metavar='FILE',
+            help='Stream measured zones into FILE (Chrome trace format). Implies --frame-profiler.',
+        )
+        self.parser.add_argument(
+            '--callgrind', dest='callgrind', action='store', default=None,
+            metavar='FILE',
+            help='Write measured zones into FILE (callgrind format) on exit. Implies --frame-profiler.',
+        )
 
     def parse_args(self):
         args = self.parser.parse_args()
@@ -83,7 +115,25 @@ class Cli(object):
         return args
 
     def run(self, command, *args, **kwargs):
-        if self.args.profiler:
+        from diamond import profiler
+        trace = getattr(self.args, 'trace', None)
+        callgrind = getattr(self.args, 'callgrind', None)
+        if getattr(self.args, 'frame_profiler', False) or trace or callgrind:
+            profiler.enable()
+            if trace:
+                profiler.start_trace(trace)
+        if getattr(self.args, 'profiler', False) and \
+                getattr(self.args, 'profiler_mode', 'cprofile') == 'sampling':
+            from diamond.sampler import Sampler
+            sampler = Sampler(self.args.sample_output, self.args.sample_rate)
+            sampler.start()
+            try:
+                command(*args, **kwargs)
+            finally:
+                sampler.stop()
+            print
+            sampler.print_stats(10)
+        elif getattr(self.args, 'profiler', False):
             import cProfile
             func = lambda: command(*args, **kwargs)
             cProfile.runctx('func()', globals(), locals(), 'profiler-stats.dat')
@@ -102,5 +152,9 @@ class Cli(object):
             # p.print_callers(.5, 'init')
         else:
             command()
+        if profiler.enabled:
+            profiler.stop_trace()
+            if callgrind:
+                profiler.export_callgrind(callgrind)
         from diamond.decorators import print_time_stats
         print_time_stats()
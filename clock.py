@@ -4,14 +4,71 @@
 # @copyright Oktay Acikalin
 # @license   MIT (LICENSE.txt)
 
+import sys
 from time import time, sleep
-
-from diamond import _startup_time
+from threading import Lock
+from weakref import WeakSet
+
+
+def _get_monotonic_source():
+    '''
+    Returns a function which returns seconds from a monotonic clock.
+    Falls back to time.time() if no monotonic clock can be found.
+    '''
+    try:
+        from time import monotonic  # Python 3.3+
+        return monotonic
+    except ImportError:
+        pass
+    if sys.platform == 'win32':
+        # Based on QueryPerformanceCounter on Windows.
+        from time import clock
+        return clock
+    try:
+        import ctypes
+        import ctypes.util
+        if sys.platform == 'darwin':
+            libc = ctypes.CDLL(ctypes.util.find_library('c'))
+
+            class mach_timebase_info(ctypes.Structure):
+                _fields_ = [('numer', ctypes.c_uint32), ('denom', ctypes.c_uint32)]
+
+            info = mach_timebase_info()
+            libc.mach_timebase_info(ctypes.byref(info))
+            factor = info.numer / float(info.denom) * 1e-9
+            mach_absolute_time = libc.mach_absolute_time
+            mach_absolute_time.restype = ctypes.c_uint64
+            return lambda: mach_absolute_time() * factor
+        if sys.platform.startswith('linux'):
+            class timespec(ctypes.Structure):
+                _fields_ = [('tv_sec', ctypes.c_long), ('tv_nsec', ctypes.c_long)]
+
+            CLOCK_MONOTONIC = 1
+            libname = ctypes.util.find_library('rt') or ctypes.util.find_library('c')
+            clock_gettime = ctypes.CDLL(libname).clock_gettime
+            clock_gettime.argtypes = [ctypes.c_int, ctypes.POINTER(timespec)]
+
+            def monotonic():
+                spec = timespec()
+                clock_gettime(CLOCK_MONOTONIC, ctypes.byref(spec))
+                return spec.tv_sec + spec.tv_nsec * 1e-9
+
+            monotonic()  # Fail early if something's wrong with the library.
+            return monotonic
+    except (OSError, AttributeError, TypeError):
+        pass
+    return time
+
+
+monotonic = _get_monotonic_source()
+
+_lock = Lock()
+_startup_time = monotonic() * 1000
 
 
 def get_ticks():
     '''Returns the number of milliseconds since diamond was loaded.'''
-    return (time() * 1000) -_startup_time
+    return (monotonic() * 1000) - _startup_time
 
 
 def wait(msecs):
@@ -21,15 +78,16 @@ def wait(msecs):
 def reset():
     '''Resets the statup time to now.'''
     global _startup_time
-    _startup_time = time() * 1000
+    with _lock:
+        _startup_time = monotonic() * 1000
 
 
 def shift(msecs):
     '''Use this to alter the time for e.g. compensating loading or creation time of scenes.'''
     global _startup_time
-    _startup_time += msecs
-    if _startup_time > time() * 1000:
-        _startup_time = time() * 1000
+    with _lock:
+        now = monotonic() * 1000
+        _startup_time = min(_startup_time + msecs, now)
 
 
 class Timer(object):
@@ -40,9 +98,115 @@ class Timer(object):
         self._stop = 0
 
     def start(self):
-        self._start = time() * 1000
+        self._start = monotonic() * 1000
 
     def stop(self):
-        self._stop = time() * 1000
+        self._stop = monotonic() * 1000
 
     result = property(lambda self: self._stop - self._start)
+
+
+class VirtualClock(object):
+    '''
+    A clock which follows a source clock (the engine clock by default) and
+    can be paused, scaled (slow-motion, fast-forward) and stepped manually.
+    Sources can be other virtual clocks which makes it possible to e.g.
+    give every scene its own clock driven by the clock of the scene manager.
+
+    Tickers and threads bound to a virtual clock get woken up whenever the
+    clock is being changed.
+    '''
+
+    def __init__(self, source=None, scale=1.0, manual=False):
+        super(VirtualClock, self).__init__()
+        self._lock = Lock()
+        self._source = source
+        self._scale = scale
+        self._is_paused = False
+        self._is_manual = manual
+        self._observers = WeakSet()
+        self._last = self._read_source()
+        self._time = 0.0
+        if source is not None and hasattr(source, 'add_observer'):
+            source.add_observer(self)
+
+    def __repr__(self):
+        return '<VirtualClock(time = %.2f, scale = %s, paused = %s, manual = %s)>' % (
+            self._time, self._scale, self._is_paused, self._is_manual)
+
+    def _read_source(self):
+        if self._source is None:
+            return get_ticks()
+        return self._source.get_ticks()
+
+    def _advance(self):
+        now = self._read_source()
+        delta = now - self._last
+        self._last = now
+        if not (self._is_paused or self._is_manual):
+            self._time += delta * self._scale
+
+    def get_ticks(self):
+        with self._lock:
+            self._advance()
+            return self._time
+
+    def add_observer(self, observer):
+        '''Observers need a wakeup() method which is being called on changes.'''
+        self._observers.add(observer)
+
+    def remove_observer(self, observer):
+        self._observers.discard(observer)
+
+    def wakeup(self):
+        [observer.wakeup() for observer in list(self._observers)]
+
+    def pause(self):
+        with self._lock:
+            self._advance()
+            self._is_paused = True
+        self.wakeup()
+
+    def unpause(self):
+        with self._lock:
+            self._advance()
+            self._is_paused = False
+        self.wakeup()
+
+    is_paused = property(lambda self: self._is_paused)
+
+    def set_scale(self, scale):
+        with self._lock:
+            self._advance()
+            self._scale = max(0.0, scale)
+        self.wakeup()
+
+    scale = property(lambda self: self._scale, set_scale)
+
+    def set_manual(self, manual):
+        '''In manual mode the clock only advances by calling step().'''
+        with self._lock:
+            self._advance()
+            self._is_manual = manual
+        self.wakeup()
+
+    is_manual = property(lambda self: self._is_manual)
+
+    def step(self, msecs):
+        '''Advances the clock by msecs. Works in any mode, even when paused.'''
+        with self._lock:
+            self._advance()
+            self._time += msecs
+        self.wakeup()
+
+    def to_source_msecs(self, msecs):
+        '''
+        Converts a duration of this clock into real milliseconds.
+        Returns None if the duration will never pass by on its own.
+        '''
+        if self._is_paused or self._is_manual or not self._scale:
+            return None
+        msecs /= self._scale
+        if self._source is not None and hasattr(self._source, 'to_source_msecs'):
+            return self._source.to_source_msecs(msecs)
+        return msecs
@@ -1,4 +1,4 @@
-# Tickerable class to test for collisions and emit events if any.
+# Tickerable classes to test for collisions and emit events if any.
 #
 # @author    Oktay Acikalin <oktay.acikalin@gmail.com>
 # @copyright Oktay Acikalin
@@ -7,80 +7,252 @@
 from threading import RLock
 
 from diamond import event
+from diamond import profiler
+from diamond.spatial import SpatialHash
 # from diamond.decorators import time
 
 
+# Layer bits of the bodies of Collision.
+SOURCE_LAYER = 1
+TARGET_LAYER = 2
+
+ALL_LAYERS = 0xffffffff
+
+
+class Body(object):
+
+    __slots__ = ('item', 'layer', 'mask', 'is_source', 'use_mask', 'get_rect', 'rect', 'hits')
+
+    def __init__(self, item, layer, mask, is_source, use_mask, get_rect):
+        self.item = item
+        self.layer = layer
+        self.mask = mask
+        self.is_source = is_source
+        self.use_mask = use_mask
+        self.get_rect = get_rect
+        self.rect = None
+        self.hits = set()
+
+    def __repr__(self):
+        return '<Body(%s, layer = %x, mask = %x)>' % (self.item, self.layer, self.mask)
+
+
+def _get_node_position(node, cache):
+    try:
+        return cache[node]
+    except KeyError:
+        parent = node._parent_node
+        if parent is None:
+            position = node._x, node._y
+        else:
+            x, y = _get_node_position(parent, cache)
+            position = x + node._x, y + node._y
+        cache[node] = position
+        return position
+
+
+def _can_use_mask(sprite):
+    # Masks only fit unscaled and unrotated sprites.
+    return sprite._scale == 1 and not sprite._rotation
+
+
+class CollisionWorld(object):
+    '''
+    Tests lots of bodies against each other and emits events for the
+    bodies being sources:
+    > <name>.state.changed: dict(source, targets, targets_added, targets_removed)
+    > <name>.state: dict(source, targets)
+    The first one whenever the targets of a source changed. The second one
+    on every tick as long as the source hits anything (and once after it
+    stopped doing so).
+
+    Every body has a layer and a mask (bit fields). A source hits a body
+    if the layer of the body and the mask of the source share a bit. Thus
+    bodies which are no source only get hit.
+
+    Bodies are sprites or any other object. The rect of a sprite is being
+    taken from its bounds and the position of its node in the tree. Other
+    objects need a get_rect function returning (x, y, w, h).
+
+    A spatial hash finds the bodies sharing an area (broad phase) which
+    keeps the costs proportional to the amount of bodies and not to the
+    amount of pairs. Bodies touching each other can then be tested pixel
+    by pixel via the alpha masks of the vault frames they show (narrow
+    phase). This only applies to unscaled and unrotated sprites.
+    '''
+
+    def __init__(self, name='collision', cell_size=64, use_masks=False):
+        super(CollisionWorld, self).__init__()
+        self.name = name
+        self.use_masks = use_masks
+        self._index = SpatialHash(cell_size)
+        self._bodies = dict()  # item -> Body
+        self.lock = RLock()
+
+    def __repr__(self):
+        return '<CollisionWorld(%s, bodies = %d)>' % (self.name, len(self._bodies))
+
+    def __len__(self):
+        return len(self._bodies)
+
+    def __contains__(self, item):
+        return item in self._bodies
+
+    def add(self, item, layer=1, mask=ALL_LAYERS, is_source=False, use_mask=None, get_rect=None):
+        '''
+        Adds item as body or updates it. use_mask defaults to the use_masks
+        setting of the world. See class description for the rest.
+        '''
+        if use_mask is None:
+            use_mask = self.use_masks
+        if get_rect is None and not hasattr(item, 'get_bounds'):
+            get_rect = item.get_rect
+        with self.lock:
+            body = self._bodies.get(item)
+            if body is None:
+                self._bodies[item] = Body(item, layer, mask, is_source, use_mask, get_rect)
+            else:
+                body.layer, body.mask, body.is_source = layer, mask, is_source
+                body.use_mask, body.get_rect = use_mask, get_rect
+
+    def add_many(self, items, **kwargs):
+        with self.lock:
+            [self.add(item, **kwargs) for item in items]
+
+    def remove(self, item):
+        with self.lock:
+            body = self._bodies.pop(item, None)
+            if body is not None:
+                self._index.remove(body)
+
+    def remove_many(self, items):
+        with self.lock:
+            [self.remove(item) for item in items]
+
+    def clear(self):
+        with self.lock:
+            self._bodies.clear()
+            self._index.clear()
+
+    def get_hits(self, item):
+        '''Returns the set of items hit by the source item during the last tick.'''
+        return set(self._bodies[item].hits)
+
+    def _update_rects(self):
+        update, remove = self._index.update, self._index.remove
+        positions = dict()
+        for body in self._bodies.itervalues():
+            item = body.item
+            if body.get_rect is not None:
+                x, y, w, h = body.get_rect()
+                rect = x, y, x + w, y + h
+            else:
+                node = item._parent_node
+                if node is None or not item._visible:
+                    body.rect = None
+                    remove(body)
+                    continue
+                n_x, n_y = _get_node_position(node, positions)
+                x1, y1, x2, y2 = item.get_bounds()
+                rect = x1 + n_x, y1 + n_y, x2 + n_x, y2 + n_y
+            if rect != body.rect:
+                body.rect = rect
+                update(body, rect)
+
+    def _overlap(self, a, b):
+        a_x1, a_y1, a_x2, a_y2 = a.rect
+        b_x1, b_y1, b_x2, b_y2 = b.rect
+        if a_x1 >= b_x2 or b_x1 >= a_x2 or a_y1 >= b_y2 or b_y1 >= a_y2:
+            return False
+        if not a.use_mask or not b.use_mask or a.get_rect is not None or b.get_rect is not None:
+            return True
+        if not _can_use_mask(a.item) or not _can_use_mask(b.item):
+            return True
+        return a.item.get_frame().get_mask().overlap(
+            b.item.get_frame().get_mask(), b_x1 - a_x1, b_y1 - a_y1)
+
+    def _find_hits(self):
+        hits = dict()  # source body -> set of items
+        overlap = self._overlap
+        pairs = self._index.get_pairs()
+        for a, b in pairs:
+            a_hits_b = a.is_source and b.layer & a.mask
+            b_hits_a = b.is_source and a.layer & b.mask
+            if not a_hits_b and not b_hits_a:
+                continue
+            if not overlap(a, b):
+                continue
+            if a_hits_b:
+                try:
+                    hits[a].add(b.item)
+                except KeyError:
+                    hits[a] = set([b.item])
+            if b_hits_a:
+                try:
+                    hits[b].add(a.item)
+                except KeyError:
+                    hits[b] = set([a.item])
+        if profiler.enabled:
+            profiler.count('collision.pairs', len(pairs))
+        return hits
+
+    def _emit(self, body, results):
+        last_results = body.hits
+        if not results and not last_results:
+            return
+        body.hits = results
+        source = body.item
+        if results != last_results:
+            event.emit('%s.state.changed' % self.name, dict(
+                source=source, targets=results,
+                targets_added=results - last_results,
+                targets_removed=last_results - results,
+            ))
+        event.emit('%s.state' % self.name, dict(
+            source=source, targets=results,
+        ))
+
+    # @time
+    def tick(self):
+        if not self.lock.acquire(False):
+            return
+        try:
+            self._update_rects()
+            hits = self._find_hits()
+            emit = self._emit
+            for body in self._bodies.values():
+                if body.is_source:
+                    emit(body, hits.get(body, set()))
+        finally:
+            self.lock.release()
+
+
 class Collision(object):
+    '''
+    Tests one source against many targets. Uses a CollisionWorld with
+    alpha masks enabled.
+    '''
 
     def __init__(self, name='collision'):
         super(Collision, self).__init__()
-        self.__name = name
-        self.__events = set()
-        self.__targets = set()
+        self.world = CollisionWorld(name, use_masks=True)
+        self.lock = self.world.lock
         self.__source = None
-        self.__active_collisions = set()
-        self.lock = RLock()
 
     def add_targets(self, targets):
-        with self.lock:
-            self.__targets |= set(targets)
+        self.world.add_many(targets, layer=TARGET_LAYER, mask=0)
 
     def remove_targets(self, targets):
-        with self.lock:
-            self.__targets -= set(targets)
+        self.world.remove_many(targets)
 
     def set_source(self, source):
-        self.__source = source
+        with self.lock:
+            if self.__source is not None:
+                self.world.remove(self.__source)
+            self.__source = source
+            if source is not None:
+                self.world.add(source, layer=SOURCE_LAYER, mask=TARGET_LAYER, is_source=True)
 
     # @time
     def tick(self):
-        if self.__source is None or not self.lock.acquire(False):
-            return
-        source = self.__source
-        targets = list(self.__targets)
-        target_rects = [target.get_rect() for target in targets]
-        collisions = source.get_rect().collidelistall(target_rects)
-        if collisions:
-            # print
-            source_mask = source.frame['masks'][str(source.frame['current_gamma'])]
-            results = set()
-            for idx in collisions:
-                target = targets[idx]
-                if not target or target.pos_real_in_tree is None:
-                    continue
-                try:
-                    target_mask = target.frame['masks'][str(target.frame['current_gamma'])]
-                except TypeError:  # Race condition.
-                    print('Got race condition with sprite: %s' % target)
-                    target_mask = target.vault.get_action('none').get_frame(0).get_mask()
-                # print(target_mask)
-                x, y = source.pos_real_in_tree
-                x -= target.pos_real_in_tree[0]
-                y -= target.pos_real_in_tree[1]
-                # print x, y
-                if target_mask.overlap(source_mask, (x, y)):
-                    results.add(target)
-            # print(results)
-            last_results = self.__active_collisions
-            added = results - last_results
-            removed = last_results - results
-            self.__active_collisions = results
-            if added or removed:
-                event.emit('%s.state.changed' % self.__name, dict(
-                    source=source, targets=results,
-                    targets_added=added, targets_removed=removed,
-                ))
-            event.emit('%s.state' % self.__name, dict(
-                source=source, targets=results,
-            ))
-        elif self.__active_collisions:
-            last_results = self.__active_collisions
-            self.__active_collisions = set()
-            event.emit('%s.state.changed' % self.__name, dict(
-                source=source, targets=set(),
-                targets_added=set(), targets_removed=last_results,
-            ))
-            event.emit('%s.state' % self.__name, dict(
-                source=source, targets=self.__active_collisions,
-            ))
-        self.lock.release()
+        self.world.tick()
@@ -0,0 +1,227 @@
+# Collision tests against solid tiles of a matrix.
+#
+# @author    Oktay Acikalin <oktay.acikalin@gmail.com>
+# @copyright Oktay Acikalin
+# @license   MIT (LICENSE.txt)
+
+from math import floor, ceil
+from threading import RLock
+
+from diamond import event
+
+
+class CollisionGrid(object):
+    '''
+    Extracts the solid tiles of some layers of a Matrix (e.g. passability
+    layers) into one bitmap per sector: a list of integers, one per row,
+    with bit x set if tile x of the row is solid. Sectors get extracted on
+    first use and dropped again when points of the matrix change.
+
+    All queries take pixels (tile coordinates times tile_size) and test
+    whole rows of tiles at once. Thus their costs depend on the amount of
+    rows or tiles being crossed and not on the size of the map.
+
+    By default every tile having a value on any of the layers is solid.
+    Pass is_solid(value) for anything else.
+
+    Sectors may get extracted by other threads (see Pathfinder). A sector
+    being extracted while it changes won't be kept.
+    '''
+
+    def __init__(self, matrix, layers, tile_size=(1, 1), is_solid=None):
+        super(CollisionGrid, self).__init__()
+        self.matrix = matrix
+        self.layers = tuple(layers)
+        self.tile_size = tile_size
+        self._is_solid_value = is_solid
+        self._sectors = dict()  # (s_x, s_y) -> list of row bits
+        self._generations = dict()  # (s_x, s_y) -> amount of invalidations
+        self._clears = 0
+        self.lock = RLock()
+        self._listener = event.add_listener(self._on_matrix_point_changed, 'matrix.point.changed')
+
+    def __repr__(self):
+        return '<CollisionGrid(layers = %s, sectors = %d)>' % (self.layers, len(self._sectors))
+
+    def _on_matrix_point_changed(self, context):
+        if context['matrix'] is self.matrix and context['z'] in self.layers:
+            self.invalidate(context['x'], context['y'])
+
+    def close(self):
+        event.remove_listener(self._listener)
+        self.clear()
+
+    def _get_generation(self, s_x, s_y):
+        return self._clears, self._generations.get((s_x, s_y), 0)
+
+    def _build_sector(self, s_x, s_y):
+        with self.lock:
+            generation = self._get_generation(s_x, s_y)
+        s_w, s_h = self.matrix.sector_size
+        o_x, o_y = s_x * s_w, s_y * s_h
+        is_solid = self._is_solid_value
+        rows = [0] * s_h
+        for x, y, z, value in self.matrix.get_sector_points(s_x, s_y, self.layers):
+            if is_solid is None or is_solid(value):
+                rows[y - o_y] |= 1 << (x - o_x)
+        with self.lock:
+            # Don't keep it if the sector changed meanwhile.
+            if self._get_generation(s_x, s_y) == generation:
+                self._sectors[s_x, s_y] = rows
+        return rows
+
+    def _get_sector(self, s_x, s_y):
+        try:
+            return self._sectors[s_x, s_y]
+        except KeyError:
+            return self._build_sector(s_x, s_y)
+
+    def invalidate(self, x, y):
+        '''Extracts the sector containing tile (x, y) again on next use.'''
+        s_w, s_h = self.matrix.sector_size
+        self.invalidate_sector(x // s_w, y // s_h)
+
+    def invalidate_sector(self, s_x, s_y):
+        with self.lock:
+            self._generations[s_x, s_y] = self._generations.get((s_x, s_y), 0) + 1
+            self._sectors.pop((s_x, s_y), None)
+
+    def clear(self):
+        with self.lock:
+            self._clears += 1
+            self._sectors.clear()
+
+    def is_solid(self, x, y):
+        '''Returns True if tile (x, y) is solid. Takes tile coordinates.'''
+        s_w, s_h = self.matrix.sector_size
+        s_x, s_y = x // s_w, y // s_h
+        return bool(self._get_sector(s_x, s_y)[y - s_y * s_h] >> (x - s_x * s_w) & 1)
+
+    def get_row(self, y, x1, x2):
+        '''
+        Returns the bits of the tiles x1 to x2 (including) of row y. Bit 0
+        belongs to tile x1. Takes tile coordinates.
+        '''
+        s_w, s_h = self.matrix.sector_size
+        s_y = y // s_h
+        l_y = y - s_y * s_h
+        get_sector = self._get_sector
+        result = 0
+        for s_x in xrange(x1 // s_w, x2 // s_w + 1):
+            o_x = s_x * s_w
+            row = get_sector(s_x, s_y)[l_y]
+            if not row:
+                continue
+            l_x1 = max(x1 - o_x, 0)
+            l_x2 = min(x2 - o_x, s_w - 1)
+            bits = (row >> l_x1) & ((1 << (l_x2 - l_x1 + 1)) - 1)
+            if bits:
+                result |= bits << (o_x + l_x1 - x1)
+        return result
+
+    def raycast(self, x1, y1, x2, y2):
+        '''
+        Follows the line from (x1, y1) to (x2, y2) tile by tile (DDA) and
+        returns (tile_x, tile_y, x, y) of the first solid tile and the point
+        where the line enters it. Or None if there is none. Takes pixels.
+        '''
+        t_w, t_h = self.tile_size
+        s_w, s_h = self.matrix.sector_size
+        f_x, f_y = x1 / float(t_w), y1 / float(t_h)
+        d_x, d_y = x2 / float(t_w) - f_x, y2 / float(t_h) - f_y
+        x, y = int(floor(f_x)), int(floor(f_y))
+        if d_x > 0:
+            step_x, delta_x, max_x = 1, 1 / d_x, (x + 1 - f_x) / d_x
+        elif d_x < 0:
+            step_x, delta_x, max_x = -1, -1 / d_x, (f_x - x) / -d_x
+        else:
+            step_x, delta_x, max_x = 0, 0, 2.0
+        if d_y > 0:
+            step_y, delta_y, max_y = 1, 1 / d_y, (y + 1 - f_y) / d_y
+        elif d_y < 0:
+            step_y, delta_y, max_y = -1, -1 / d_y, (f_y - y) / -d_y
+        else:
+            step_y, delta_y, max_y = 0, 0, 2.0
+        get_sector = self._get_sector
+        sector_pos, rows = None, None
+        t = 0.0
+        while t <= 1.0:
+            s_x, s_y = x // s_w, y // s_h
+            if (s_x, s_y) != sector_pos:
+                sector_pos = s_x, s_y
+                rows = get_sector(s_x, s_y)
+            if rows[y - s_y * s_h] >> (x - s_x * s_w) & 1:
+                return x, y, x1 + (x2 - x1) * t, y1 + (y2 - y1) * t
+            if max_x < max_y:
+                t = max_x
+                max_x += delta_x
+                x += step_x
+            else:
+                t = max_y
+                max_y += delta_y
+                y += step_y
+        return None
+
+    def _sweep_x(self, x, y, w, h, d_x):
+        t_w, t_h = self.tile_size
+        row1, row2 = int(floor(y / float(t_h))), int(ceil((y + h) / float(t_h))) - 1
+        get_row = self.get_row
+        if d_x > 0:
+            edge = x + w
+            col1 = int(ceil(edge / float(t_w)))
+            col2 = int(ceil((edge + d_x) / float(t_w))) - 1
+            if col2 < col1:
+                return d_x, False
+            bits = 0
+            for row in xrange(row1, row2 + 1):
+                bits |= get_row(row, col1, col2)
+            if not bits:
+                return d_x, False
+            col = col1 + (bits & -bits).bit_length() - 1
+            return col * t_w - edge, True
+        else:
+            col1 = int(floor((x + d_x) / float(t_w)))
+            col2 = int(floor(x / float(t_w))) - 1
+            if col2 < col1:
+                return d_x, False
+            bits = 0
+            for row in xrange(row1, row2 + 1):
+                bits |= get_row(row, col1, col2)
+            if not bits:
+                return d_x, False
+            col = col1 + bits.bit_length() - 1
+            return (col + 1) * t_w - x, True
+
+    def _sweep_y(self, x, y, w, h, d_y):
+        t_w, t_h = self.tile_size
+        col1, col2 = int(floor(x / float(t_w))), int(ceil((x + w) / float(t_w))) - 1
+        get_row = self.get_row
+        if d_y > 0:
+            edge = y + h
+            row1 = int(ceil(edge / float(t_h)))
+            row2 = int(ceil((edge + d_y) / float(t_h))) - 1
+            for row in xrange(row1, row2 + 1):
+                if get_row(row, col1, col2):
+                    return row * t_h - edge, True
+        else:
+            row1 = int(floor(y / float(t_h))) - 1
+            row2 = int(floor((y + d_y) / float(t_h)))
+            for row in xrange(row1, row2 - 1, -1):
+                if get_row(row, col1, col2):
+                    return (row + 1) * t_h - y, True
+        return d_y, False
+
+    def sweep_aabb(self, x, y, w, h, d_x, d_y):
+        '''
+        Moves the rect (x, y, w, h) by (d_x, d_y) - horizontally first, then
+        vertically - and stops it in front of solid tiles. Returns (d_x,
+        d_y, hit_x, hit_y) with the movement possible and whether a tile
+        got hit on that axis. Tiles already overlapped are being ignored.
+        Takes pixels.
+        '''
+        hit_x = hit_y = False
+        if d_x:
+            d_x, hit_x = self._sweep_x(x, y, w, h, d_x)
+        if d_y:
+            d_y, hit_y = self._sweep_y(x + d_x, y, w, h, d_y)
+        return d_x, d_y, hit_x, hit_y
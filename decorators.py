@@ -4,13 +4,9 @@
 # @copyright Oktay Acikalin
 # @license   MIT (LICENSE.txt)
 
-import sys
-import cStringIO
 from functools import wraps
 
-from diamond.clock import get_ticks
-
-time_stats = dict()
+from diamond import profiler
 
 
 def _get_func_and_arglist(fname, argnames, args_, kwargs_):
@@ -49,53 +45,30 @@ def dump_args(func):
 
 def time(func):
     '''
-    This decorator dumps out the arguments passed to a function before calling it
-    and measures it's execution time in msecs.
-    @link http://wiki.python.org/moin/PythonDecoratorLibrary
+    This decorator measures the execution time of a function in msecs within
+    a zone of the profiler (see diamond.profiler). It only costs a flag check
+    while the profiler is disabled.
     '''
-    @wraps(func)
-    def wrapper(*args, **kwargs):
-        argnames = func.func_code.co_varnames[:func.func_code.co_argcount]
-        fname = func.func_name
-        args_ = list(args)
-        kwargs_ = kwargs.copy()
-        func_name, items = _get_func_and_arglist(fname, argnames, args_, kwargs_)
-        print '%s(%s)' % (func_name, ', '.join(items)),
+    name = func.func_name
+    try:
+        args = func.func_code.co_varnames[:func.func_code.co_argcount]
+    except AttributeError:
+        args = ()
 
-        stdout = sys.stdout
-        output = cStringIO.StringIO()
-        sys.stdout = output
-
-        start = get_ticks()
-        excp = None
-        try:
-            result = func(*args, **kwargs)
-        except Exception as excp:
-            result = ''
-        stop = get_ticks()
-
-        contents = output.getvalue()
-        sys.stdout = stdout
-
-        print('-> %.4f msecs' % (stop - start))
-
-        for line in contents.rstrip().split('\n'):
-            print('  %s' % line)
-
-        if func_name in time_stats:
-            time_stats[func_name].append(stop - start)
+    @wraps(func)
+    def wrapper(*args_, **kwargs):
+        if not profiler.enabled:
+            return func(*args_, **kwargs)
+        if args and args[0] == 'self':
+            zone = '%s.%s' % (args_[0].__class__.__name__, name)
         else:
-            time_stats[func_name] = [stop - start]
-
-        if excp:
-            raise
-
-        return result
+            zone = name
+        with profiler.zone(zone):
+            return func(*args_, **kwargs)
     wrapper.__wrapped__ = func
     return wrapper
 
 
 def print_time_stats():
-    for func, stats in time_stats.iteritems():
-        print('%s: min=%.4f, max=%.4f, avg=%.4f, count=%d' % (func,
-              min(stats), max(stats), sum(stats) / len(stats), len(stats)))
+    if profiler.zones:
+        profiler.print_stats()
@@ -5,7 +5,13 @@
 # @license   MIT (LICENSE.txt)
 
 # TODO make use of http://docs.python.org/library/itertools.html
+import sys
+import weakref
 from inspect import getargspec
+from collections import deque
+
+from diamond import profiler
+from diamond import ownership
 from diamond.helper.weak_ref import Wrapper
 
 # from diamond.decorators import time, dump_args
@@ -13,6 +19,9 @@ from diamond.helper.weak_ref import Wrapper
 
 listeners = {}
 
+# Listeners whose function or filter objects died. Purged on next access.
+_dead_listeners = deque()
+
 basic_rules = dict(
     instance__is=lambda context, value: context is not value,
     instance__is_not=lambda context, value: context is value,
@@ -51,22 +60,71 @@ proxy_context_rules = set([
 
 class Listener(object):
 
-    def __init__(self, func, event_name, filters):
+    def __init__(self, func, event_name, filters, argument=None):
         self.func = func
         self.event_name = event_name
         self.filters = filters
+        # Name of the argument the context gets passed as (if any).
+        self.argument = argument
+        self.owner = None  # See diamond.ownership.
 
     def __repr__(self):
         return 'Listener(%s, %s, %s)' % (self.func, self.event_name, self.filters)
 
 
+def _get_argument(func):
+    try:
+        if hasattr(func, '__wrapped__'):
+            spec = getargspec(func.__wrapped__)
+        else:
+            spec = getargspec(func)
+    except TypeError:
+        # Not a python function. We cannot know.
+        return None
+    args = spec.args
+    if 'context' in args:
+        return 'context'
+    elif 'event' in args:
+        return 'event'
+    return None
+
+
+def _get_death_handler(listener):
+    listener = weakref.ref(listener)
+
+    def on_death(wrapper):
+        listener_ = listener()
+        if listener_ is not None:
+            _dead_listeners.append(listener_)
+    return on_death
+
+
+def _remove(listener):
+    try:
+        listeners[listener.event_name].discard(listener)
+    except KeyError:
+        pass
+    if listener.owner is not None:
+        ownership.remove_listener(listener)
+
+
+def _purge_dead_listeners():
+    pop = _dead_listeners.popleft
+    while _dead_listeners:
+        _remove(pop())
+
+
 # @time
 def clear_listeners():
     # print 'event.clear_listeners()'
+    for items in listeners.values():
+        [ownership.remove_listener(item) for item in items if item.owner is not None]
     listeners.clear()
+    _dead_listeners.clear()
 
 
 def get_listeners(hide_empty_lists=True):
+    _purge_dead_listeners()
     if hide_empty_lists:
         results = {}
         for key, val in listeners.iteritems():
@@ -78,49 +136,59 @@ def get_listeners(hide_empty_lists=True):
 
 
 # @time
-def add_listener(func, event_name, **filters):
+def add_listener(func, event_name, owner=None, **filters):
+    '''
+    Calls func whenever event_name gets emitted and the filters match.
+    If owner is given the listener gets removed by ownership.release(owner).
+    Returns a handle for remove_listener().
+    '''
     # print 'event.add_listener(func=%s, event_name=%s, filters=%s)' % (func, event_name, filters)
-    func = Wrapper(func)
+    if _dead_listeners:
+        _purge_dead_listeners()
+    handler = Listener(None, event_name, filters, _get_argument(func))
+    on_death = _get_death_handler(handler)
+    handler.func = Wrapper(func, on_death)
     if filters:
         # print 'event.add_listener(func=%s, event_name=%s, filters=%s)' % (func, event_name, filters)
         for key, val in filters.iteritems():
             if key in proxy_rules:
                 try:
-                    filters[key] = Wrapper(val)
+                    filters[key] = Wrapper(val, on_death)
                 except TypeError:
                     pass
                 continue
             for rule in proxy_context_rules:
                 if key.endswith(rule):
                     try:
-                        filters[key] = Wrapper(val)
+                        filters[key] = Wrapper(val, on_death)
                     except TypeError:
                         pass
                     break
-    handler = Listener(func, event_name, filters)
     try:
-        listeners[event_name] |= set([handler])
+        listeners[event_name].add(handler)
     except KeyError:
         listeners[event_name] = set([handler])
+    if owner is not None:
+        ownership.add_listener(owner, handler)
     return Wrapper(handler)
 
 
+def get_listener(candidate):
+    '''Returns the Listener of a handle (or the Listener itself). None if gone.'''
+    if type(candidate) is Wrapper:
+        return candidate.resolve()
+    if type(candidate) is Listener:
+        return candidate
+    return None
+
+
 # @dump_args
 def remove_listener(candidate):
     # print 'Remove listener:', candidate
-    try:
-        listener = candidate.resolve()
-    except ReferenceError:
-        # Try to find dead candidate and remove it.
-        for key in listeners:
-            try:
-                listeners[key].remove(candidate)
-                break
-            except ValueError:
-                pass
-    else:
-        if listener is not None:
-            listeners[listener.event_name].remove(listener)
+    # The handle dies with its listener. Dead listeners are gone already.
+    listener = get_listener(candidate)
+    if listener is not None:
+        _remove(listener)
 
 
 # @dump_args
@@ -166,21 +234,14 @@ def emit(event_name, context=None):
     # print 'event.emit(event_name=%s, context=%s)' % (event_name, context)
     parse = _parse
     results = []
+    if _dead_listeners:
+        _purge_dead_listeners()
     for listener in listeners.get(event_name, set()).copy():
         func = listener.func
-        event_name = listener.event_name
         filters = listener.filters
 
-        # Resolve weak ref.
-        try:
-            func = func.resolve()
-        except ReferenceError:
-            # It might happen that a race conditions brings us here.
-            try:
-                listeners[event_name].remove(listener)
-                # print 'removed stale listener: %s' % listener
-            except KeyError:
-                pass
+        if not func.is_alive:
+            # Died while emitting.
             continue
 
         matching_failed = False
@@ -212,19 +273,22 @@ def emit(event_name, context=None):
             if matching_failed:
                 break
         if not matching_failed:
-            if hasattr(func, '__wrapped__'):
-                spec = getargspec(func.__wrapped__)
-            else:
-                spec = getargspec(func)
-            args = spec.args
-            if 'context' in args:
-                # print 'executing %s with context: %s' % (func, context)
-                results.append((func, func(context=context)))
-            elif 'event' in args:
-                # print 'executing %s with event: %s' % (func, context)
-                results.append((func, func(event=context)))
-            else:
-                # print 'DEBUG: event.emit() got function without proper event interface:', func
-                # print 'executing %s without context.' % func
-                results.append((func, func()))
+            argument = listener.argument
+            try:
+                if argument == 'context':
+                    # print 'executing %s with context: %s' % (func, context)
+                    results.append((func, func(context=context)))
+                elif argument == 'event':
+                    # print 'executing %s with event: %s' % (func, context)
+                    results.append((func, func(event=context)))
+                else:
+                    # print 'executing %s without context.' % func
+                    results.append((func, func()))
+            except ReferenceError:
+                if func.is_alive:
+                    raise
+                # Instance died while emitting.
     return results
+
+
+profiler.instrument(sys.modules[__name__], 'emit', 'event.emit')
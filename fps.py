@@ -4,6 +4,7 @@
 # @copyright Oktay Acikalin
 # @license   MIT (LICENSE.txt)
 
+from diamond import pyglet
 from diamond.font import Font
 
 
@@ -28,17 +29,14 @@ class Fps(Font):
         self.details = False
 
     def update_fps(self):
-        fps = self.display.clock.get_fps()
+        fps = pyglet.clock.get_fps()
         recent_flens = self.recent_frame_lenghts
         recent_flens.pop(0)
         recent_flens.append(fps)
         if self.details:
+            # For a detailed breakdown use the HUD (see Window.show_hud).
             avg_flen = sum(recent_flens) / 5
-            nodes = len(self.display.get_root_node().get_node_tree_as_list())
-            sprites = len(self.display.display_list)
-            drawables = len(self.display._drawables)
-            text = '%.1f fps (avg %.1f), %d objs (%d nds, %d sprts, %d drwbls)' % (
-                fps, avg_flen, nodes + sprites, nodes, sprites, drawables)
+            text = '%.1f fps (avg %.1f)' % (fps, avg_flen)
         else:
             text = '%d fps' % fps
         self.set_text(text)
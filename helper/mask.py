@@ -0,0 +1,97 @@
+# Bit masks for pixel exact collision tests.
+#
+# @author    Oktay Acikalin <oktay.acikalin@gmail.com>
+# @copyright Oktay Acikalin
+# @license   MIT (LICENSE.txt)
+
+
+class Mask(object):
+    '''
+    Holds one integer per row of pixels. Bit x of a row is set if pixel x
+    is solid. Testing two masks for overlap shifts and ands whole rows at
+    once. Thus the costs depend on the height of the overlap only.
+    Rows go from top to bottom like the nodes do.
+    '''
+
+    __slots__ = ('width', 'height', 'rows')
+
+    def __init__(self, width, height, rows=None):
+        self.width = width
+        self.height = height
+        self.rows = rows if rows is not None else [0] * height
+
+    def __repr__(self):
+        return '<Mask(%dx%d, %d bits)>' % (self.width, self.height, self.count())
+
+    @classmethod
+    def from_alpha(cls, data, width, height, pitch=None, bpp=4, alpha_offset=3,
+                   threshold=1, flip_y=False):
+        '''
+        Builds a mask out of raw image data (RGBA by default). Pixels with an
+        alpha of at least threshold are solid. Set flip_y if the rows of data
+        go from bottom to top (like the ones of pyglet do).
+        '''
+        if pitch is None:
+            pitch = width * bpp
+        rows = []
+        for y in xrange(height):
+            offset = pitch * y + alpha_offset
+            alphas = data[offset:offset + width * bpp:bpp]
+            row = 0
+            for x, alpha in enumerate(alphas):
+                if ord(alpha) >= threshold:
+                    row |= 1 << x
+            rows.append(row)
+        if flip_y:
+            rows.reverse()
+        return cls(width, height, rows)
+
+    def get_at(self, x, y):
+        return bool(self.rows[y] >> x & 1)
+
+    def count(self):
+        '''Returns the amount of solid pixels.'''
+        return sum(bin(row).count('1') for row in self.rows)
+
+    def overlap(self, other, offset_x, offset_y):
+        '''
+        Returns True if any solid pixel of other placed at (offset_x,
+        offset_y) relative to this mask meets a solid pixel of this mask.
+        '''
+        offset_x, offset_y = int(offset_x), int(offset_y)
+        if offset_x >= self.width or -offset_x >= other.width:
+            return False
+        start = max(0, offset_y)
+        end = min(self.height, offset_y + other.height)
+        rows, other_rows = self.rows, other.rows
+        if offset_x >= 0:
+            for y in xrange(start, end):
+                if rows[y] & (other_rows[y - offset_y] << offset_x):
+                    return True
+        else:
+            offset_x = -offset_x
+            for y in xrange(start, end):
+                if rows[y] & (other_rows[y - offset_y] >> offset_x):
+                    return True
+        return False
+
+    def get_bounding_rect(self):
+        '''Returns the tight rect (x, y, w, h) around all solid pixels.'''
+        rows = [y for y, row in enumerate(self.rows) if row]
+        if not rows:
+            return 0, 0, 0, 0
+        combined = 0
+        for row in self.rows:
+            combined |= row
+        x1 = (combined & -combined).bit_length() - 1
+        x2 = combined.bit_length()
+        return x1, rows[0], x2 - x1, rows[-1] + 1 - rows[0]
+
+    def to_data(self):
+        '''Returns a JSON friendly form (rows as hex strings). See from_data().'''
+        return dict(size=[self.width, self.height], rows=['%x' % row for row in self.rows])
+
+    @classmethod
+    def from_data(cls, data):
+        width, height = data['size']
+        return cls(width, height, [int(row, 16) for row in data['rows']])
@@ -1,77 +1,177 @@
 # Ordered Set.
 #
 # @author    Oktay Acikalin <oktay.acikalin@gmail.com> (partly)
+#
+# Interface, __repr__ and __eq__ taken from
+# http://code.activestate.com/recipes/577624/ (r2)
 
-## {{{ http://code.activestate.com/recipes/577624/ (r2)
 import collections
-from itertools import chain
+from bisect import bisect_left, bisect_right, insort
+from itertools import chain, islice
+
+
+# Marks removed items within the array.
+_DELETED = object()
 
-# from diamond.decorators import time
+# Compact only if there are at least this many removed items.
+COMPACT_MIN_DELETED = 64
 
 
 class OrderedSet(collections.MutableSet):
+    '''
+    A set which remembers the order in which items have been added.
 
-    KEY, PREV, NEXT = range(3)
+    Items live in an array. Removing an item only leaves a tombstone which
+    keeps adding, removing and membership tests at O(1). The array gets
+    compacted as soon as more than half of it consists of tombstones.
+    Leading and trailing tombstones are being skipped right away thus first
+    ([0]) and last ([-1]) item are always O(1). Other indices are O(1) as
+    long as there are no tombstones in between. Otherwise the positions of
+    the tombstones (kept sorted) are being bisected which is O(log^2 n).
+
+    Iterating is safe while adding or removing items. The array won't be
+    compacted until all running iterators are done.
+    '''
+
+    __slots__ = ('_items', '_map', '_head', '_deleted', '_iterators')
 
     def __init__(self, iterable=None):
-        self.end = end = []
-        end += [None, end, end]  # sentinel node for doubly linked list
-        self.map = {}            # key --> [key, prev, next]
+        self._items = []  # Items in order with tombstones.
+        self._map = {}    # item --> position in _items
+        self._head = 0    # Position of the first item.
+        self._deleted = []  # Sorted positions of tombstones after _head.
+        self._iterators = 0
         if iterable is not None:
-            self |= iterable
+            self.update(iterable)
 
     def __len__(self):
-        return len(self.map)
+        return len(self._map)
 
     def __contains__(self, key):
-        return key in self.map
+        return key in self._map
 
     def add(self, key):
-        if key not in self.map:
-            end = self.end
-            curr = end[OrderedSet.PREV]
-            curr[OrderedSet.NEXT] = end[OrderedSet.PREV] = self.map[key] = [key, curr, end]
+        map = self._map
+        if key not in map:
+            items = self._items
+            map[key] = len(items)
+            items.append(key)
+
+    def update(self, iterable):
+        map = self._map
+        items = self._items
+        append = items.append
+        for key in iterable:
+            if key not in map:
+                map[key] = len(items)
+                append(key)
+
+    def __ior__(self, iterable):
+        self.update(iterable)
+        return self
 
     def copy(self):
         return OrderedSet(self)
 
     def discard(self, key):
-        if key in self.map:
-            key, prev, next = self.map.pop(key)
-            prev[OrderedSet.NEXT] = next
-            next[OrderedSet.PREV] = prev
+        try:
+            pos = self._map.pop(key)
+        except KeyError:
+            return
+        items = self._items
+        items[pos] = _DELETED
+        deleted = self._deleted
+        if pos == len(items) - 1:
+            while items and items[-1] is _DELETED:
+                items.pop()
+            if deleted:
+                del deleted[bisect_left(deleted, len(items)):]
+            if self._head > len(items):
+                self._head = len(items)
+        elif pos == self._head:
+            # The last item is never a tombstone. Thus we'll find one.
+            pos += 1
+            while items[pos] is _DELETED:
+                pos += 1
+            self._head = pos
+            if deleted:
+                del deleted[:bisect_left(deleted, pos)]
+        else:
+            insort(deleted, pos)
+        # Tombstones in front of _head count as well. Otherwise removing from
+        # the front while adding to the back (FIFO) would never compact.
+        tombstones = self._head + len(deleted)
+        if tombstones > COMPACT_MIN_DELETED and tombstones > len(self._map) \
+                and not self._iterators:
+            self._compact()
+
+    def _compact(self):
+        '''Removes all tombstones from the array. O(n).'''
+        items = [key for key in islice(self._items, self._head, None) if key is not _DELETED]
+        map = self._map
+        for pos, key in enumerate(items):
+            map[key] = pos
+        self._items = items
+        self._head = 0
+        self._deleted = []
+
+    def _get_pos(self, index):
+        '''Returns the array position of the item at index (0 <= index < len).'''
+        deleted = self._deleted
+        pos = self._head + index
+        if not deleted or pos < deleted[0]:
+            return pos
+        # Find the first position with index + 1 items up to it.
+        low, high = pos, pos + len(deleted)
+        while low < high:
+            middle = (low + high) // 2
+            if middle - bisect_right(deleted, middle) < pos:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def clear(self):
+        self._map.clear()
+        del self._items[:]
+        self._head = 0
+        self._deleted = []
 
     def __iter__(self):
-        KEY = OrderedSet.KEY
-        NEXT = OrderedSet.NEXT
-        end = self.end
-        curr = end[NEXT]
-        while curr is not end:
-            yield curr[KEY]
-            curr = curr[NEXT]
+        self._iterators += 1
+        try:
+            pos = self._head
+            while True:
+                items = self._items
+                if pos >= len(items):
+                    break
+                key = items[pos]
+                pos += 1
+                if key is not _DELETED:
+                    yield key
+        finally:
+            self._iterators -= 1
 
     def __reversed__(self):
-        KEY = OrderedSet.KEY
-        PREV = OrderedSet.PREV
-        end = self.end
-        curr = end[PREV]
-        while curr is not end:
-            yield curr[KEY]
-            curr = curr[PREV]
+        self._iterators += 1
+        try:
+            pos = len(self._items) - 1
+            while True:
+                items = self._items
+                pos = min(pos, len(items) - 1)
+                if pos < self._head:
+                    break
+                key = items[pos]
+                pos -= 1
+                if key is not _DELETED:
+                    yield key
+        finally:
+            self._iterators -= 1
 
     def pop(self, last=True):
-        if not self:
+        if not self._map:
             raise KeyError('set is empty')
-        # key = next(reversed(self)) if last else next(iter(self))
-        if last:
-            try:
-                key = next(reversed(self))
-            except StopIteration:
-                print self
-                print 'Got unexpected StopIteration in pop(). self.map = %s' % self.map
-                raise
-        else:
-            key = next(iter(self))
+        key = self._items[-1] if last else self._items[self._head]
         self.discard(key)
         return key
 
@@ -85,91 +185,59 @@ class OrderedSet(collections.MutableSet):
             return len(self) == len(other) and list(self) == list(other)
         return set(self) == set(other)
 
-    def __del__(self):
-        self.clear()  # remove circular references
-
-    # @time
     def union(self, *iterables):
         oset = OrderedSet(self)
-        # for iterable in iterables:
-        #     oset |= iterable
-        # [oset.__or__(iterable) for iterable in iterables]
-        oset = oset | chain(*iterables)
+        oset.update(chain(*iterables))
         return oset
 
-    def update(self, iterable):
-        self |= iterable
-
     def index(self, value):
-        index = 0
-        for item in self:
-            if item is value:
-                return index
-            index += 1
+        '''Returns the position of value or None if it can't be found.'''
+        pos = self._map.get(value)
+        if pos is None or self._items[pos] is not value:
+            return None
+        return pos - self._head - bisect_left(self._deleted, pos)
 
-    # @time
     def __getitem__(self, index):
-        '''
-        Returns an item of the ordered set.
-        Please keep in mind that this can be slow due to the fact that we have
-        no index and have to skim thru all items of the doubly linked list.
-        If you do this multiple times in a row you might want to create a list
-        from this and continue to work with it instead.
-        '''
-        set = OrderedSet(self)
-        length = len(set.map)
-        # print index, length
+        '''Returns an item of the ordered set. See class description for costs.'''
+        if isinstance(index, slice):
+            return list(self)[index]
+        length = len(self._map)
         if index < 0:
-            index = length + index
+            index += length
         if index >= length or index < 0:
-            # print index, length, self.map
             raise IndexError('set index out of range')
-        iterable = iter(set)
-        curr = next(iterable)
-        for count in xrange(0, index):
-            try:
-                curr = next(iterable)
-            except StopIteration:
-                print set
-                print length, index, count
-                raise
-        return curr
-
-    # @time
+        if index == length - 1:
+            return self._items[-1]
+        return self._items[self._get_pos(index)]
+
     def __getslice__(self, start, stop):
-        '''
-        Returns an iterable slice of the ordered set.
-        Please keep in mind that this can be slow due to the fact that we have
-        no index and have to skim thru all items of the doubly linked list.
-        If you do this multiple times in a row you might want to create a list
-        from this and continue to work with it instead.
-        '''
-        results = []
-        iterable = iter(self)
-        try:
-            for count in xrange(0, stop):
-                curr = next(iterable)
-                if count < start:
-                    continue
-                results.append(curr)
-        except StopIteration:
-            pass
-        return results
+        '''Returns a list with the items of the given range.'''
+        length = len(self._map)
+        start = min(max(start, 0), length)
+        stop = min(max(stop, start), length)
+        if start == stop:
+            return []
+        items = self._items
+        first = self._get_pos(start)
+        if not self._deleted:
+            return items[first:first + stop - start]
+        last = self._get_pos(stop - 1)
+        return [key for key in islice(items, first, last + 1) if key is not _DELETED]
 
     def __delitem__(self, index):
         item = self[index]
         self.remove(item)
 
     def __delslice__(self, start, stop):
-        remove = self.remove
-        [remove(item) for item in self.__getslice__(start, stop)]
+        discard = self.discard
+        # Backwards keeps removing from the end cheap.
+        [discard(item) for item in reversed(self.__getslice__(start, stop))]
 
 
 if __name__ == '__main__':
     print '1', OrderedSet('abracadaba')
     print '2', OrderedSet('simsalabim')
     x = OrderedSet('abracadaba')
-    # doesn't raise "Exception TypeError: TypeError('list indices must be integers, not NoneType',) in ignored"
     print '3', OrderedSet('abracadaba').union(OrderedSet('simsalabim'))
     print '4', OrderedSet('abracadaba') | OrderedSet('simsalabim')
     print '5', OrderedSet('abracadaba'), list(OrderedSet('abracadaba')[2:]), list('abrcd'[2:])
@@ -186,4 +254,10 @@ if __name__ == '__main__':
     o = OrderedSet('abracadaba')
     del o[1:3]
     print '14', o
-## end of http://code.activestate.com/recipes/577624/ }}}
+    o = OrderedSet(xrange(10))
+    for value in xrange(10, 100010):
+        o.pop(last=False)
+        o.add(value)
+    assert list(o) == range(100000, 100010), list(o)
+    assert len(o._items) <= 2 * COMPACT_MIN_DELETED + len(o), len(o._items)
+    print '15', o
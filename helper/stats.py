@@ -0,0 +1,61 @@
+# Rolling statistics over the most recent values of a series.
+#
+# @author    Oktay Acikalin <oktay.acikalin@gmail.com>
+# @copyright Oktay Acikalin
+# @license   MIT (LICENSE.txt)
+
+from collections import deque
+
+
+def percentile(sorted_values, percent):
+    '''Returns the nearest-rank percentile of an already sorted list.'''
+    if not sorted_values:
+        return 0.0
+    index = int(round(percent / 100.0 * (len(sorted_values) - 1)))
+    return sorted_values[max(0, min(len(sorted_values) - 1, index))]
+
+
+class RollingStats(object):
+    '''
+    Keeps the last size values of a series and calculates min, max, average
+    and percentiles over them. Adding values is O(1) and never allocates
+    beyond the window size.
+    '''
+
+    def __init__(self, size=300):
+        super(RollingStats, self).__init__()
+        self.values = deque(maxlen=size)
+        self.count = 0
+        self.last = 0.0
+
+    def __repr__(self):
+        return '<RollingStats(count = %d, window = %d)>' % (self.count, len(self.values))
+
+    def add(self, value):
+        self.values.append(value)
+        self.last = value
+        self.count += 1
+
+    def clear(self):
+        self.values.clear()
+        self.count = 0
+        self.last = 0.0
+
+    def percentile(self, percent):
+        return percentile(sorted(self.values), percent)
+
+    def get_stats(self):
+        values = sorted(self.values)
+        if not values:
+            return dict(count=self.count, last=0.0, min=0.0, max=0.0,
+                        avg=0.0, p50=0.0, p95=0.0, p99=0.0)
+        return dict(
+            count=self.count,
+            last=self.last,
+            min=values[0],
+            max=values[-1],
+            avg=sum(values) / float(len(values)),
+            p50=percentile(values, 50),
+            p95=percentile(values, 95),
+            p99=percentile(values, 99),
+        )
@@ -8,32 +8,119 @@ import weakref
 import new
 
 
+def callable_key(obj):
+    '''
+    Returns a key identifying a callable: (id of function, id of instance)
+    for bound methods and (id of object, None) for everything else. Equals
+    the key of a Wrapper around the same callable.
+    '''
+    if type(obj) is Wrapper:
+        return obj.key
+    inst = getattr(obj, 'im_self', None)
+    if inst is not None:
+        return id(obj.im_func), id(inst)
+    return id(getattr(obj, 'im_func', obj)), None
+
+
+def _get_death_handler(wrapper):
+    # Don't let the weakref callback keep the wrapper alive.
+    wrapper = weakref.ref(wrapper)
+
+    def on_death(ref):
+        wrapper_ = wrapper()
+        if wrapper_ is not None:
+            wrapper_._on_death()
+    return on_death
+
+
 class Wrapper(object):
+    '''
+    Holds a weak reference to an object or the instance of a bound method.
 
-    def __init__(self, obj):
+    Calling the wrapper calls the wrapped function directly with the
+    instance. Thus no bound method has to be built for every call. Caching
+    a bound method instead would keep the instance alive.
+
+    Wrappers are equal if they wrap the same function of the same instance
+    (see callable_key()). Callbacks added via add_death_callback() (or given
+    on creation) are being called with the wrapper as soon as the wrapped
+    object dies.
+    '''
+
+    def __init__(self, obj, callback=None):
         self.is_method = False
         self.has_instance = False
+        self.is_alive = True
+        self._callbacks = [] if callback is None else [callback]
+        self._func = None
+        self._ref = None
+        self.key = callable_key(obj)
         if hasattr(obj, '__call__') and hasattr(obj, 'im_self'):
             inst = obj.im_self
             if inst is not None:
                 try:
-                    obj = obj.im_func, weakref.ref(inst), obj.im_class
+                    self._func = obj.im_func
+                    self._ref = weakref.ref(inst, _get_death_handler(self))
+                    obj = obj.im_func, self._ref, obj.im_class
                 except AttributeError:
-                    obj = weakref.ref(obj)
+                    obj = self._ref = weakref.ref(obj, _get_death_handler(self))
                 else:
                     self.is_method = True
                     self.has_instance = True
             else:
+                # Unbound methods hold no instance. Keep them as they are.
+                self._func = obj
                 obj = obj.im_func, inst, obj.im_class
                 self.is_method = True
         else:
-            obj = weakref.ref(obj)
+            obj = self._ref = weakref.ref(obj, _get_death_handler(self))
         self.obj = obj
 
     def __repr__(self):
         res = self.resolve(raise_error=False)
         return '%s containing %s>' % (super(Wrapper, self).__repr__()[:-1], res)
 
+    def __eq__(self, other):
+        return type(other) is Wrapper and self.key == other.key
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __hash__(self):
+        return hash(self.key)
+
+    def __call__(self, *args, **kwargs):
+        if self.has_instance:
+            inst = self._ref()
+            if inst is None:
+                raise ReferenceError
+            return self._func(inst, *args, **kwargs)
+        if self.is_method:
+            return self._func(*args, **kwargs)
+        obj = self._ref()
+        if obj is None:
+            raise ReferenceError
+        return obj(*args, **kwargs)
+
+    def _on_death(self):
+        self.is_alive = False
+        callbacks, self._callbacks = self._callbacks, []
+        [callback(self) for callback in callbacks]
+
+    def add_death_callback(self, callback):
+        '''Calls callback with this wrapper when the wrapped object dies.'''
+        if self.is_alive:
+            self._callbacks.append(callback)
+        else:
+            callback(self)
+
+    @property
+    def function(self):
+        '''The wrapped function (without instance) or the wrapped object.'''
+        if self.is_method:
+            return self._func
+        return self._ref()
+
     def resolve(self, raise_error=True):
         if self.is_method:
             inst = self.obj[1]
@@ -44,5 +131,3 @@ class Wrapper(object):
             return new.instancemethod(self.obj[0], inst, self.obj[2])
         else:
             return self.obj()
-
-    # TODO implement __eq__ and __ne__ methods
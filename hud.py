@@ -0,0 +1,227 @@
+# Performance overlay showing per-frame timings of the engine subsystems.
+#
+# @author    Oktay Acikalin <oktay.acikalin@gmail.com>
+# @copyright Oktay Acikalin
+# @license   MIT (LICENSE.txt)
+
+import gc
+from collections import deque
+
+from diamond import pyglet
+from diamond import profiler
+from diamond.clock import monotonic
+from diamond.helper.stats import percentile
+
+
+class GcMonitor(object):
+    '''
+    Counts garbage collections per frame. Pauses can only be measured where
+    gc.callbacks exists (Python 3.3+). Elsewhere collections are being
+    detected by watching the allocation counters.
+    '''
+
+    def __init__(self):
+        super(GcMonitor, self).__init__()
+        self.collections = 0
+        self.pause_msecs = 0.0
+        self._start = None
+        self._last_count = gc.get_count()
+        self.can_measure_pauses = hasattr(gc, 'callbacks')
+        if self.can_measure_pauses:
+            gc.callbacks.append(self._on_gc)
+
+    def _on_gc(self, phase, info):
+        if phase == 'start':
+            self._start = monotonic()
+        elif self._start is not None:
+            self.pause_msecs += (monotonic() - self._start) * 1000.0
+            self.collections += 1
+            self._start = None
+
+    def poll(self):
+        '''Call once per frame. Returns (collections, pause msecs) since the last call.'''
+        if not self.can_measure_pauses:
+            # Every collection of a generation increments the counter of the
+            # next older one and resets its own.
+            count = gc.get_count()
+            last = self._last_count
+            if count[1] > last[1]:
+                self.collections += count[1] - last[1]
+            elif count[1] < last[1] or count[2] != last[2]:
+                self.collections += 1
+            self._last_count = count
+        result = self.collections, self.pause_msecs
+        self.collections, self.pause_msecs = 0, 0.0
+        return result
+
+    def close(self):
+        if self.can_measure_pauses:
+            try:
+                gc.callbacks.remove(self._on_gc)
+            except ValueError:
+                pass
+
+
+class Hud(object):
+    '''
+    Draws frame timings, tick times of the bound tickers, event and sector
+    statistics, draw calls, garbage collections and a frame-time graph on
+    top of the window. Needs an enabled profiler (see diamond.profiler).
+
+    Everything gets drawn from one batch of its own. The text is being
+    rebuilt at most every update_msecs and only if it has changed. pyglet
+    keeps the glyphs in a texture atlas, thus the label only rewrites its
+    vertex list then. The graph is one vertex list which gets refreshed
+    together with the text.
+    '''
+
+    def __init__(self, window, update_msecs=250, graph_frames=120, graph_height=50,
+                 font_size=9, target_msecs=1000.0 / 60):
+        super(Hud, self).__init__()
+        self.window = window
+        self.update_msecs = update_msecs
+        self.graph_frames = graph_frames
+        self.graph_height = graph_height
+        self.target_msecs = target_msecs
+        self.frame_times = deque([0.0] * graph_frames, maxlen=graph_frames)
+        self.gc_monitor = GcMonitor()
+        self._gc_collections = deque([0] * graph_frames, maxlen=graph_frames)
+        self._gc_pauses = deque([0.0] * graph_frames, maxlen=graph_frames)
+        self._last_draw = None
+        self._last_update = 0.0
+        self._own_draw_calls = 0
+        self._draw_zone = profiler.get_zone('gl.draw')
+
+        self.batch = batch = pyglet.graphics.Batch()
+        background_group = pyglet.graphics.OrderedGroup(0)
+        graph_group = pyglet.graphics.OrderedGroup(1)
+        text_group = pyglet.graphics.OrderedGroup(2)
+        self.margin = 4
+        self.width = max(graph_frames * 2, 320)
+        self.label = pyglet.text.Label(
+            '', font_size=font_size, multiline=True, width=self.width,
+            anchor_x='left', anchor_y='top', color=(255, 255, 255, 255),
+            batch=batch, group=text_group,
+        )
+        self._background = batch.add(
+            4, pyglet.gl.GL_QUADS, background_group,
+            'v2f/dynamic', ('c4B/static', (0, 0, 0, 180) * 4),
+        )
+        self._graph = batch.add(
+            graph_frames * 4, pyglet.gl.GL_QUADS, graph_group,
+            'v2f/stream', 'c4B/stream',
+        )
+        self._target_line = batch.add(
+            2, pyglet.gl.GL_LINES, graph_group,
+            'v2f/dynamic', ('c4B/static', (255, 255, 0, 160) * 2),
+        )
+
+    def delete(self):
+        self.gc_monitor.close()
+        self.label.delete()
+        self._background.delete()
+        self._graph.delete()
+        self._target_line.delete()
+
+    def _get_text(self):
+        frames = sorted(self.frame_times)
+        get_zone = profiler.zones.get
+        lines = [
+            'frame %.2f ms  p50 %.2f  p95 %.2f  p99 %.2f  max %.2f  (%.0f fps)' % (
+                self.frame_times[-1], percentile(frames, 50), percentile(frames, 95),
+                percentile(frames, 99), frames[-1], pyglet.clock.get_fps()),
+        ]
+        ticks = sorted((name, zone) for name, zone in profiler.zones.items()
+                       if name.startswith('tick '))
+        for name, zone in ticks:
+            lines.append('%s %.2f ms' % (name, zone.last_frame_total))
+        emit = get_zone('event.emit')
+        if emit is not None:
+            lines.append('emit %d calls %.2f ms' % (emit.last_frame_calls, emit.last_frame_total))
+        sectors = get_zone('TileMatrix.update_sectors')
+        lines.append('sectors %d built %.2f ms, %d vertex bytes' % (
+            profiler.get_counter('tilematrix.sectors.built'),
+            sectors.last_frame_total if sectors is not None else 0.0,
+            profiler.get_counter('tilematrix.vertex_bytes')))
+        draw = get_zone('Window.on_draw')
+        lines.append('draw %d calls %.2f ms' % (
+            max(0, self._draw_zone.last_frame_calls - self._own_draw_calls),
+            draw.last_frame_total if draw is not None else 0.0))
+        if self.gc_monitor.can_measure_pauses:
+            lines.append('gc %d collections %.2f ms (max %.2f ms)' % (
+                sum(self._gc_collections), sum(self._gc_pauses), max(self._gc_pauses)))
+        else:
+            lines.append('gc %d collections' % sum(self._gc_collections))
+        return '\n'.join(lines)
+
+    def _update_graph(self, x, y):
+        height = self.graph_height
+        scale = height / (self.target_msecs * 2)
+        target = self.target_msecs
+        vertices = []
+        colors = []
+        for pos, msecs in enumerate(self.frame_times):
+            x1 = x + pos * 2
+            bar = min(height, msecs * scale)
+            vertices.extend((x1, y, x1 + 2, y, x1 + 2, y + bar, x1, y + bar))
+            if msecs > target * 2:
+                color = (255, 60, 60, 220)
+            elif msecs > target:
+                color = (255, 200, 0, 220)
+            else:
+                color = (80, 220, 80, 220)
+            colors.extend(color * 4)
+        self._graph.vertices[:] = vertices
+        self._graph.colors[:] = colors
+        y1 = y + target * scale
+        self._target_line.vertices[:] = (x, y1, x + len(self.frame_times) * 2, y1)
+
+    def _update(self):
+        label = self.label
+        margin = self.margin
+        top = self.window.height - margin
+        text = self._get_text()
+        label.begin_update()
+        if text != label.text:
+            label.text = text
+        if (label.x, label.y) != (margin * 2, top - margin):
+            label.x, label.y = margin * 2, top - margin
+        label.end_update()
+        bottom = top - label.content_height - margin * 3 - self.graph_height
+        self._update_graph(margin * 2, bottom + margin)
+        right = margin * 3 + self.width
+        self._background.vertices[:] = (margin, bottom, right, bottom, right, top, margin, top)
+
+    def draw(self):
+        now = monotonic()
+        if self._last_draw is not None:
+            self.frame_times.append((now - self._last_draw) * 1000.0)
+        self._last_draw = now
+        collections, pause = self.gc_monitor.poll()
+        self._gc_collections.append(collections)
+        self._gc_pauses.append(pause)
+        if (now - self._last_update) * 1000.0 >= self.update_msecs:
+            self._last_update = now
+            self._update()
+
+        # Our window renders into a scaled and letterboxed viewport with the
+        # y-axis pointing down. The HUD uses the plain window coordinates.
+        gl = pyglet.gl
+        window = self.window
+        gl.glViewport(0, 0, window.width, window.height)
+        gl.glMatrixMode(gl.GL_PROJECTION)
+        gl.glPushMatrix()
+        gl.glLoadIdentity()
+        gl.glOrtho(0, window.width, 0, window.height, -1, 1)
+        gl.glMatrixMode(gl.GL_MODELVIEW)
+        gl.glPushMatrix()
+        gl.glLoadIdentity()
+        calls = self._draw_zone.frame_calls
+        with profiler.zone('hud.draw'):
+            self.batch.draw()
+        self._own_draw_calls = self._draw_zone.frame_calls - calls
+        gl.glPopMatrix()
+        gl.glMatrixMode(gl.GL_PROJECTION)
+        gl.glPopMatrix()
+        gl.glMatrixMode(gl.GL_MODELVIEW)
+        gl.glViewport(*window.viewport)
@@ -0,0 +1,207 @@
+# Loads vaults in the background and uploads their textures in slices.
+#
+# @author    Oktay Acikalin <oktay.acikalin@gmail.com>
+# @copyright Oktay Acikalin
+# @license   MIT (LICENSE.txt)
+
+import sys
+from collections import OrderedDict
+from threading import Thread, RLock
+from Queue import Queue, Empty
+
+from diamond import event
+from diamond.array import Array
+from diamond.clock import get_ticks, wait
+from diamond.vault import Vault, cache
+from diamond.helper.logging import log_debug, log_error
+
+
+class LoadJob(object):
+    '''Keeps track of a bunch of vaults requested at once.'''
+
+    def __init__(self, vaults, pin=False):
+        super(LoadJob, self).__init__()
+        self.vaults = OrderedDict.fromkeys(vaults).keys()  # Drop duplicates.
+        self.pin = pin
+        self.instances = dict()
+        self.errors = dict()
+
+    def __repr__(self):
+        return '<LoadJob(loaded = %d, failed = %d, total = %d)>' % (
+            len(self.instances), len(self.errors), self.total)
+
+    total = property(lambda self: len(self.vaults))
+
+    def _get_progress(self):
+        if not self.vaults:
+            return 1.0
+        return (len(self.instances) + len(self.errors)) / float(len(self.vaults))
+
+    progress = property(_get_progress)
+
+    is_done = property(lambda self: len(self.instances) + len(self.errors) >= len(self.vaults))
+
+
+class _DecodeWorker(Thread):
+
+    def __init__(self, requests, results):
+        super(_DecodeWorker, self).__init__()
+        self.daemon = True
+        self.requests = requests
+        self.results = results
+
+    def run(self):
+        while True:
+            vault = self.requests.get()
+            if vault is None:
+                break
+            try:
+                image_data = None
+                if vault.filename is not None:
+                    image_data = Vault.load_image_data(vault)
+            except Exception:
+                self.results.put((vault, None, sys.exc_info()[1]))
+            else:
+                self.results.put((vault, image_data, None))
+
+
+class VaultLoader(object):
+    '''
+    Decodes the images of vaults on worker threads and creates the textures
+    within tick() which has to be called by the thread owning the GL context.
+    Each call of tick() only spends up to upload_msecs for creating textures
+    which keeps the frame rate up while big scenes are being streamed in.
+
+    Bind an instance to your scene or call tick() once per frame. Progress is
+    being reported via the following events:
+    - loader.progress with loader, job, vault, loaded, total and progress
+    - loader.error with loader, job, vault and error
+    - loader.done with loader and job
+    '''
+
+    def __init__(self, workers=2, upload_msecs=4):
+        super(VaultLoader, self).__init__()
+        self.upload_msecs = upload_msecs
+        self.lock = RLock()
+        self._requests = Queue()
+        self._results = Queue()
+        self._jobs = []
+        self._pending = dict()  # vault module -> list of jobs
+        self._is_paused = False
+        self._workers = [_DecodeWorker(self._requests, self._results)
+                         for count in xrange(max(1, workers))]
+        [worker.start() for worker in self._workers]
+
+    def __repr__(self):
+        return '<VaultLoader(jobs = %d, pending = %d)>' % (len(self._jobs), len(self._pending))
+
+    def load(self, vaults, pin=False):
+        '''
+        Requests loading of the given vault modules and returns a LoadJob.
+        Vaults already being in the vault cache are done on the next tick.
+        '''
+        job = LoadJob(vaults, pin)
+        with self.lock:
+            self._jobs.append(job)
+            for vault in job.vaults:
+                if vault in self._pending:
+                    self._pending[vault].append(job)
+                    continue
+                self._pending[vault] = [job]
+                if vault in cache:
+                    self._results.put((vault, None, None))
+                else:
+                    self._requests.put(vault)
+        log_debug('Requested loading of %d vaults.' % job.total)
+        return job
+
+    def is_busy(self):
+        return bool(self._jobs)
+
+    def pause(self):
+        self._is_paused = True
+
+    def unpause(self):
+        self._is_paused = False
+
+    def _finish(self, vault, instance, error):
+        with self.lock:
+            jobs = self._pending.pop(vault, [])
+        for job in jobs:
+            if error is not None:
+                job.errors[vault] = error
+                log_error('Could not load vault %s: %s' % (vault, error))
+                event.emit('loader.error', Array(
+                    loader=self, job=job, vault=vault, error=error,
+                ))
+            else:
+                if job.pin:
+                    cache.pin(vault)
+                job.instances[vault] = instance
+                event.emit('loader.progress', Array(
+                    loader=self, job=job, vault=vault,
+                    loaded=len(job.instances), total=job.total,
+                    progress=job.progress,
+                ))
+
+    def tick(self):
+        if self._is_paused or (not self._jobs and self._results.empty()):
+            return
+        deadline = get_ticks() + self.upload_msecs
+        while True:
+            try:
+                vault, image_data, error = self._results.get_nowait()
+            except Empty:
+                break
+            instance = None
+            if error is None:
+                try:
+                    instance = cache.get(vault, lambda vault: Vault(vault, image_data))
+                except Exception:
+                    error = sys.exc_info()[1]
+            self._finish(vault, instance, error)
+            if get_ticks() >= deadline:
+                break
+        done = [job for job in self._jobs if job.is_done]
+        if done:
+            with self.lock:
+                self._jobs = [job for job in self._jobs if not job.is_done]
+            for job in done:
+                event.emit('loader.done', Array(loader=self, job=job))
+
+    def flush(self):
+        '''Blocks until all jobs are done. Has to be called from the GL thread.'''
+        upload_msecs, is_paused = self.upload_msecs, self._is_paused
+        self.upload_msecs, self._is_paused = float('inf'), False
+        try:
+            while self._jobs:
+                self.tick()
+                if self._jobs:
+                    wait(1)
+        finally:
+            self.upload_msecs, self._is_paused = upload_msecs, is_paused
+
+    def cancel(self, job):
+        '''
+        Forgets about the given job and unpins the vaults it pinned already.
+        Pending decodes still land in the cache.
+        '''
+        with self.lock:
+            if job in self._jobs:
+                self._jobs.remove(job)
+            for vault in job.vaults:
+                jobs = self._pending.get(vault)
+                if jobs is not None and job in jobs:
+                    jobs.remove(job)
+        if job.pin:
+            [cache.unpin(vault) for vault in job.instances]
+
+    def clear(self):
+        '''Forgets about all jobs. Pending decodes still land in the cache.'''
+        with self.lock:
+            del self._jobs[:]
+
+    def join(self):
+        self.clear()
+        [self._requests.put(None) for worker in self._workers]
+        [worker.join() for worker in self._workers]
@@ -7,6 +7,7 @@
 import os
 import ConfigParser
 import csv
+from threading import RLock
 
 from diamond import event
 from diamond.decorators import time
@@ -24,6 +25,7 @@ class Matrix(object):
         self._sector_size = 10, 10  # Is being filled from config file.
         self._data_path = None
         self._sectors_loaded = set()
+        self._lock = RLock()  # Sectors may get loaded by worker threads.
 
     def _set_default_value(self, value):
         assert type(value) is dict or value is None
@@ -36,7 +38,8 @@ class Matrix(object):
             raise Exception('Cannot change sector size after setting a data path.')
         self._sector_size = max(1, width), max(1, height)
 
-    sector_size = property(lambda self: self._sector_size, _set_sector_size)
+    sector_size = property(lambda self: self._sector_size,
+                           lambda self, size: self._set_sector_size(*size))
 
     def _set_data_path(self, path):
         self._data_path = path
@@ -70,12 +73,12 @@ class Matrix(object):
             return
         s_w, s_h = self._sector_size
         sectors = dict((tuple(map(int, id.split(','))), []) for id in self._sectors_loaded)
-        for (x, y), data in self._matrix.iteritems():
-            # print (x, y), data
-            s_x = x // s_w
-            s_y = y // s_h
-            # print s_x, s_y
-            for z, id in data.iteritems():
+        for z, matrix in self._matrix.iteritems():
+            for (x, y), id in matrix.iteritems():
+                # print (x, y, z), id
+                s_x = x // s_w
+                s_y = y // s_h
+                # print s_x, s_y
                 point = (x - s_w * s_x, y - s_h * s_y, z, id)
                 try:
                     sectors[(s_x, s_y)].append(point)
@@ -101,7 +104,12 @@ class Matrix(object):
         id = '%d,%d' % (s_x, s_y)
         if id in self._sectors_loaded:
             return
-        self._sectors_loaded.add(id)
+        with self._lock:
+            if id not in self._sectors_loaded:
+                self._load_sector(s_x, s_y, id)
+                self._sectors_loaded.add(id)
+
+    def _load_sector(self, s_x, s_y, id):
         # If possible try loading data from disk.
         if self._data_path:
             filename = os.path.join(self._data_path, 's.%s.csv' % id)
@@ -162,6 +170,32 @@ class Matrix(object):
         s_y = y // s_h
         self._ensure_sector_loaded(s_x, s_y)
         self._set_point(x, y, z, data)
+        event.emit('matrix.point.changed', dict(matrix=self, x=x, y=y, z=z, data=data))
+
+    def get_sector_points(self, s_x, s_y, layers=None):
+        '''
+        Returns a list of (x, y, z, data) of all points within the sector
+        on the given layers (default: all layers). Loads the sector if
+        necessary.
+        '''
+        self._ensure_sector_loaded(s_x, s_y)
+        s_w, s_h = self._sector_size
+        x1, y1 = s_x * s_w, s_y * s_h
+        coords = [(x, y) for y in xrange(y1, y1 + s_h) for x in xrange(x1, x1 + s_w)]
+        matrix = self._matrix
+        if layers is None:
+            layers = matrix.keys()
+        points = []
+        for z in layers:
+            layer = matrix.get(z)
+            if not layer:
+                continue
+            if len(layer) < len(coords):
+                points.extend((x, y, z, data) for (x, y), data in layer.items()
+                              if x1 <= x < x1 + s_w and y1 <= y < y1 + s_h)
+            else:
+                points.extend((x, y, z, layer[x, y]) for x, y in coords if (x, y) in layer)
+        return points
 
     # @time
     def _get_rect(self, coords):
@@ -4,9 +4,14 @@
 # @copyright Oktay Acikalin
 # @license   MIT (LICENSE.txt)
 
+import weakref
+from itertools import count
+from threading import Lock
+
 from diamond import pyglet
 from diamond import event
 from diamond.decorators import time
+from diamond.spatial import SpatialHash
 
 
 class ClipGroup(pyglet.graphics.OrderedGroup):
@@ -26,12 +31,38 @@ class ClipGroup(pyglet.graphics.OrderedGroup):
         pyglet.gl.glDisable(pyglet.gl.GL_SCISSOR_TEST)
 
 
+# Tie breaker for groups sharing the same order. Keeps them in creation order.
+_group_sequence = count()
+
+
 class PositionalGroup(pyglet.graphics.OrderedGroup):
-    """Sprite group that also moves the children to some specific offset."""
+    """
+    Sprite group that also moves the children to some specific offset.
+
+    The batch sorts groups per parent only. Thus order is relative to the
+    siblings and the draw order of a tree follows from the tree itself, no
+    matter how deep it is. Groups are equal only to themselves. Siblings
+    with the same order therefore don't get merged and changing order or
+    parent doesn't change the hash of a group already known to the batch.
+    """
 
     def __init__(self, order=0, parent=None):
         super(PositionalGroup, self).__init__(order=order, parent=parent)
         self.x, self.y = 0, 0
+        self._sequence = next(_group_sequence)
+
+    def __lt__(self, other):
+        if isinstance(other, pyglet.graphics.OrderedGroup):
+            return (self.order, self._sequence) < (other.order, getattr(other, '_sequence', -1))
+        return NotImplemented
+
+    def __eq__(self, other):
+        return self is other
+
+    def __ne__(self, other):
+        return self is not other
+
+    __hash__ = object.__hash__
 
     def set_state(self):
         pyglet.gl.glTranslated(self.x, self.y, 0)
@@ -40,6 +71,73 @@ class PositionalGroup(pyglet.graphics.OrderedGroup):
         pyglet.gl.glTranslated(-self.x, -self.y, 0)
 
 
+# Nodes whose visibility changed since the last call of resolve_updates().
+_dirty_nodes = set()
+# Static nodes whose subtree changed since the last call of resolve_updates().
+_dirty_static_nodes = set()
+_dirty_lock = Lock()
+# Amount of static nodes. Lets the common case skip looking for them.
+_static_count = 0
+# Amount of nodes with a spatial index. Same as above.
+_spatial_count = 0
+
+
+# Weak refs of detached nodes whose groups are still known to a batch.
+_detached_refs = set()
+
+
+def _forget_groups(batch, group):
+    '''Removes group and all groups below it from the batch.'''
+    pending = [group]
+    while pending:
+        group = pending.pop()
+        batch.group_map.pop(group, None)
+        pending.extend(batch.group_children.pop(group, ()))
+
+
+def _get_detached_handler(batch, group):
+    # The batch can't reach detached groups and thus never drops them itself.
+    def on_death(ref):
+        _detached_refs.discard(ref)
+        if group.parent is None:
+            _forget_groups(batch, group)
+    return on_death
+
+
+def _get_depth(node):
+    depth = 0
+    node = node._parent_node
+    while node is not None:
+        depth += 1
+        node = node._parent_node
+    return depth
+
+
+def resolve_updates():
+    '''
+    Propagates all pending visibility changes through the tree. Window calls
+    this once right before drawing. Only subtrees whose effective visibility
+    really changed are being touched. Thus hiding and showing a node several
+    times within one frame costs next to nothing. Static subtrees which
+    changed get baked again (see Node.static). Returns the number of nodes
+    updated or baked.
+    '''
+    global _dirty_nodes, _dirty_static_nodes
+    with _dirty_lock:
+        if not _dirty_nodes and not _dirty_static_nodes:
+            return 0
+        nodes, _dirty_nodes = _dirty_nodes, set()
+        static_nodes, _dirty_static_nodes = _dirty_static_nodes, set()
+    count = 0
+    # Parents first. Their propagation already covers dirty children.
+    for node in sorted(nodes, key=_get_depth):
+        if node._visibility_dirty:
+            count += node._resolve_inherited_visibility()
+    for node in static_nodes:
+        count += node._bake_static()
+    return count
+
+
 class Node(object):
 
     def __init__(self, name=None):
@@ -55,6 +153,10 @@ class Node(object):
         self._parent_node = None
         self._visible = True
         self._inherited_visibility = True
+        self._visibility_dirty = False
+        self._static = False
+        self._spatial_index = None
+        self._detached_ref = None
 
     def __repr__(self):
         pos = '%d,%d' % (self._x, self._y)
@@ -77,6 +179,12 @@ class Node(object):
     def _update_real_position(self):
         self._group.x = self._x
         self._group.y = self._y
+        if _static_count:
+            root = self._get_static_root()
+            if root is not None and root is not self:
+                root._mark_static_dirty()
+        if _spatial_count and self._spatial_index is None and self._get_spatial() is not None:
+            self._update_spatial()
     #     try:
     #         self._x_real = self._parent_node._x_real + self._x
     #         self._y_real = self._parent_node._y_real + self._y
@@ -123,11 +231,56 @@ class Node(object):
         self._y += r_y
         self._update_real_position()
 
+    def _get_batch(self):
+        try:
+            return self._window._batch
+        except AttributeError:
+            return None
+
     # @time
     def _update_group_order(self):
-        self._group.order = int('%s%05d' % (self._parent_node._order_id, self._order_id))
-        # self._group.order = self._order_id
-        # print self, self._group.order
+        group = self._group
+        if group.order != self._order_id:
+            group.order = self._order_id
+            batch = self._get_batch()
+            if batch is not None and group in batch.group_map:
+                # The batch sorts the siblings again on its next draw.
+                batch.invalidate()
+
+    # @time
+    def _set_group_parent(self, parent):
+        '''Moves the group of this node (and thus its subtree) below parent.'''
+        group = self._group
+        if group.parent is parent:
+            return
+        if self._detached_ref is not None:
+            _detached_refs.discard(self._detached_ref)
+            self._detached_ref = None
+        batch = self._get_batch()
+        if batch is None or group not in batch.group_map:
+            group.parent = parent
+            return
+        # The batch only learns about groups on their first use. Thus move
+        # the group over to its new parent ourselves.
+        if group.parent is None:
+            siblings = batch.top_groups
+        else:
+            siblings = batch.group_children.get(group.parent, [])
+        if group in siblings:
+            siblings.remove(group)
+        group.parent = parent
+        if parent is not None:
+            if parent not in batch.group_map:
+                batch._add_group(parent)
+            batch.group_children.setdefault(parent, []).append(group)
+        else:
+            # Detached subtrees don't get drawn until being added again. Keep
+            # their groups (and the vertex lists within) for that but drop
+            # them as soon as the node is gone.
+            self._detached_ref = weakref.ref(self, _get_detached_handler(batch, group))
+            _detached_refs.add(self._detached_ref)
+        # Only flags the draw list. It gets rebuilt once on the next draw.
+        batch.invalidate()
 
     # @time
     def _set_order_id(self, id):
@@ -138,19 +291,187 @@ class Node(object):
     order_id = property(lambda self: self._order_id, _set_order_id)
 
     def _update_inherited_visibility(self):
-        try:
-            self._inherited_visibility = self._visible and self._parent_node._inherited_visibility
-        except AttributeError:
-            self._inherited_visibility = self._visible
+        '''Marks the visibility as dirty. See resolve_updates().'''
+        if not self._visibility_dirty:
+            self._visibility_dirty = True
+            with _dirty_lock:
+                _dirty_nodes.add(self)
+
+    def _resolve_inherited_visibility(self):
+        self._visibility_dirty = False
+        parent = self._parent_node
+        if parent is None:
+            visibility = self._visible
+        else:
+            visibility = self._visible and parent._inherited_visibility
+        if visibility == self._inherited_visibility:
+            return 0
+        self._inherited_visibility = visibility
+        self._on_inherited_visibility_changed()
         [sprite._update_inherited_visibility() for sprite in self._child_sprites]
-        [node._update_inherited_visibility() for node in self._child_nodes]
+        return 1 + sum(node._resolve_inherited_visibility() for node in self._child_nodes)
+
+    def _on_inherited_visibility_changed(self):
+        '''Called after the effective visibility of this node changed.'''
+        pass
 
     def _set_visible(self, visible):
-        self._visible = visible
-        self._update_inherited_visibility()
+        if visible != self._visible:
+            self._visible = visible
+            self._update_inherited_visibility()
 
     visible = property(lambda self: self._visible, _set_visible)
 
+    def _get_static_root(self):
+        '''Returns the outermost static node containing this node (or None).'''
+        root = None
+        node = self
+        while node is not None:
+            if node._static:
+                root = node
+            node = node._parent_node
+        return root
+
+    def _mark_static_dirty(self):
+        with _dirty_lock:
+            _dirty_static_nodes.add(self)
+
+    def _invalidate_static(self):
+        '''Lets the static node containing this node bake its subtree again.'''
+        if _static_count:
+            root = self._get_static_root()
+            if root is not None:
+                root._mark_static_dirty()
+
+    def _bake_static(self):
+        '''
+        Moves all sprites of the subtree into the group of this node and
+        lets them add the offset of their node to their vertices.
+        '''
+        if not self._static or self._get_static_root() is not self:
+            return 0
+        group = self._group
+        stack = [(self, 0, 0)]
+        while stack:
+            node, x, y = stack.pop()
+            for sprite in node._child_sprites:
+                sprite._set_static_offset(group, x, y)
+            stack.extend((child, x + child._x, y + child._y) for child in node._child_nodes)
+        return 1
+
+    def _unbake_static(self):
+        '''Puts all sprites of the subtree back into the groups of their nodes.'''
+        stack = [self]
+        while stack:
+            node = stack.pop()
+            for sprite in node._child_sprites:
+                sprite._set_static_offset(node._group, 0, 0)
+            stack.extend(node._child_nodes)
+
+    def _set_static(self, static):
+        global _static_count
+        static = bool(static)
+        if static == self._static:
+            return
+        self._static = static
+        if static:
+            _static_count += 1
+        else:
+            _static_count -= 1
+            with _dirty_lock:
+                _dirty_static_nodes.discard(self)
+            self._unbake_static()
+        # Might as well be part of another static subtree.
+        self._invalidate_static()
+
+    static = property(lambda self: self._static, _set_static, doc='''
+        Marks the subtree as static. Its sprites get drawn within the group
+        of this node with their absolute offsets baked into their vertices.
+        Thus a deep tree costs one translation instead of two per node and
+        sprites of the same texture end up in the same batch state. Moving
+        the static node itself is as cheap as before. Adding, removing or
+        moving anything below bakes the subtree again on the next frame.
+        Draw order within a static subtree is only kept per texture. Only
+        sprites get baked - other drawables stay within their node.
+        ''')
+
+    def _get_spatial(self):
+        '''
+        Returns the nearest spatial index containing this node and the
+        offset of this node within it. Or None if there is none.
+        '''
+        x, y = 0, 0
+        node = self
+        while node is not None:
+            if node._spatial_index is not None:
+                return node._spatial_index, x, y
+            x += node._x
+            y += node._y
+            node = node._parent_node
+        return None
+
+    def _update_spatial(self, sprites=None):
+        '''Registers the sprites of the subtree (or only sprites) with their index.'''
+        spatial = self._get_spatial()
+        if sprites is not None:
+            [sprite._set_spatial(spatial) for sprite in sprites]
+            return
+        if spatial is None:
+            index, x, y = None, 0, 0
+        else:
+            index, x, y = spatial
+        stack = [(self, x, y)]
+        while stack:
+            node, x, y = stack.pop()
+            spatial = None if index is None else (index, x, y)
+            for sprite in node._child_sprites:
+                sprite._set_spatial(spatial)
+            # Nodes with an index of their own keep their sprites.
+            stack.extend((child, x + child._x, y + child._y) for child in node._child_nodes
+                         if child._spatial_index is None)
+
+    def enable_spatial_index(self, cell_size=64):
+        '''
+        Keeps all (visible) sprites of the subtree within a spatial index
+        which is being updated as sprites and nodes move, show, hide, come
+        and go. Subtrees with an index of their own are not part of it.
+        Allows for the query_* methods. Returns the index.
+        '''
+        global _spatial_count
+        if self._spatial_index is None:
+            _spatial_count += 1
+        self._spatial_index = SpatialHash(cell_size)
+        self._update_spatial()
+        return self._spatial_index
+
+    def disable_spatial_index(self):
+        global _spatial_count
+        if self._spatial_index is None:
+            return
+        _spatial_count -= 1
+        self._spatial_index = None
+        # Sprites now belong to an index further up (if any).
+        self._update_spatial()
+
+    spatial_index = property(lambda self: self._spatial_index)
+
+    def _get_index(self):
+        if self._spatial_index is None:
+            raise Exception('Spatial index of node not enabled: %s' % self)
+        return self._spatial_index
+
+    def query_point(self, x, y):
+        '''Returns the visible sprites at the point (relative to this node).'''
+        return self._get_index().query_point(x, y)
+
+    def query_rect(self, x, y, w, h):
+        '''Returns the visible sprites touching the rect (relative to this node).'''
+        return self._get_index().query_rect(x, y, w, h)
+
+    def query_radius(self, x, y, radius):
+        '''Returns the visible sprites touching the circle (relative to this node).'''
+        return self._get_index().query_radius(x, y, radius)
+
     def hide(self):
         if self._visible:
             self._set_visible(False)
@@ -185,10 +506,11 @@ class Node(object):
         # print 'ORDER ID =', node.order_id
         if node.order_id is None:
             node.order_id = len(self._child_nodes)
-        node._group.parent = self._group
+        node._set_group_parent(self._group)
         node._update_inherited_visibility()
         node._update_real_position()
         node._update_group_order()
+        self._invalidate_static()
 
     # @time
     def add_nodes(self, nodes):
@@ -202,10 +524,11 @@ class Node(object):
             if node.order_id is None:
                 node.order_id = order_id
             order_id += 1
-            node._group.parent = self._group
+            node._set_group_parent(self._group)
             node._update_inherited_visibility()
             node._update_real_position()
             node._update_group_order()
+        self._invalidate_static()
 
     # @time
     def add_sprite(self, sprite):
@@ -221,6 +544,9 @@ class Node(object):
         sprite._parent_node = self
         # sprite._update_real_position()
         sprite._update_inherited_visibility()
+        self._invalidate_static()
+        if _spatial_count:
+            self._update_spatial([sprite])
 
     # @time
     def add_sprites(self, sprites):
@@ -236,6 +562,9 @@ class Node(object):
             # sprite._update_real_position()
             sprite._update_inherited_visibility()
         self._child_sprites.extend(sprites)
+        self._invalidate_static()
+        if _spatial_count:
+            self._update_spatial(sprites)
 
     def add_to(self, node):
         node.add_node(self)
@@ -245,6 +574,8 @@ class Node(object):
             node.remove_all()
         for sprite in self._child_sprites:
             sprite._parent_node = None
+            sprite._static_offset = (0, 0)
+            sprite._set_spatial(None)
             sprite.group = None
             sprite.batch = None            
         del self._child_sprites[:]
@@ -255,11 +586,18 @@ class Node(object):
 
     def remove_node(self, node):
         self._child_nodes.remove(node)
+        if _static_count and self._get_static_root() is not None:
+            node._unbake_static()
+            self._invalidate_static()
         node._parent_node = None
-        node._group.parent = None
+        node._set_group_parent(None)
+        if _spatial_count and node._spatial_index is None:
+            node._update_spatial()
 
     def remove_sprite(self, sprite):
         self._child_sprites.remove(sprite)
         sprite._parent_node = None
+        sprite._static_offset = (0, 0)
+        sprite._set_spatial(None)
         sprite.group = None
         sprite.batch = None
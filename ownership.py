@@ -0,0 +1,150 @@
+# Keeps track of listeners and ticks per owner (e.g. a scene).
+#
+# @author    Oktay Acikalin <oktay.acikalin@gmail.com>
+# @copyright Oktay Acikalin
+# @license   MIT (LICENSE.txt)
+
+import weakref
+from threading import RLock
+
+
+_lock = RLock()
+_records = dict()  # id of owner -> Record
+
+
+class Record(object):
+
+    __slots__ = ('name', 'ref', 'listeners', 'ticks')
+
+    def __init__(self, owner):
+        self.name = repr(owner)
+        try:
+            self.ref = weakref.ref(owner)
+        except TypeError:
+            self.ref = lambda: owner
+        self.listeners = set()
+        self.ticks = dict()  # ticker -> set of ticks
+
+    def __repr__(self):
+        return '<Record(%s, listeners = %d, ticks = %d)>' % (
+            self.name, len(self.listeners), sum(len(ticks) for ticks in self.ticks.itervalues()))
+
+    def is_empty(self):
+        return not self.listeners and not self.ticks
+
+
+def _get_record(owner):
+    key = id(owner)
+    record = _records.get(key)
+    if record is None or record.ref() is not owner:
+        # Unknown owner or a dead one whose id got reused.
+        record = _records[key] = Record(owner)
+    return key, record
+
+
+def add_listener(owner, listener):
+    '''Tags an event.Listener as being owned by owner.'''
+    with _lock:
+        key, record = _get_record(owner)
+        record.listeners.add(listener)
+        listener.owner = key
+
+
+def remove_listener(listener):
+    '''Forgets the owner of an event.Listener. Called when it gets removed.'''
+    with _lock:
+        key = listener.owner
+        listener.owner = None
+        record = _records.get(key)
+        if record is not None:
+            record.listeners.discard(listener)
+            if record.is_empty():
+                del _records[key]
+
+
+def add_tick(owner, ticker, tick):
+    '''Tags a tick of ticker as being owned by owner.'''
+    with _lock:
+        key, record = _get_record(owner)
+        try:
+            record.ticks[ticker].add(tick)
+        except KeyError:
+            record.ticks[ticker] = set([tick])
+        tick.user_data['owner'] = key
+
+
+def remove_tick(ticker, tick):
+    '''Forgets the owner of a tick. Called when it gets removed from ticker.'''
+    with _lock:
+        key = tick.user_data.pop('owner', None)
+        record = _records.get(key)
+        if record is None:
+            return
+        ticks = record.ticks.get(ticker)
+        if ticks is not None:
+            ticks.discard(tick)
+            if not ticks:
+                del record.ticks[ticker]
+        if record.is_empty():
+            del _records[key]
+
+
+def get_ticks(owner, ticker):
+    '''Returns a list of the ticks of ticker owned by owner.'''
+    with _lock:
+        record = _records.get(id(owner))
+        if record is None or record.ref() is not owner:
+            return []
+        return list(record.ticks.get(ticker, ()))
+
+
+def claim(owner, *candidates):
+    '''
+    Tags already existing listeners (or their handles as returned by
+    event.add_listener) as being owned by owner. Scene.bind() does this.
+    '''
+    from diamond import event
+    for candidate in candidates:
+        listener = event.get_listener(candidate)
+        if listener is not None and listener.owner is None:
+            add_listener(owner, listener)
+
+
+def release(owner):
+    '''
+    Removes all listeners and ticks of owner. Costs are proportional to the
+    amount of owned things only. Returns the number of things removed.
+    '''
+    from diamond import event
+    with _lock:
+        record = _records.pop(id(owner), None)
+    if record is None:
+        return 0
+    count = len(record.listeners)
+    event.remove_listeners(list(record.listeners))
+    for ticker, ticks in record.ticks.items():
+        count += len(ticks)
+        ticker.remove_many(list(ticks))
+    return count
+
+
+def get_report():
+    '''
+    Returns a dict of owner name -> dict(listeners=[...], ticks=[...]) of
+    all owners still holding something. Owners which have been released
+    hold nothing. Thus this lists the stragglers.
+    '''
+    with _lock:
+        records = _records.values()
+    report = dict()
+    for record in records:
+        if record.is_empty():
+            continue
+        name = record.name
+        if record.ref() is None:
+            name += ' (dead)'
+        report[name] = dict(
+            listeners=list(record.listeners),
+            ticks=[tick for ticks in record.ticks.values() for tick in ticks],
+        )
+    return report
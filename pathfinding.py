@@ -0,0 +1,475 @@
+# Finds paths on the passability data of a matrix in the background.
+#
+# @author    Oktay Acikalin <oktay.acikalin@gmail.com>
+# @copyright Oktay Acikalin
+# @license   MIT (LICENSE.txt)
+
+import sys
+from heapq import heappush, heappop
+from threading import Thread, RLock
+from Queue import Queue, Empty
+
+from diamond import event
+from diamond.array import Array
+from diamond.helper.logging import log_error
+
+
+DIAGONAL_COST = 1.4142135623730951
+
+NEIGHBOURS = (
+    (1, 0, 1.0), (-1, 0, 1.0), (0, 1, 1.0), (0, -1, 1.0),
+    (1, 1, DIAGONAL_COST), (-1, 1, DIAGONAL_COST),
+    (1, -1, DIAGONAL_COST), (-1, -1, DIAGONAL_COST),
+)
+
+# Entrances longer than this get a transition at both ends instead of one
+# in the middle. Keeps paths along wide openings straight.
+WIDE_ENTRANCE = 6
+
+
+def octile(a, b):
+    d_x, d_y = abs(a[0] - b[0]), abs(a[1] - b[1])
+    return max(d_x, d_y) + (DIAGONAL_COST - 1) * min(d_x, d_y)
+
+
+def _get_path(parents, node):
+    path = []
+    while node is not None:
+        path.append(node)
+        node = parents[node]
+    path.reverse()
+    return path
+
+
+class PathRequest(object):
+    '''A path asked for via Pathfinder.find_path(). See Pathfinder.'''
+
+    def __init__(self, start, goal, user_data):
+        super(PathRequest, self).__init__()
+        self.start = tuple(start)
+        self.goal = tuple(goal)
+        self.user_data = user_data
+        self.path = None
+        self.error = None
+        self.is_cancelled = False
+
+    def __repr__(self):
+        return '<PathRequest(%s -> %s, length = %s)>' % (
+            self.start, self.goal, None if self.path is None else len(self.path))
+
+    def cancel(self):
+        '''The result of a cancelled request won't be delivered.'''
+        self.is_cancelled = True
+
+
+class _PathWorker(Thread):
+
+    def __init__(self, pathfinder, requests, results):
+        super(_PathWorker, self).__init__()
+        self.daemon = True
+        self.pathfinder = pathfinder
+        self.requests = requests
+        self.results = results
+
+    def run(self):
+        get_path = self.pathfinder.get_path
+        while True:
+            request = self.requests.get()
+            if request is None:
+                break
+            if not request.is_cancelled:
+                try:
+                    request.path = get_path(request.start, request.goal)
+                except Exception:
+                    request.error = sys.exc_info()[1]
+            self.results.put(request)
+
+
+class Pathfinder(object):
+    '''
+    Finds paths between tiles on the solid tiles of a CollisionGrid (see
+    TileMatrix.get_collision_grid) which extracts the passability layers of
+    a Matrix into one bitmap per sector. Tiles outside of the boundaries of
+    the matrix are solid. Paths go in 8 directions without cutting corners.
+
+    Long paths are being searched hierarchically (HPA*): neighbouring
+    sectors get connected via transitions along the open parts of their
+    border (cached per pair of sectors). Transitions of a sector get
+    connected via searches within the sector whose paths are being cached
+    as segments. A search then only walks from transition to transition and
+    glues the cached segments together. Paths within one sector or between
+    neighbouring sectors are being searched directly. Results are near
+    optimal. Changes of the matrix drop the data of the sectors affected.
+
+    find_path() hands the search over to a pool of worker threads. Call
+    tick() once per frame (or bind it to your scene) for getting the results
+    delivered as events:
+    - pathfinding.result with pathfinder, request and path (None if there
+      is no path).
+    get_path() searches right away on the calling thread.
+
+    Set close_grid for closing the grid on join().
+    '''
+
+    def __init__(self, grid, workers=2, close_grid=False):
+        super(Pathfinder, self).__init__()
+        self.grid = grid
+        self.close_grid = close_grid
+        self.lock = RLock()
+        self._entrances = dict()  # (sector, sector) -> list of (tile, tile)
+        self._sectors = dict()  # sector -> dict of tile -> dict of tile -> (cost, segment)
+        self._generations = dict()  # sector -> amount of invalidations
+        self._clears = 0
+        self._requests = Queue()
+        self._results = Queue()
+        self._pending = 0
+        self._listener = event.add_listener(self._on_matrix_point_changed, 'matrix.point.changed')
+        self._workers = [_PathWorker(self, self._requests, self._results)
+                         for count in xrange(max(1, workers))]
+        [worker.start() for worker in self._workers]
+
+    def __repr__(self):
+        return '<Pathfinder(sectors = %d, pending = %d)>' % (len(self._sectors), self._pending)
+
+    def _on_matrix_point_changed(self, context):
+        grid = self.grid
+        if context['matrix'] is grid.matrix and context['z'] in grid.layers:
+            s_w, s_h = grid.matrix.sector_size
+            self.invalidate_sector(context['x'] // s_w, context['y'] // s_h)
+
+    def invalidate_sector(self, s_x, s_y):
+        '''Drops everything known about sector (s_x, s_y) and the transitions into it.'''
+        sector = s_x, s_y
+        self.grid.invalidate_sector(s_x, s_y)
+        with self.lock:
+            self._generations[sector] = self._generations.get(sector, 0) + 1
+            for other in ((s_x - 1, s_y), (s_x + 1, s_y), (s_x, s_y - 1), (s_x, s_y + 1)):
+                self._entrances.pop((min(sector, other), max(sector, other)), None)
+                self._sectors.pop(other, None)
+            self._sectors.pop(sector, None)
+
+    def clear(self):
+        with self.lock:
+            self._clears += 1
+            self._entrances.clear()
+            self._sectors.clear()
+
+    # Tiles.
+
+    def _get_sector_of(self, tile):
+        s_w, s_h = self.grid.matrix.sector_size
+        return tile[0] // s_w, tile[1] // s_h
+
+    def _get_passable(self, x1, y1, x2, y2):
+        '''Returns passable(x, y) for tiles within the rect (including x2 and y2).'''
+        left, top, right, bottom = self.grid.matrix.boundaries
+        x1, y1, x2, y2 = max(x1, left), max(y1, top), min(x2, right), min(y2, bottom)
+        grid = self.grid
+        s_w, s_h = grid.matrix.sector_size
+        get_sector = grid._get_sector
+        sectors = dict()
+
+        def passable(x, y):
+            if x < x1 or x > x2 or y < y1 or y > y2:
+                return False
+            s_x, s_y = x // s_w, y // s_h
+            try:
+                rows = sectors[s_x, s_y]
+            except KeyError:
+                rows = sectors[s_x, s_y] = get_sector(s_x, s_y)
+            return not rows[y - s_y * s_h] >> (x - s_x * s_w) & 1
+        return passable
+
+    def _get_sector_passable(self, sector):
+        s_w, s_h = self.grid.matrix.sector_size
+        x, y = sector[0] * s_w, sector[1] * s_h
+        return self._get_passable(x, y, x + s_w - 1, y + s_h - 1)
+
+    def _get_neighbours(self, x1, y1, x2, y2):
+        '''
+        Returns neighbours(tile) -> list of (tile, cost) for passable tiles
+        within the rect (including x2 and y2). Reads the sector bitmaps while
+        searching. Thus only the tiles actually visited cost anything.
+        '''
+        passable = self._get_passable(x1, y1, x2, y2)
+        cache = dict()
+
+        def neighbours(tile):
+            try:
+                return cache[tile]
+            except KeyError:
+                pass
+            x, y = tile
+            right, left = passable(x + 1, y), passable(x - 1, y)
+            down, up = passable(x, y + 1), passable(x, y - 1)
+            result = []
+            if right:
+                result.append(((x + 1, y), 1.0))
+            if left:
+                result.append(((x - 1, y), 1.0))
+            if down:
+                result.append(((x, y + 1), 1.0))
+            if up:
+                result.append(((x, y - 1), 1.0))
+            # Don't cut corners.
+            if right and down and passable(x + 1, y + 1):
+                result.append(((x + 1, y + 1), DIAGONAL_COST))
+            if left and down and passable(x - 1, y + 1):
+                result.append(((x - 1, y + 1), DIAGONAL_COST))
+            if right and up and passable(x + 1, y - 1):
+                result.append(((x + 1, y - 1), DIAGONAL_COST))
+            if left and up and passable(x - 1, y - 1):
+                result.append(((x - 1, y - 1), DIAGONAL_COST))
+            cache[tile] = result
+            return result
+        return neighbours
+
+    def _get_sector_neighbours(self, sector):
+        s_w, s_h = self.grid.matrix.sector_size
+        x, y = sector[0] * s_w, sector[1] * s_h
+        return self._get_neighbours(x, y, x + s_w - 1, y + s_h - 1)
+
+    def _search(self, start, goals, neighbours, heuristic=None):
+        '''
+        A* (or Dijkstra without heuristic) from start via neighbours (see
+        _get_neighbours) until reaching one of goals - or all of them
+        without heuristic. Returns (costs, parents).
+        '''
+        costs = {start: 0.0}
+        parents = {start: None}
+        open_list = [(0.0, start)]
+        closed = set()
+        remaining = set(goals)
+        while open_list:
+            f, node = heappop(open_list)
+            if node in closed:
+                continue
+            closed.add(node)
+            if node in remaining:
+                remaining.discard(node)
+                if heuristic is not None or not remaining:
+                    break
+            cost = costs[node]
+            for neighbour, step in neighbours(node):
+                n_cost = cost + step
+                if n_cost < costs.get(neighbour, float('inf')):
+                    costs[neighbour] = n_cost
+                    parents[neighbour] = node
+                    h = heuristic(neighbour) if heuristic is not None else 0.0
+                    heappush(open_list, (n_cost + h, neighbour))
+        return costs, parents
+
+    # Abstraction.
+
+    def _get_generation(self, sectors):
+        '''
+        Returns the state of the sectors. Data built from them only gets
+        cached if their state is still the same afterwards. Otherwise it
+        might be based on the map before a change.
+        '''
+        generations = self._generations
+        return self._clears, tuple(generations.get(sector, 0) for sector in sectors)
+
+    def _get_entrances(self, a, b):
+        '''Returns the transitions (tile of a, tile of b) between neighbouring sectors.'''
+        key = min(a, b), max(a, b)
+        try:
+            return self._entrances[key]
+        except KeyError:
+            pass
+        a, b = key
+        with self.lock:
+            generation = self._get_generation(key)
+        s_w, s_h = self.grid.matrix.sector_size
+        if a[0] != b[0]:  # b is right of a.
+            x = b[0] * s_w
+            y1 = a[1] * s_h
+            pairs = [((x - 1, y), (x, y)) for y in xrange(y1, y1 + s_h)]
+        else:  # b is below a.
+            y = b[1] * s_h
+            x1 = a[0] * s_w
+            pairs = [((x, y - 1), (x, y)) for x in xrange(x1, x1 + s_w)]
+        passable_a = self._get_sector_passable(a)
+        passable_b = self._get_sector_passable(b)
+        runs, run = [], []
+        for pair in pairs:
+            if passable_a(*pair[0]) and passable_b(*pair[1]):
+                run.append(pair)
+            elif run:
+                runs.append(run)
+                run = []
+        if run:
+            runs.append(run)
+        entrances = []
+        for run in runs:
+            if len(run) > WIDE_ENTRANCE:
+                entrances.extend((run[0], run[-1]))
+            else:
+                entrances.append(run[len(run) // 2])
+        with self.lock:
+            if self._get_generation(key) == generation:
+                self._entrances[key] = entrances
+        return entrances
+
+    def _get_sector_graph(self, sector):
+        '''
+        Returns the transitions of the sector with their edges: tile ->
+        dict(tile -> (cost, segment)). Segments hold the tiles after the
+        first one up to the second one.
+        '''
+        try:
+            return self._sectors[sector]
+        except KeyError:
+            pass
+        s_x, s_y = sector
+        neighbours = (s_x - 1, s_y), (s_x + 1, s_y), (s_x, s_y - 1), (s_x, s_y + 1)
+        with self.lock:
+            generation = self._get_generation((sector,) + neighbours)
+        edges = dict()
+        for other in neighbours:
+            for tile_a, tile_b in self._get_entrances(sector, other):
+                if min(sector, other) != sector:
+                    tile_a, tile_b = tile_b, tile_a
+                edges.setdefault(tile_a, dict())[tile_b] = (1.0, [tile_b])
+        neighbours_of = self._get_sector_neighbours(sector)
+        transitions = list(edges)
+        for pos, tile in enumerate(transitions):
+            others = transitions[pos + 1:]
+            if not others:
+                break
+            costs, parents = self._search(tile, others, neighbours_of)
+            for other in others:
+                if other in costs:
+                    path = _get_path(parents, other)
+                    edges[tile][other] = (costs[other], path[1:])
+                    path.reverse()
+                    edges[other][tile] = (costs[other], path[1:])
+        with self.lock:
+            if self._get_generation((sector,) + neighbours) == generation:
+                self._sectors[sector] = edges
+        return edges
+
+    # Searching.
+
+    def get_path(self, start, goal):
+        '''
+        Returns the list of tiles leading from start to goal (both included)
+        or None if there is no path. Searches on the calling thread.
+        '''
+        start, goal = tuple(start), tuple(goal)
+        start_sector = self._get_sector_of(start)
+        goal_sector = self._get_sector_of(goal)
+        start_neighbours = self._get_sector_neighbours(start_sector)
+        if not self._get_sector_passable(start_sector)(*start):
+            return None
+        if start == goal:
+            return [start]
+        goal_neighbours = self._get_sector_neighbours(goal_sector)
+        if not self._get_sector_passable(goal_sector)(*goal):
+            return None
+        heuristic = lambda node: octile(node, goal)
+        if abs(start_sector[0] - goal_sector[0]) <= 1 and abs(start_sector[1] - goal_sector[1]) <= 1:
+            # Close enough for searching the tiles directly.
+            s_w, s_h = self.grid.matrix.sector_size
+            neighbours = self._get_neighbours(
+                min(start_sector[0], goal_sector[0]) * s_w,
+                min(start_sector[1], goal_sector[1]) * s_h,
+                (max(start_sector[0], goal_sector[0]) + 1) * s_w - 1,
+                (max(start_sector[1], goal_sector[1]) + 1) * s_h - 1)
+            costs, parents = self._search(start, [goal], neighbours, heuristic)
+            if goal in costs:
+                return _get_path(parents, goal)
+
+        # Connect start and goal with the transitions of their sectors.
+        start_graph = self._get_sector_graph(start_sector)
+        costs, parents = self._search(start, start_graph.keys(), start_neighbours)
+        start_edges = dict((tile, (costs[tile], _get_path(parents, tile)[1:]))
+                           for tile in start_graph if tile in costs)
+        goal_graph = self._get_sector_graph(goal_sector)
+        costs, parents = self._search(goal, goal_graph.keys(), goal_neighbours)
+        goal_edges = dict()
+        for tile in goal_graph:
+            if tile in costs:
+                path = _get_path(parents, tile)
+                path.reverse()
+                goal_edges[tile] = (costs[tile], path[1:])
+
+        # Walk from transition to transition.
+        get_sector_of = self._get_sector_of
+        get_sector_graph = self._get_sector_graph
+        costs = {start: 0.0}
+        parents = {start: None}
+        segments = dict()
+        open_list = [(heuristic(start), start)]
+        closed = set()
+        while open_list:
+            f, node = heappop(open_list)
+            if node == goal:
+                break
+            if node in closed:
+                continue
+            closed.add(node)
+            edges = get_sector_graph(get_sector_of(node)).get(node, {})
+            if node == start:
+                # Start might be a transition itself.
+                edges = dict(edges)
+                edges.update(start_edges)
+            if node in goal_edges:
+                edges = dict(edges)
+                edges[goal] = goal_edges[node]
+            cost = costs[node]
+            for neighbour, (step, segment) in edges.iteritems():
+                n_cost = cost + step
+                if n_cost < costs.get(neighbour, float('inf')):
+                    costs[neighbour] = n_cost
+                    parents[neighbour] = node
+                    segments[neighbour] = segment
+                    heappush(open_list, (n_cost + heuristic(neighbour), neighbour))
+        if goal not in parents:
+            return None
+
+        # Glue the segments together.
+        nodes = _get_path(parents, goal)
+        path = [start]
+        for node in nodes[1:]:
+            path.extend(segments[node])
+        return path
+
+    # Workers.
+
+    def find_path(self, start, goal, **user_data):
+        '''
+        Requests a path from start to goal (tiles) and returns a PathRequest.
+        The result gets delivered by tick() via the pathfinding.result event.
+        '''
+        request = PathRequest(start, goal, user_data)
+        self._pending += 1
+        self._requests.put(request)
+        return request
+
+    def is_busy(self):
+        return self._pending > 0
+
+    def tick(self):
+        '''Emits the results found since the last call. Call it from the main thread.'''
+        while self._pending:
+            try:
+                request = self._results.get_nowait()
+            except Empty:
+                break
+            self._pending -= 1
+            if request.is_cancelled:
+                continue
+            if request.error is not None:
+                log_error('Could not find path from %s to %s: %s' % (
+                    request.start, request.goal, request.error))
+            event.emit('pathfinding.result', Array(
+                pathfinder=self, request=request, path=request.path,
+            ))
+
+    def join(self):
+        event.remove_listener(self._listener)
+        [self._requests.put(None) for worker in self._workers]
+        [worker.join() for worker in self._workers]
+        if self.close_grid:
+            self.grid.close()
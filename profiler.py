@@ -0,0 +1,376 @@
+# Scoped frame profiler with near-zero cost when being disabled.
+#
+# @author    Oktay Acikalin <oktay.acikalin@gmail.com>
+# @copyright Oktay Acikalin
+# @license   MIT (LICENSE.txt)
+
+import os
+import json
+from functools import wraps
+from threading import Lock, local, current_thread
+
+from diamond.clock import monotonic
+from diamond.helper.stats import percentile
+
+
+# Check this before doing anything expensive for the profiler.
+enabled = False
+
+# How many samples each zone keeps.
+ZONE_SAMPLES = 1024
+# How many frames each zone keeps per-frame totals for.
+FRAME_SAMPLES = 300
+
+zones = dict()
+counters = dict()
+frame_count = 0
+
+_lock = Lock()
+_stack = local()
+_instrumented = []  # [owner, attr, name, original]
+_trace = None
+
+
+class Zone(object):
+    '''Keeps the latest durations (in msecs) of a named zone in ring buffers.'''
+
+    __slots__ = ('name', 'samples', 'pos', 'calls', 'total',
+                 'frame_samples', 'frame_pos', 'frame_total', 'frame_calls',
+                 'last_frame_total', 'last_frame_calls', 'children', 'self_total')
+
+    def __init__(self, name):
+        self.name = name
+        self.samples = [0.0] * ZONE_SAMPLES
+        self.pos = 0
+        self.calls = 0
+        self.total = 0.0
+        self.self_total = 0.0
+        self.frame_samples = [0.0] * FRAME_SAMPLES
+        self.frame_pos = 0
+        self.frame_total = 0.0
+        self.frame_calls = 0
+        self.last_frame_total = 0.0
+        self.last_frame_calls = 0
+        self.children = dict()  # name -> [calls, inclusive msecs]
+
+    def __repr__(self):
+        return '<Zone(%s, calls = %d, total = %.2f)>' % (self.name, self.calls, self.total)
+
+    def add(self, msecs):
+        pos = self.pos
+        self.samples[pos % ZONE_SAMPLES] = msecs
+        self.pos = pos + 1
+        self.calls += 1
+        self.total += msecs
+        self.frame_total += msecs
+        self.frame_calls += 1
+
+    def end_frame(self):
+        self.frame_samples[self.frame_pos % FRAME_SAMPLES] = self.frame_total
+        self.frame_pos += 1
+        self.last_frame_total = self.frame_total
+        self.last_frame_calls = self.frame_calls
+        self.frame_total = 0.0
+        self.frame_calls = 0
+
+    def get_stats(self):
+        values = sorted(self.samples[:min(self.pos, ZONE_SAMPLES)])
+        frames = sorted(self.frame_samples[:min(self.frame_pos, FRAME_SAMPLES)])
+        if not values:
+            values = [0.0]
+        if not frames:
+            frames = [0.0]
+        return dict(
+            calls=self.calls,
+            total=self.total,
+            self_total=self.self_total,
+            min=values[0],
+            max=values[-1],
+            avg=sum(values) / len(values),
+            p50=percentile(values, 50),
+            p95=percentile(values, 95),
+            p99=percentile(values, 99),
+            frame_p50=percentile(frames, 50),
+            frame_p95=percentile(frames, 95),
+            frame_p99=percentile(frames, 99),
+            frame_max=frames[-1],
+        )
+
+
+def get_zone(name):
+    try:
+        return zones[name]
+    except KeyError:
+        with _lock:
+            return zones.setdefault(name, Zone(name))
+
+
+def remove_zone(name):
+    '''Forgets a zone, e.g. the one of a ticker being gone.'''
+    with _lock:
+        zones.pop(name, None)
+
+
+class _Scope(object):
+
+    __slots__ = ('zone', 'start', 'children')
+
+    def __init__(self, zone):
+        self.zone = zone
+        self.children = 0.0
+
+    def __enter__(self):
+        try:
+            stack = _stack.scopes
+        except AttributeError:
+            stack = _stack.scopes = []
+        stack.append(self)
+        self.start = monotonic()
+        return self
+
+    def __exit__(self, type, value, traceback):
+        end = monotonic()
+        msecs = (end - self.start) * 1000.0
+        zone = self.zone
+        zone.add(msecs)
+        zone.self_total += msecs - self.children
+        stack = _stack.scopes
+        stack.pop()
+        if stack:
+            parent = stack[-1]
+            parent.children += msecs
+            try:
+                edge = parent.zone.children[zone.name]
+            except KeyError:
+                edge = parent.zone.children[zone.name] = [0, 0.0]
+            edge[0] += 1
+            edge[1] += msecs
+        if _trace is not None:
+            _trace.add(zone.name, self.start, end)
+        return False
+
+
+class _NullScope(object):
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        return False
+
+
+_null_scope = _NullScope()
+
+
+def zone(name):
+    '''
+    Returns a context manager measuring the enclosed block:
+    > with profiler.zone('collision'):
+    >     ...
+    Costs a global lookup and a function call if the profiler is disabled.
+    '''
+    if not enabled:
+        return _null_scope
+    return _Scope(get_zone(name))
+
+
+def count(name, amount=1):
+    '''Adds amount to the counter of the current frame.'''
+    if not enabled:
+        return
+    try:
+        counters[name][0] += amount
+    except KeyError:
+        counters[name] = [amount, 0, 0]
+
+
+def get_counter(name):
+    '''Returns the value of the counter during the last finished frame.'''
+    try:
+        return counters[name][1]
+    except KeyError:
+        return 0
+
+
+def frame():
+    '''
+    Finishes the current frame. Zones and counters get their per-frame values
+    aggregated. Call this once per frame (the scene manager does).
+    '''
+    global frame_count
+    if not enabled:
+        return
+    frame_count += 1
+    for zone in zones.values():
+        zone.end_frame()
+    for counter in counters.values():
+        counter[1] = counter[0]
+        counter[2] += counter[0]
+        counter[0] = 0
+    if _trace is not None:
+        _trace.flush(frame_count)
+
+
+def _wrap(func, name):
+    zone = get_zone(name)
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        with _Scope(zone):
+            return func(*args, **kwargs)
+    wrapper.__wrapped__ = getattr(func, '__wrapped__', func)
+    return wrapper
+
+
+def _patch(entry):
+    owner, attr, name, original = entry
+    func = owner.__dict__[attr]
+    entry[3] = func
+    if isinstance(func, staticmethod):
+        wrapper = staticmethod(_wrap(func.__func__, name))
+    elif isinstance(func, classmethod):
+        wrapper = classmethod(_wrap(func.__func__, name))
+    else:
+        wrapper = _wrap(func, name)
+    setattr(owner, attr, wrapper)
+
+
+def _unpatch(entry):
+    owner, attr, name, original = entry
+    setattr(owner, attr, original)
+    entry[3] = None
+
+
+def instrument(owner, attr, name=None):
+    '''
+    Registers a function of a class or module for being measured while the
+    profiler is enabled. The function only gets replaced by a measuring
+    wrapper when enabling the profiler. Thus it costs nothing otherwise.
+    '''
+    if name is None:
+        name = '%s.%s' % (getattr(owner, '__name__', owner), attr)
+    entry = [owner, attr, name, None]
+    _instrumented.append(entry)
+    if enabled:
+        _patch(entry)
+
+
+def enable():
+    global enabled
+    if enabled:
+        return
+    [_patch(entry) for entry in _instrumented]
+    enabled = True
+
+
+def disable():
+    global enabled
+    if not enabled:
+        return
+    enabled = False
+    [_unpatch(entry) for entry in _instrumented]
+    stop_trace()
+
+
+def reset():
+    global frame_count
+    with _lock:
+        # Keep the zones. Instrumented functions hold references to them.
+        [zone.__init__(zone.name) for zone in zones.values()]
+        counters.clear()
+        frame_count = 0
+
+
+def get_stats():
+    '''Returns a dict with the stats of every zone and counter.'''
+    return dict(
+        frames=frame_count,
+        zones=dict((name, zone.get_stats()) for name, zone in zones.items()),
+        counters=dict((name, dict(last=value[1], total=value[2]))
+                      for name, value in counters.items()),
+    )
+
+
+class _Trace(object):
+    '''
+    Streams complete events in Chrome's trace event format (chrome://tracing)
+    into a file. Every event is on its own line and gets written out on each
+    frame which keeps memory usage flat and allows processing the file as a
+    stream. The closing bracket is optional for the viewers.
+    '''
+
+    def __init__(self, filename):
+        super(_Trace, self).__init__()
+        self.file = open(filename, 'w')
+        self.file.write('[\n')
+        self.pid = os.getpid()
+        self.events = []
+        self.lock = Lock()
+
+    def add(self, name, start, end):
+        # Appending to a list is atomic - no lock needed here.
+        self.events.append((name, current_thread().ident, start, end))
+
+    def flush(self, frame_no=None):
+        with self.lock:
+            events, self.events = self.events, []
+            if self.file is None:
+                return
+            pid = self.pid
+            dumps = json.dumps
+            lines = ['{"name": %s, "ph": "X", "pid": %d, "tid": %d, "ts": %d, "dur": %d},\n' % (
+                dumps(name), pid, tid, start * 1000000, (end - start) * 1000000)
+                for name, tid, start, end in events]
+            if frame_no is not None:
+                lines.append('{"name": "frame", "ph": "i", "s": "g", "pid": %d, "tid": 0, "ts": %d, "args": {"frame": %d}},\n' % (
+                    pid, monotonic() * 1000000, frame_no))
+            self.file.writelines(lines)
+
+    def close(self):
+        self.flush()
+        with self.lock:
+            self.file.write('{"name": "process_name", "ph": "M", "pid": %d, "args": {"name": "diamond"}}]\n' % self.pid)
+            self.file.close()
+            self.file = None
+
+
+def start_trace(filename):
+    '''Starts streaming all measured zones into filename as a Chrome trace.'''
+    global _trace
+    stop_trace()
+    _trace = _Trace(filename)
+
+
+def stop_trace():
+    global _trace
+    trace, _trace = _trace, None
+    if trace is not None:
+        trace.close()
+
+
+def export_callgrind(filename):
+    '''
+    Writes the zones as callgrind file (e.g. for KCachegrind). The costs are
+    in microseconds. Nesting of zones is being kept as call graph.
+    '''
+    with open(filename, 'w') as output:
+        output.write('version: 1\ncreator: diamond.profiler\nevents: Microseconds\n\n')
+        for name, zone in sorted(zones.items()):
+            output.write('fn=%s\n0 %d\n' % (name, zone.self_total * 1000))
+            for child, (calls, msecs) in sorted(zone.children.items()):
+                output.write('cfn=%s\ncalls=%d 0\n0 %d\n' % (child, calls, msecs * 1000))
+            output.write('\n')
+
+
+def print_stats():
+    stats = get_stats()
+    print('Profiled %d frames.' % stats['frames'])
+    for name, zone in sorted(stats['zones'].items(), key=lambda item: -item[1]['total']):
+        print('%s: calls=%d, total=%.2f, avg=%.4f, p50=%.4f, p95=%.4f, p99=%.4f, max=%.4f, '
+              'per frame p50=%.4f, p99=%.4f msecs' % (
+                  name, zone['calls'], zone['total'], zone['avg'], zone['p50'], zone['p95'],
+                  zone['p99'], zone['max'], zone['frame_p50'], zone['frame_p99']))
+    for name, counter in sorted(stats['counters'].items()):
+        print('%s: last frame=%d, total=%d' % (name, counter['last'], counter['total']))
@@ -0,0 +1,154 @@
+# Statistical profiler sampling the stacks of all threads.
+#
+# @author    Oktay Acikalin <oktay.acikalin@gmail.com>
+# @copyright Oktay Acikalin
+# @license   MIT (LICENSE.txt)
+
+import os
+import sys
+import weakref
+import threading
+from time import sleep
+
+from diamond import event
+from diamond.clock import monotonic
+from diamond.helper.logging import log_info
+
+
+class Sampler(object):
+    '''
+    Looks at the stacks of all threads rate times per second from a thread
+    of its own and writes them as folded stacks (one "a;b;c count" line per
+    unique stack) which can be fed into flamegraph.pl, speedscope and alike.
+
+    The program only pays for the sampling itself - nothing gets measured on
+    each call. Thus it is suited for watching long sessions.
+
+    Every stack starts with the id of the active scene and the number of
+    the frame during which it has been seen:
+    > scene:game;frame:1234;MainThread;run (scene.py:670);...
+    That allows cutting out single hitches with grep. Set per_frame to False
+    for aggregating over the whole session instead. The scene manager gets
+    picked up via the scenemanager.ready event.
+    Samples get written out whenever a frame has been finished.
+    '''
+
+    def __init__(self, filename, rate=200, per_frame=True):
+        super(Sampler, self).__init__()
+        self.filename = filename
+        self.interval = 1.0 / rate
+        self.per_frame = per_frame
+        self.samples = 0
+        self.overhead = 0.0  # Seconds spent in sampling.
+        self.leaf_counts = dict()  # function -> samples with it on top.
+        self._manager = lambda: None
+        self._stacks = dict()
+        self._prefix = None
+        self._labels = dict()
+        self._file = None
+        self._thread = None
+        self._running = False
+        self._listeners = []
+
+    def __repr__(self):
+        return '<Sampler(%s, samples = %d)>' % (self.filename, self.samples)
+
+    def _on_scenemanager_ready(self, context):
+        self._manager = weakref.ref(context)
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._file = open(self.filename, 'w')
+        self._listeners = [
+            event.add_listener(self._on_scenemanager_ready, 'scenemanager.ready'),
+        ]
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name='Sampler')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self._running = False
+        self._thread.join()
+        self._thread = None
+        event.remove_listeners(self._listeners)
+        self._listeners = []
+        self._flush()
+        self._file.close()
+        self._file = None
+        log_info('Took %d samples (%.2f secs overhead) into %s.' % (
+            self.samples, self.overhead, self.filename))
+
+    def _get_label(self, code):
+        try:
+            return self._labels[code]
+        except KeyError:
+            label = '%s (%s:%d)' % (code.co_name, os.path.basename(code.co_filename),
+                                    code.co_firstlineno)
+            # Semicolons separate the functions of folded stacks.
+            label = self._labels[code] = label.replace(';', ':')
+            return label
+
+    def _get_prefix(self):
+        manager = self._manager()
+        if manager is None:
+            return 'scene:none;frame:0' if self.per_frame else 'scene:none'
+        if self.per_frame:
+            return 'scene:%s;frame:%d' % (manager.active_scene_id, manager.frame_count)
+        return 'scene:%s' % manager.active_scene_id
+
+    def _flush(self):
+        stacks, self._stacks = self._stacks, dict()
+        self._file.writelines('%s %d\n' % item for item in stacks.iteritems())
+
+    def _sample(self):
+        prefix = self._get_prefix()
+        if prefix != self._prefix:
+            if self.per_frame:
+                self._flush()
+            self._prefix = prefix
+        own_ident = threading.current_thread().ident
+        names = dict((thread.ident, thread.name) for thread in threading.enumerate())
+        get_label = self._get_label
+        stacks = self._stacks
+        leaf_counts = self.leaf_counts
+        for ident, frame in sys._current_frames().items():
+            if ident == own_ident:
+                continue
+            labels = []
+            leaf = frame
+            while frame is not None:
+                labels.append(get_label(frame.f_code))
+                frame = frame.f_back
+            labels.append(names.get(ident, 'Thread-%d' % ident).replace(';', ':'))
+            labels.append(prefix)
+            labels.reverse()
+            key = ';'.join(labels)
+            stacks[key] = stacks.get(key, 0) + 1
+            label = get_label(leaf.f_code)
+            leaf_counts[label] = leaf_counts.get(label, 0) + 1
+        self.samples += 1
+
+    def _run(self):
+        interval = self.interval
+        next_sample = monotonic() + interval
+        while self._running:
+            delay = next_sample - monotonic()
+            if delay > 0:
+                sleep(delay)
+            start = monotonic()
+            self._sample()
+            end = monotonic()
+            self.overhead += end - start
+            # Don't try to catch up after being stalled. Just skip samples.
+            next_sample = max(next_sample + interval, end)
+
+    def print_stats(self, limit=10):
+        print 'Top %d functions seen on top of the stack (%d samples):' % (limit, self.samples)
+        total = float(sum(self.leaf_counts.itervalues()) or 1)
+        items = sorted(self.leaf_counts.iteritems(), key=lambda item: -item[1])
+        for label, count in items[:limit]:
+            print '%6.2f%% %6d %s' % (count * 100 / total, count, label)
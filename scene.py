@@ -5,22 +5,34 @@
 # @license   MIT (LICENSE.txt)
 
 import os
+import gc
 import random
+import traceback
 import collections
 from threading import Thread
 
 from diamond.array import Array
 from diamond.window import Window
+from diamond.loader import VaultLoader
+from diamond.vault import cache as vault_cache
+from diamond.tilematrix import TileMatrixSector
+from diamond.telemetry import TelemetrySink
 from diamond import event
+from diamond import ownership
+from diamond import profiler
 from diamond.node import Node
-from diamond.helper.logging import log_debug, log_info, log_warning
+from diamond.helper.logging import log_debug, log_info, log_warning, log_error
 from diamond.helper.weak_ref import Wrapper
+from diamond.helper.stats import RollingStats
 from diamond import clock
 from diamond import pyglet
 
 
 class Scene(object):
 
+    # Vault modules being loaded in the background by SceneManager.preload_scene().
+    assets = ()
+
     def __init__(self, scene_id, manager):
         super(Scene, self).__init__()
         self.scene_id = scene_id
@@ -28,10 +40,15 @@ class Scene(object):
         self.root_node = None
         self.__bound_listeners = set()
         self.__bound_tickers = set()
+        self.__tick_zones = dict()  # ticker -> name of its profiler zone
+        self.__tick_zone_count = 0
         self.__bound_threads = set()
         self.__managed_objects = set()
         self.keys_pressed = set()
         self.is_paused = False
+        # Drives the tickers and threads bound to the scene (see bind()). Use
+        # it for pausing, scaling or stepping the scene time.
+        self.clock = clock.VirtualClock(source=manager.clock)
 
     def setup(self):
         '''
@@ -42,15 +59,35 @@ class Scene(object):
         root_node.add_to(self.scene_manager.window.root_node)
         self.root_node = root_node
 
+    def preload(self, **kwargs):
+        '''
+        This method is being called by SceneManager.preload_scene() within a
+        background thread before setup() is being called on the main thread.
+        Do expensive work like parsing or generating data here and store the
+        results for setup(). Never create nodes, sprites or touch anything
+        else related to OpenGL in here.
+        Returns the vault modules to be loaded before setup() is being called.
+        '''
+        return self.assets
+
     def bind(self, *candidates):
+        '''
+        Binds listeners, tickers and threads to the scene. Tickers and
+        threads without a clock of their own get bound to the clock of the
+        scene. Thus fixed updates (see SceneManager.set_fixed_update) drive
+        them step by step.
+        '''
         has_method = lambda obj, method: hasattr(obj, method) and \
             isinstance(getattr(obj, method), collections.Callable)
         for candidate in candidates:
             obj = candidate
             if type(obj) is Wrapper:
                 obj = obj.resolve()
+            if has_method(obj, 'set_clock') and getattr(obj, 'clock', None) is None:
+                obj.set_clock(self.clock)
             if type(obj) is event.Listener:
                 self.__bound_listeners.add(candidate)
+                ownership.claim(self, obj)
             elif isinstance(obj, Thread):
                 if not hasattr(candidate, 'is_threaded') or candidate.is_threaded:
                     self.__bound_threads.add(candidate)
@@ -58,12 +95,24 @@ class Scene(object):
                     # print 1, candidate
                 else:
                     # print 2, candidate
-                    self.__bound_tickers.add(candidate)
+                    self.__add_ticker(candidate, obj)
             elif has_method(obj, 'tick'):
-                self.__bound_tickers.add(candidate)
+                self.__add_ticker(candidate, obj)
             else:
                 raise Exception('Only Listener and Ticker objects can be bond to the scene.')
 
+    def __add_ticker(self, candidate, obj):
+        if candidate not in self.__bound_tickers:
+            self.__bound_tickers.add(candidate)
+            # Stays the same as long as the ticker is bound.
+            self.__tick_zones[candidate] = 'tick %s/%d %s' % (
+                self.scene_id, self.__tick_zone_count, type(obj).__name__)
+            self.__tick_zone_count += 1
+
+    def __remove_ticker(self, candidate):
+        self.__bound_tickers.remove(candidate)
+        profiler.remove_zone(self.__tick_zones.pop(candidate))
+
     def remove_bonds(self, *candidates):
         has_method = lambda obj, method: hasattr(obj, method) and \
             isinstance(getattr(obj, method), collections.Callable)
@@ -80,12 +129,17 @@ class Scene(object):
                 self.__bound_threads.remove(candidate)
             elif has_method(obj, 'tick'):
                 candidate.clear()
-                self.__bound_tickers.remove(candidate)
+                self.__remove_ticker(candidate)
             else:
                 raise Exception('Only Listener and Ticker objects can be unbonded from the scene.')
         if listeners:
             event.remove_listeners(listeners)
 
+    def get_queued_ticks(self):
+        '''Returns the number of ticks waiting within all bound tickers and threads.'''
+        return sum(len(getattr(ticker, 'tickers', ()))
+                   for ticker in list(self.__bound_tickers) + list(self.__bound_threads))
+
     def remove_all_bonds(self):
         log_debug('clear tickers')
         for ticker in self.__bound_tickers:
@@ -93,12 +147,15 @@ class Scene(object):
         log_debug('join threads')
         for thread in self.__bound_threads:
             thread.join()
+        log_debug('release owned listeners and ticks')
+        ownership.release(self)
         log_debug('remove listeners')
+        # Only those being owned by someone else are left.
         event.remove_listeners(self.__bound_listeners)
         log_debug('clear listener list')
         self.__bound_listeners.clear()
         log_debug('clear ticker list')
-        self.__bound_tickers.clear()
+        [self.__remove_ticker(ticker) for ticker in list(self.__bound_tickers)]
         log_debug('clear thread list')
         self.__bound_threads.clear()
 
@@ -111,6 +168,9 @@ class Scene(object):
             event.add_listener(window.toggle_fullscreen, 'scene.key.down',
                                context__scene__is=self,
                                context__event__key__eq='F11'),
+            event.add_listener(window.toggle_hud, 'scene.key.down',
+                               context__scene__is=self,
+                               context__event__key__eq='F3'),
         )
         # TODO only add this if platform is windows.
         self.bind(
@@ -165,18 +225,27 @@ class Scene(object):
 
     def tick(self, dt):
         # TODO also support Wrapper?
+        if profiler.enabled:
+            zone = profiler.zone
+            names = self.__tick_zones
+            for ticker in self.__bound_tickers:
+                with zone(names[ticker]):
+                    ticker.tick()
+            return
         [ticker.tick() for ticker in self.__bound_tickers]
 
     def pause(self):
         if not self.is_paused:
             [ticker.pause() for ticker in self.__bound_tickers]
             [thread.pause() for thread in self.__bound_threads]
+            self.clock.pause()
             self.is_paused = True
 
     def unpause(self):
         if self.is_paused:
             [ticker.unpause() for ticker in self.__bound_tickers]
             [thread.unpause() for thread in self.__bound_threads]
+            self.clock.unpause()
             self.is_paused = False
 
     def show(self):
@@ -191,6 +260,9 @@ class Scene(object):
         #     self.root_node.hide()
         pass
 
+    # Use this for interpolating between the last two fixed updates while rendering.
+    interpolation_alpha = property(lambda self: self.scene_manager.interpolation_alpha)
+
     def on_quit_event(self, context):
         event.emit('scene.quit', self)
 
@@ -206,13 +278,93 @@ class SceneManager(object):
         self.scenes = {}
         self.scene_tickers = []
         self.active_scene_id = None
+        # Source of all scene clocks. Gets stepped manually in fixed update mode.
+        self.clock = clock.VirtualClock()
+        self.loader = None
+        self._preloading = []
+        self.frame_count = 0
+        self.fixed_step = None
+        self.max_update_steps = 5
+        self.interpolation_alpha = 1.0
+        self.dropped_update_steps = 0
+        self._accumulator = 0.0
+        self.frame_stats = RollingStats()  # Frame times in msecs.
+        self.update_stats = RollingStats()  # Time spent ticking per frame in msecs.
+        self.telemetry = None
+        if os.environ.get('DIAMOND_TELEMETRY'):
+            # e.g. DIAMOND_TELEMETRY=unix:/tmp/diamond.sock DIAMOND_TELEMETRY_FORMAT=binary
+            self.set_telemetry(TelemetrySink(os.environ['DIAMOND_TELEMETRY'],
+                                             os.environ.get('DIAMOND_TELEMETRY_FORMAT', 'jsonl')))
         self._listeners = [
             event.add_listener(self._on_window_key_down_event, 'window.key.down'),
             event.add_listener(self._on_window_key_up_event, 'window.key.up'),
+            event.add_listener(self._on_window_mouse_motion_event, 'window.mouse.motion'),
+            event.add_listener(self._on_window_mouse_button_down_event, 'window.mouse.button.down'),
+            event.add_listener(self._on_window_mouse_button_up_event, 'window.mouse.button.up'),
             event.add_listener(self._on_scene_quit_event, 'scene.quit'),
         ]
         log_info('Initialized.')
 
+    def set_fixed_update(self, rate=None, max_steps=5):
+        '''
+        Enables the fixed-timestep update mode if rate (updates per second)
+        is given. Scene tickers are then being called with a constant dt as
+        often as necessary to catch up with the elapsed time but never more
+        than max_steps times per frame. The remaining fraction of a step is
+        being exposed as interpolation_alpha (0.0 - 1.0) for render code.
+        The clock of the manager (and thereby the clocks of all scenes) then
+        only advances by whole steps which makes tickers bound to them run
+        deterministically.
+        Pass None as rate for calling the tickers once per frame again.
+        '''
+        self.fixed_step = 1.0 / rate if rate else None
+        self.max_update_steps = max(1, max_steps)
+        self.interpolation_alpha = 1.0
+        self._accumulator = 0.0
+        self.clock.set_manual(self.fixed_step is not None)
+
+    def set_telemetry(self, sink):
+        '''
+        Sends a record with timings and engine stats for every frame to the
+        given sink (see diamond.telemetry.TelemetrySink). Pass None for
+        stopping. The sink gets closed when the scene manager stops running.
+        Setting the environment variable DIAMOND_TELEMETRY to a target (and
+        optionally DIAMOND_TELEMETRY_FORMAT) does the same on creation.
+        '''
+        self.telemetry = sink
+
+    def _record_telemetry(self):
+        vault_stats = vault_cache.get_stats()
+        gc0, gc1, gc2 = gc.get_count()
+        queued_ticks = 0
+        for scene_frame in self.scenes.values():
+            if scene_frame['instance'] is not None:
+                queued_ticks += scene_frame['instance'].get_queued_ticks()
+        self.telemetry.write(dict(
+            frame=self.frame_count,
+            time=clock.get_ticks(),
+            frame_msecs=self.frame_stats.last,
+            update_msecs=self.update_stats.last,
+            dropped_update_steps=self.dropped_update_steps,
+            queued_ticks=queued_ticks,
+            sectors=TileMatrixSector.alive,
+            sectors_built=TileMatrixSector.built,
+            vault_cache_bytes=vault_stats['bytes'],
+            vault_cache_hits=vault_stats['hits'],
+            vault_cache_loads=vault_stats['loads'],
+            gc0=gc0,
+            gc1=gc1,
+            gc2=gc2,
+        ))
+
+    def get_frame_stats(self):
+        return dict(
+            frames=self.frame_count,
+            frame_msecs=self.frame_stats.get_stats(),
+            update_msecs=self.update_stats.get_stats(),
+            dropped_update_steps=self.dropped_update_steps,
+        )
+
     def setup_window(self, **kwargs):
         self.window = Window(**kwargs)
         return self.window
@@ -226,6 +378,8 @@ class SceneManager(object):
             setup_kwargs=setup_kwargs,
             instance=None,
             scene_id=scene_id,  # Backref for faster looping.
+            preload=None,
+            is_hidden=False,  # Whether the root node got hidden by preloading.
         )
 
     def create_scene(self, scene_id):
@@ -254,12 +408,126 @@ class SceneManager(object):
         scene.setup(**scene_frame['setup_kwargs'])
         clock.shift(clock.get_ticks() - time)
 
+    def _run_preload(self, scene, setup_kwargs, preload):
+        # Gets the scene and its preload dict passed since teardown_scene()
+        # might drop both from the scene frame while we are still running.
+        try:
+            vaults = scene.preload(**setup_kwargs)
+            preload['vaults'] = list(vaults or [])
+        except Exception as excp:
+            # Gets reported on the main thread by _tick_preload().
+            preload['traceback'] = traceback.format_exc()
+            preload['error'] = excp
+
+    def preload_scene(self, scene_id):
+        '''
+        Creates the scene and runs its preload() method within a background
+        thread while the current scene keeps running. Afterwards the vaults
+        returned by preload() are being loaded asynchronously and finally the
+        scene gets setup on the main thread. The scene stays hidden until
+        show_scene() is being called and scene.preloaded is being emitted as
+        soon as it's ready to be shown instantly. If preload() fails the
+        error gets logged, scene.preload.failed is being emitted (with
+        scene_id, error and traceback) and the scene gets dropped again while
+        the current scene keeps running. Tearing down a scene which is still
+        being preloaded drops it without setting it up.
+        '''
+        try:
+            scene_frame = self.scenes[scene_id]
+        except KeyError:
+            raise Exception('Unknown scene ID: %s' % scene_id)
+        if scene_frame['instance'] is not None:
+            return
+        self.create_scene(scene_id)
+        log_info('Preloading scene with ID "%s".' % scene_id)
+        preload = dict(thread=None, vaults=None, job=None, error=None, traceback=None)
+        thread = Thread(target=self._run_preload,
+                        args=(scene_frame['instance'], scene_frame['setup_kwargs'], preload),
+                        name='preload %s' % scene_id)
+        thread.daemon = True
+        preload['thread'] = thread
+        scene_frame['preload'] = preload
+        self._preloading.append(scene_frame)
+        thread.start()
+
+    def _tick_preload(self, scene_frame, block=False):
+        '''Advances the preloading of a scene. Returns True if done.'''
+        preload = scene_frame['preload']
+        thread = preload['thread']
+        if thread.is_alive():
+            if not block:
+                return False
+            thread.join()
+        if preload['error'] is not None:
+            self._fail_preload(scene_frame)
+            return True
+        if preload['job'] is None:
+            if self.loader is None:
+                self.loader = VaultLoader()
+            preload['job'] = self.loader.load(preload['vaults'])
+        if not preload['job'].is_done:
+            if not block:
+                return False
+            self.loader.flush()
+        # The cheap part: Create nodes and sprites from already loaded vaults.
+        self._preloading.remove(scene_frame)
+        scene_frame['preload'] = None
+        scene_id = scene_frame['scene_id']
+        self.setup_scene(scene_id)
+        scene = scene_frame['instance']
+        if scene_id != self.active_scene_id:
+            scene.root_node.hide()
+            scene_frame['is_hidden'] = True
+        log_info('Preloaded scene with ID "%s".' % scene_id)
+        event.emit('scene.preloaded', scene)
+        return True
+
+    def _drop_preload(self, scene_frame):
+        # Never got setup. Thus there is nothing to teardown. A preload()
+        # still running in the background finishes without being noticed.
+        preload = scene_frame['preload']
+        self._preloading.remove(scene_frame)
+        scene_frame['preload'] = None
+        if preload['job'] is not None:
+            self.loader.cancel(preload['job'])
+        scene = scene_frame['instance']
+        self.scene_tickers.remove(scene.tick)
+        scene_frame['instance'] = None
+        return preload
+
+    def _fail_preload(self, scene_frame):
+        preload = self._drop_preload(scene_frame)
+        scene_id = scene_frame['scene_id']
+        log_error('Error preloading scene with ID "%s":\n%s' % (scene_id, preload['traceback']))
+        event.emit('scene.preload.failed', Array(
+            scene_id=scene_id,
+            error=preload['error'],
+            traceback=preload['traceback'],
+        ))
+
+    def _finish_preload(self, scene_frame):
+        if scene_frame['preload'] is not None:
+            self._tick_preload(scene_frame, block=True)
+
+    def is_scene_preloaded(self, scene_id):
+        scene_frame = self.scenes[scene_id]
+        return scene_frame['instance'] is not None and scene_frame['preload'] is None
+
     def teardown_scene(self, scene_id):
         time = clock.get_ticks()
         try:
             scene_frame = self.scenes[scene_id]
         except KeyError:
             raise Exception('Unknown scene ID: %s' % scene_id)
+        preload = scene_frame['preload']
+        if preload is not None:
+            if not preload['thread'].is_alive() and preload['error'] is not None:
+                self._fail_preload(scene_frame)
+            else:
+                log_info('Dropping preloading scene with ID "%s".' % scene_id)
+                self._drop_preload(scene_frame)
+            return
+        scene_frame['is_hidden'] = False
         scene = scene_frame['instance']
         log_info('Tearing down scene %s with ID "%s".' % (scene, scene_id))
         scene.teardown()
@@ -276,7 +544,14 @@ class SceneManager(object):
         if scene_frame['instance'] is None:
             self.create_scene(scene_id)
             self.setup_scene(scene_id)
+        else:
+            self._finish_preload(scene_frame)
+            if scene_frame['instance'] is None:
+                return  # Preloading failed. Keep the current scene.
         self.active_scene_id = scene_id
+        if scene_frame['is_hidden']:
+            scene_frame['instance'].root_node.show()
+            scene_frame['is_hidden'] = False
         scene_frame['instance'].keys_pressed.clear()
         scene_frame['instance'].show()
 
@@ -302,59 +577,29 @@ class SceneManager(object):
             else:
                 self.create_scene(scene_id)
                 self.setup_scene(scene_id)
+        elif instanciate:
+            self._finish_preload(scene_frame)
         return scene_frame['instance']
 
-    # TODO
     def _on_window_mouse_motion_event(self, context):
-        # translate_view_to_screen_coord = self.window.translate_view_to_screen_coord
-        # old_pos = translate_view_to_screen_coord(*pygame.mouse.get_pos())
         scene_id = self.active_scene_id
         if scene_id is not None:
-            #     if pg_event.type == pygame.locals.MOUSEMOTION:
-            #         pos = translate_view_to_screen_coord(*pg_event.pos)
-            #         rel = pos[0] - old_pos[0], pos[1] - old_pos[1]
-            #         old_pos = pos
-            #         pg_event = pygame.event.Event(pg_event.type, dict(
-            #             buttons=pg_event.buttons,
-            #             pos=pos,
-            #             rel=rel,
-            #         ))
             event.emit('scene.mouse.motion', Array(
                 scene=self.scenes[scene_id]['instance'],
                 event=context,
             ))
 
-    # TODO
     def _on_window_mouse_button_down_event(self, context):
         scene_id = self.active_scene_id
         if scene_id is not None:
-            #     elif pg_event.type in (pygame.locals.MOUSEBUTTONDOWN, pygame.locals.MOUSEBUTTONUP):
-            #         pos = translate_view_to_screen_coord(*pg_event.pos)
-            #         old_pos = pos
-            #         pg_event = pygame.event.Event(pg_event.type, dict(
-            #             button=pg_event.button,
-            #             pos=pos,
-            #         ))
-            #     event.emit('scene', Array(
-            #         scene=scene_instance, event=pg_event))
             event.emit('scene.mouse.button.down', Array(
                 scene=self.scenes[scene_id]['instance'],
                 event=context,
             ))
 
-    # TODO
     def _on_window_mouse_button_up_event(self, context):
         scene_id = self.active_scene_id
         if scene_id is not None:
-            #     elif pg_event.type in (pygame.locals.MOUSEBUTTONUP, pygame.locals.MOUSEBUTTONUP):
-            #         pos = translate_view_to_screen_coord(*pg_event.pos)
-            #         old_pos = pos
-            #         pg_event = pygame.event.Event(pg_event.type, dict(
-            #             button=pg_event.button,
-            #             pos=pos,
-            #         ))
-            #     event.emit('scene', Array(
-            #         scene=scene_instance, event=pg_event))
             event.emit('scene.mouse.button.up', Array(
                 scene=self.scenes[scene_id]['instance'],
                 event=context,
@@ -386,9 +631,8 @@ class SceneManager(object):
             self.active_scene_id = None
             self.window.dispatch_event('on_close')
 
-    def _loop_scenes(self):
-        scenes = self.scenes.values()
-        for scene in scenes:
+    def _begin_loop(self):
+        for scene in self.scenes.values():
             if scene['instance'] is not None:
                 event.emit('scene.ready', scene['instance'])
                 scene['instance'].show()
@@ -397,15 +641,79 @@ class SceneManager(object):
         # This also ensures that tickers won't skip ahead on startup.
         clock.reset()
 
-        tickers = self.scene_tickers
-        pyglet.clock.schedule(lambda dt: [ticker(dt) for ticker in tickers])
-        pyglet.app.run()
-
-        for scene in scenes:
+    def _end_loop(self):
+        for scene in self.scenes.values():
             if scene['instance'] is not None:
                 self.teardown_scene(scene['scene_id'])
+        if self.loader is not None:
+            self.loader.join()
+            self.loader = None
+        if self.telemetry is not None:
+            self.telemetry.close()
+            self.telemetry = None
 
-    def run(self, scene_id=None):
+    def _loop_scenes(self):
+        self._begin_loop()
+        pyglet.clock.schedule(self._on_frame)
+        pyglet.app.run()
+        pyglet.clock.unschedule(self._on_frame)
+        self._end_loop()
+
+    def _step_scenes(self, frames, dt=None):
+        self._begin_loop()
+        window = self.window
+        pyglet.clock.tick()  # Drop the time spent on setting things up.
+        for count in xrange(frames):
+            elapsed = pyglet.clock.tick()
+            self._on_frame(elapsed if dt is None else dt)
+            if window.has_exit:
+                break
+            window.dispatch_events()
+            window.dispatch_event('on_draw')
+            window.flip()
+        self._end_loop()
+
+    def _on_frame(self, dt):
+        if profiler.enabled:
+            profiler.frame()
+        self.frame_count += 1
+        self.frame_stats.add(dt * 1000.0)
+        start = clock.get_ticks()
+        if self.loader is not None:
+            self.loader.tick()
+        if self._preloading:
+            [self._tick_preload(scene_frame) for scene_frame in self._preloading[:]]
+        step = self.fixed_step
+        if step is None:
+            [ticker(dt) for ticker in self.scene_tickers]
+        else:
+            self._accumulator += dt
+            steps = 0
+            step_msecs = step * 1000.0
+            while self._accumulator >= step and steps < self.max_update_steps:
+                self.clock.step(step_msecs)
+                [ticker(step) for ticker in self.scene_tickers]
+                self._accumulator -= step
+                steps += 1
+            if self._accumulator >= step:
+                # Too far behind. Drop the backlog instead of spiraling.
+                self.dropped_update_steps += int(self._accumulator / step)
+                self._accumulator %= step
+            self.interpolation_alpha = self._accumulator / step
+        self.update_stats.add(clock.get_ticks() - start)
+        if self.telemetry is not None:
+            self._record_telemetry()
+
+    def run(self, scene_id=None, frames=None, dt=None):
+        '''
+        Runs the scenes until the active one quits or the window gets closed.
+        If frames is given only that many frames are being rendered as fast
+        as possible without waiting for the event loop or vsync. This is
+        meant for benchmarks and CI together with a headless window. Every
+        frame then advances time by dt seconds if given (use it together with
+        set_fixed_update() for reproducible runs) or by the real time passed.
+        Returns the frame stats.
+        '''
         event.emit('scenemanager.ready', self)
 
         if scene_id is not None:
@@ -425,25 +733,27 @@ class SceneManager(object):
         self.setup_scene(scene_id)
 
         # We enclose our loop in order to have it easier with our GC.
-        self._loop_scenes()
+        if frames is None:
+            self._loop_scenes()
+        else:
+            self._step_scenes(frames, dt)
 
         event.remove_listeners(self._listeners)
 
         del self.window  # Tell window to clean it up.
 
-        # Catch statistics and if some found output things.
+        # Report everything which is still owned by someone.
         log_info('Checking for stuff that should be cleaned up already.')
-        listeners = event.get_listeners()
-        tickers = event.emit('ticker.dump')
-        if listeners or tickers:
+        report = ownership.get_report()
+        if report:
             log_warning('Found stuff that should be cleaned up earlier!')
-            if listeners:
-                log_warning('Events:')
-                for key, val in listeners.iteritems():
-                    log_warning({key: val})
-            if tickers:
-                log_warning('Tickers:')
-                for func, items in tickers:
-                    log_warning((func, items))
+            for owner, items in sorted(report.iteritems()):
+                log_warning('%s: %d listeners, %d ticks' % (
+                    owner, len(items['listeners']), len(items['ticks'])))
+                for listener in items['listeners']:
+                    log_warning(listener)
+                for tick in items['ticks']:
+                    log_warning(tick)
 
         log_info('Done.')
+        return self.get_frame_stats()
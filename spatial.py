@@ -0,0 +1,164 @@
+# Spatial index answering which items are at a point or within an area.
+#
+# @author    Oktay Acikalin <oktay.acikalin@gmail.com>
+# @copyright Oktay Acikalin
+# @license   MIT (LICENSE.txt)
+
+
+class SpatialHash(object):
+    '''
+    Uniform grid of cells. Every item is being kept within all cells its
+    bounding rect (x1, y1, x2, y2) touches. Queries only look at the cells
+    covering the queried area. Thus their costs depend on the amount of
+    items around and not on the amount of items in total.
+
+    Moving an item within its cells is O(1). Pick a cell size about the
+    size of the typical item - much smaller ones let big items occupy lots
+    of cells, much bigger ones put lots of items into each cell.
+    '''
+
+    def __init__(self, cell_size=64):
+        super(SpatialHash, self).__init__()
+        self.cell_size = cell_size
+        self._cells = dict()  # (cx, cy) -> set of items
+        self._items = dict()  # item -> [rect, cell range]
+
+    def __repr__(self):
+        return '<SpatialHash(cell_size = %s, items = %d, cells = %d)>' % (
+            self.cell_size, len(self._items), len(self._cells))
+
+    def __len__(self):
+        return len(self._items)
+
+    def __contains__(self, item):
+        return item in self._items
+
+    def __iter__(self):
+        return iter(self._items)
+
+    def _get_range(self, x1, y1, x2, y2):
+        size = self.cell_size
+        # Floor division rounds towards negative infinity like floor().
+        return int(x1 // size), int(y1 // size), int(x2 // size), int(y2 // size)
+
+    def _add_cells(self, item, cx1, cy1, cx2, cy2):
+        cells = self._cells
+        for cx in xrange(cx1, cx2 + 1):
+            for cy in xrange(cy1, cy2 + 1):
+                try:
+                    cells[cx, cy].add(item)
+                except KeyError:
+                    cells[cx, cy] = set([item])
+
+    def _remove_cells(self, item, cx1, cy1, cx2, cy2):
+        cells = self._cells
+        for cx in xrange(cx1, cx2 + 1):
+            for cy in xrange(cy1, cy2 + 1):
+                cell = cells[cx, cy]
+                cell.discard(item)
+                if not cell:
+                    del cells[cx, cy]
+
+    def update(self, item, rect):
+        '''Adds item with its bounding rect (x1, y1, x2, y2) or moves it.'''
+        size = self.cell_size
+        x1, y1, x2, y2 = rect
+        area = int(x1 // size), int(y1 // size), int(x2 // size), int(y2 // size)
+        try:
+            entry = self._items[item]
+        except KeyError:
+            self._items[item] = [rect, area]
+            self._add_cells(item, *area)
+            return
+        entry[0] = rect
+        if entry[1] != area:
+            self._remove_cells(item, *entry[1])
+            self._add_cells(item, *area)
+            entry[1] = area
+
+    add = update
+
+    def remove(self, item):
+        '''Removes item. Unknown items are being ignored.'''
+        entry = self._items.pop(item, None)
+        if entry is not None:
+            self._remove_cells(item, *entry[1])
+
+    def clear(self):
+        self._cells.clear()
+        self._items.clear()
+
+    def get_rect(self, item):
+        return self._items[item][0]
+
+    def _get_candidates(self, x1, y1, x2, y2):
+        cells = self._cells
+        cx1, cy1, cx2, cy2 = self._get_range(x1, y1, x2, y2)
+        if (cx2 - cx1 + 1) * (cy2 - cy1 + 1) > len(cells):
+            # Huge area. Looking at the occupied cells is cheaper.
+            return set().union(*[
+                items for (cx, cy), items in cells.iteritems()
+                if cx1 <= cx <= cx2 and cy1 <= cy <= cy2
+            ])
+        candidates = set()
+        for cx in xrange(cx1, cx2 + 1):
+            for cy in xrange(cy1, cy2 + 1):
+                items = cells.get((cx, cy))
+                if items:
+                    candidates.update(items)
+        return candidates
+
+    def get_pairs(self):
+        '''
+        Returns a set of all pairs of items (ordered by id) sharing a cell.
+        Their rects don't have to intersect - it's only a broad phase.
+        '''
+        pairs = set()
+        add = pairs.add
+        for items in self._cells.itervalues():
+            if len(items) < 2:
+                continue
+            items = sorted(items, key=id)
+            for pos, item in enumerate(items):
+                for other in items[pos + 1:]:
+                    add((item, other))
+        return pairs
+
+    def query_point(self, x, y):
+        '''Returns a list of all items whose rect contains the point.'''
+        size = self.cell_size
+        items = self._cells.get((int(x // size), int(y // size)))
+        if not items:
+            return []
+        rects = self._items
+        result = []
+        for item in items:
+            x1, y1, x2, y2 = rects[item][0]
+            if x1 <= x < x2 and y1 <= y < y2:
+                result.append(item)
+        return result
+
+    def query_rect(self, x, y, w, h):
+        '''Returns a list of all items whose rect intersects with the rect.'''
+        x2, y2 = x + w, y + h
+        rects = self._items
+        result = []
+        for item in self._get_candidates(x, y, x2, y2):
+            i_x1, i_y1, i_x2, i_y2 = rects[item][0]
+            if i_x1 < x2 and x < i_x2 and i_y1 < y2 and y < i_y2:
+                result.append(item)
+        return result
+
+    def query_radius(self, x, y, radius):
+        '''Returns a list of all items whose rect intersects with the circle.'''
+        rects = self._items
+        result = []
+        square = radius * radius
+        for item in self._get_candidates(x - radius, y - radius, x + radius, y + radius):
+            x1, y1, x2, y2 = rects[item][0]
+            # Distance to the nearest point of the rect.
+            d_x = x1 - x if x < x1 else (x - x2 if x > x2 else 0)
+            d_y = y1 - y if y < y1 else (y - y2 if y > y2 else 0)
+            if d_x * d_x + d_y * d_y <= square:
+                result.append(item)
+        return result
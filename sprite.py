@@ -4,6 +4,7 @@
 # @copyright Oktay Acikalin
 # @license   MIT (LICENSE.txt)
 
+from math import hypot
 
 from diamond import pyglet
 from diamond.vault import Vault
@@ -11,6 +12,12 @@ from diamond.vault import Vault
 
 class Sprite(pyglet.sprite.Sprite):
 
+    # Offset of the node within a static subtree. See Node.static.
+    _static_offset = (0, 0)
+    # Spatial index of the node and the offset of the node within it.
+    # See Node.enable_spatial_index.
+    _spatial = None
+
     def __init__(self, vault, parent_node=None, position=None, name=None, usage='dynamic'):
         self._vault = vault
         self._name = name
@@ -77,6 +84,64 @@ class Sprite(pyglet.sprite.Sprite):
     # position = property(lambda self: (self._x_rel, self._y_rel),
     #                     lambda self, pos: self.set_position(*pos))
 
+    def _update_position(self):
+        x, y = self._static_offset
+        if not x and not y:
+            super(Sprite, self)._update_position()
+        else:
+            # Bake the offset into the vertices without touching the position.
+            s_x, s_y = self._x, self._y
+            self._x, self._y = s_x + x, s_y + y
+            try:
+                super(Sprite, self)._update_position()
+            finally:
+                self._x, self._y = s_x, s_y
+        if self._spatial is not None:
+            self._update_spatial()
+
+    def get_frame(self):
+        '''Returns the vault frame (VaultSpriteActionFrame) being shown.'''
+        return self._vault.get_action(self._action).get_frame(
+            self._frame_index if self._animation is not None else 0)
+
+    def get_bounds(self):
+        '''
+        Returns the rect (x1, y1, x2, y2) covered by the sprite relative to
+        its node. Rotated sprites get the rect covering all rotations.
+        '''
+        image = self._texture
+        scale = self._scale
+        x, y = self._x, self._y
+        a_x, a_y = image.anchor_x * scale, image.anchor_y * scale
+        w, h = image.width * scale, image.height * scale
+        if self._rotation:
+            radius = max(hypot(c_x, c_y) for c_x in (a_x, w - a_x) for c_y in (a_y, h - a_y))
+            return x - radius, y - radius, x + radius, y + radius
+        return x - a_x, y - a_y, x - a_x + w, y - a_y + h
+
+    def _update_spatial(self):
+        index, o_x, o_y = self._spatial
+        if self._visible:
+            x1, y1, x2, y2 = self.get_bounds()
+            index.update(self, (x1 + o_x, y1 + o_y, x2 + o_x, y2 + o_y))
+        else:
+            index.remove(self)
+
+    def _set_spatial(self, spatial):
+        old = self._spatial
+        if old is not None and (spatial is None or spatial[0] is not old[0]):
+            old[0].remove(self)
+        self._spatial = spatial
+        if spatial is not None:
+            self._update_spatial()
+
+    def _set_static_offset(self, group, x, y):
+        if self.group is not group:
+            self.group = group
+        if (x, y) != self._static_offset:
+            self._static_offset = x, y
+            self._update_position()
+
     def _update_inherited_visibility(self):
         new_visibility = self._my_visibility and self._parent_node._inherited_visibility
         if new_visibility != self._visible:
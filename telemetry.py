@@ -0,0 +1,149 @@
+# Writes per-frame telemetry records into a file or UNIX socket.
+#
+# @author    Oktay Acikalin <oktay.acikalin@gmail.com>
+# @copyright Oktay Acikalin
+# @license   MIT (LICENSE.txt)
+
+import json
+import struct
+import socket
+from collections import OrderedDict
+from threading import Thread
+from Queue import Queue, Full
+
+from diamond.helper.logging import log_error
+
+
+# Order and binary layout of the fields of a record.
+FIELDS = OrderedDict([
+    ('frame', 'I'),
+    ('time', 'd'),  # msecs since start of the engine clock
+    ('frame_msecs', 'f'),
+    ('update_msecs', 'f'),
+    ('dropped_update_steps', 'I'),
+    ('queued_ticks', 'I'),
+    ('sectors', 'I'),
+    ('sectors_built', 'I'),
+    ('vault_cache_bytes', 'Q'),
+    ('vault_cache_hits', 'I'),
+    ('vault_cache_loads', 'I'),
+    ('gc0', 'I'),
+    ('gc1', 'I'),
+    ('gc2', 'I'),
+    ('dropped_records', 'I'),
+])
+
+RECORD = struct.Struct('<' + ''.join(FIELDS.values()))
+BINARY_MAGIC = 'DTEL1\n'
+
+
+def read_records(input):
+    '''Yields the records of a telemetry file (both formats) as dicts.'''
+    magic = input.read(len(BINARY_MAGIC))
+    if magic == BINARY_MAGIC:
+        header = json.loads(input.readline())
+        fields = header['fields']
+        record = struct.Struct(str(header['format']))
+        while True:
+            data = input.read(record.size)
+            if len(data) < record.size:
+                break
+            yield dict(zip(fields, record.unpack(data)))
+    else:
+        first = magic + input.readline()
+        if first.strip():
+            yield json.loads(first)
+        for line in input:
+            if line.strip():
+                yield json.loads(line)
+
+
+class TelemetrySink(object):
+    '''
+    Takes records via write() and hands them over to a writer thread. The
+    queue is bounded and write() never blocks. Records get dropped (and
+    counted) if the writer cannot keep up.
+
+    target is a filename or "unix:<path>" for connecting to a UNIX socket.
+    format is "jsonl" (one JSON object per line) or "binary" (a header
+    describing the layout followed by fixed-size records, see FIELDS).
+    '''
+
+    FORMAT_JSONL = 'jsonl'
+    FORMAT_BINARY = 'binary'
+
+    def __init__(self, target, format=FORMAT_JSONL, queue_size=1024):
+        super(TelemetrySink, self).__init__()
+        if format not in (self.FORMAT_JSONL, self.FORMAT_BINARY):
+            raise Exception('Unknown telemetry format: %s' % format)
+        self.target = target
+        self.format = format
+        self.dropped = 0
+        self.written = 0
+        self._queue = Queue(maxsize=queue_size)
+        self._socket = None
+        if target.startswith('unix:'):
+            self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self._socket.connect(target[5:])
+            self._file = self._socket.makefile('wb')
+        else:
+            self._file = open(target, 'wb')
+        if format == self.FORMAT_BINARY:
+            self._file.write(BINARY_MAGIC)
+            self._file.write(json.dumps(dict(fields=FIELDS.keys(), format=RECORD.format)) + '\n')
+        self._thread = Thread(target=self._run, name='TelemetrySink')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def __repr__(self):
+        return '<TelemetrySink(target = %s, format = %s, written = %d, dropped = %d)>' % (
+            self.target, self.format, self.written, self.dropped)
+
+    def write(self, record):
+        '''Queues a record (dict with the keys of FIELDS). Returns False if it got dropped.'''
+        record['dropped_records'] = self.dropped
+        try:
+            self._queue.put_nowait(record)
+        except Full:
+            self.dropped += 1
+            return False
+        return True
+
+    def _encode(self, record):
+        if self.format == self.FORMAT_BINARY:
+            return RECORD.pack(*[record.get(name, 0) for name in FIELDS])
+        return json.dumps(record, separators=(',', ':')) + '\n'
+
+    def _run(self):
+        get = self._queue.get
+        output = self._file
+        while True:
+            record = get()
+            if record is None:
+                break
+            try:
+                output.write(self._encode(record))
+                self.written += 1
+                # Keep the data flowing but don't flush on every record.
+                if self._queue.empty():
+                    output.flush()
+            except (IOError, socket.error, struct.error) as excp:
+                log_error('Telemetry sink %s failed: %s' % (self.target, excp))
+                break
+        # Keep draining so that write() keeps dropping instead of blocking.
+        while record is not None:
+            record = get()
+
+    def close(self):
+        '''Writes out all queued records and closes the target.'''
+        if self._thread is None:
+            return
+        self._queue.put(None)
+        self._thread.join()
+        self._thread = None
+        try:
+            self._file.close()
+            if self._socket is not None:
+                self._socket.close()
+        except (IOError, socket.error):
+            pass
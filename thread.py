@@ -4,9 +4,9 @@
 # @copyright Oktay Acikalin
 # @license   MIT (LICENSE.txt)
 
-from threading import Thread
+from threading import Thread, Condition
 
-from diamond.clock import get_ticks, wait
+from diamond.clock import get_ticks
 
 
 class AbstractThread(Thread):
@@ -15,39 +15,77 @@ class AbstractThread(Thread):
     STATE_STOP = 8
     STATE_STOPPED = 9
 
-    def __init__(self):
+    def __init__(self, clock=None):
         super(AbstractThread, self).__init__()
         self.state = AbstractThread.STATE_STOPPED
+        self.clock = clock
         self.sleep_timeout = 1.0 / 60 * 1000.0  # TODO should we base this on our framerate or vsync?
+        # How long to wait if tick() returns no next deadline. None means
+        # waiting until wakeup() is being called.
+        self.idle_timeout = self.sleep_timeout
+        self._wakeup = Condition()
+        self._wakeup_pending = False
+        if clock is not None:
+            clock.add_observer(self)
+
+    def set_clock(self, clock):
+        '''
+        Binds the thread to a clock (e.g. a VirtualClock) which is being
+        used for the deadlines returned by tick(). Pass None for using the
+        engine clock.
+        '''
+        if self.clock is not None:
+            self.clock.remove_observer(self)
+        self.clock = clock
+        if clock is not None:
+            clock.add_observer(self)
+        self.wakeup()
+
+    def get_ticks(self):
+        if self.clock is not None:
+            return self.clock.get_ticks()
+        return get_ticks()
+
+    def _get_timeout(self, next_tick):
+        '''Returns real msecs until next_tick or None if it's not foreseeable.'''
+        msecs = max(0, next_tick - self.get_ticks())
+        if self.clock is not None and msecs:
+            return self.clock.to_source_msecs(msecs)
+        return msecs
 
     def tick(self):
-        '''Overwrite this method for doing your stuff.'''
+        '''
+        Overwrite this method for doing your stuff.
+        Return the timestamp (in msecs) of when to be called again or None.
+        '''
         raise NotImplemented()
 
+    def wakeup(self):
+        '''Interrupts the current wait and lets the thread call tick() again.'''
+        with self._wakeup:
+            self._wakeup_pending = True
+            self._wakeup.notify()
+
     def run(self):
         self.state = AbstractThread.STATE_RUNNING
+        condition = self._wakeup
         while self.state == AbstractThread.STATE_RUNNING:
-            start = get_ticks()
             next_tick = self.tick()
-            duration = get_ticks() - start
-            # print duration, self.sleep_timeout
             if next_tick is not None:
-                # print start, next_tick, next_tick - start
-                sleep = max(start, next_tick) - start
+                timeout = self._get_timeout(next_tick)
             else:
-                # print None
-                sleep = 0
-            timeout = self.sleep_timeout - duration
-            # print 1, timeout, sleep
-            timeout += sleep
-            # print 2, timeout
-            timeout = max(self.sleep_timeout, timeout)
-            # print 3, timeout
-            wait(timeout)
+                timeout = self.idle_timeout
+            with condition:
+                # Don't sleep if someone changed something while we ticked.
+                if not self._wakeup_pending and timeout != 0 and \
+                        self.state == AbstractThread.STATE_RUNNING:
+                    condition.wait(timeout / 1000.0 if timeout is not None else None)
+                self._wakeup_pending = False
 
     def join(self):
         if self.state == AbstractThread.STATE_RUNNING:
             self.state = AbstractThread.STATE_STOP
+            self.wakeup()
             super(AbstractThread, self).join()
             self.state = self.STATE_STOPPED
         #     print 'Thread joined:', self
@@ -4,12 +4,18 @@
 # @copyright Oktay Acikalin
 # @license   MIT (LICENSE.txt)
 
+import weakref
 from inspect import getargspec
 from itertools import takewhile
+from collections import deque
 from types import FunctionType
+from threading import RLock
 
 from diamond import event
-from diamond.helper.weak_ref import Wrapper
+from diamond import profiler
+from diamond import ownership
+from diamond.helper.logging import log_warning
+from diamond.helper.weak_ref import Wrapper, callable_key
 from diamond.helper.ordered_set import OrderedSet
 from diamond.thread import AbstractThread
 from diamond.clock import get_ticks, wait
@@ -46,16 +52,50 @@ class BreakTickerLoop(Exception):
     pass
 
 
+# code object -> whether the function wants the current_ticker argument.
+_wants_current_ticker = dict()
+
+
+def wants_current_ticker(func):
+    '''Returns True if func has a current_ticker argument. Cached per code object.'''
+    if type(func) is Wrapper:
+        func = func.function
+    func = getattr(func, 'im_func', func)
+    key = getattr(func, '__code__', func)
+    try:
+        return _wants_current_ticker[key]
+    except KeyError:
+        result = _wants_current_ticker[key] = 'current_ticker' in getargspec(func).args
+        return result
+
+
+def _get_death_handler(ticker, tick):
+    ticker, tick = weakref.ref(ticker), weakref.ref(tick)
+
+    def on_death(wrapper):
+        ticker_, tick_ = ticker(), tick()
+        if ticker_ is not None and tick_ is not None:
+            # Unindex right away. A new instance might reuse the id of the
+            # dead one and with it the index key of the tick.
+            ticker_._unindex_tick(tick_)
+            ticker_._dead_ticks.append(tick_)
+    return on_death
+
+
 class Ticker(AbstractThread):
     # TODO try make use of http://docs.python.org/tutorial/datastructures.html#using-lists-as-queues
 
-    def __init__(self, limit=25, timeout=20):
-        super(Ticker, self).__init__()
+    def __init__(self, limit=25, timeout=20, clock=None):
+        super(Ticker, self).__init__(clock=clock)
         self.tickers = OrderedSet()  # Use OrderedSet. Removing is much faster here.
         self.is_dirty = False
+        self._dead_ticks = deque()  # Ticks whose weakly wrapped function died.
+        self._index = dict()  # callable_key -> dict of id -> ticks of that callable
+        self._owners = dict()  # id of instance -> callable_keys of its methods
+        self._has_owned_ticks = False  # Any ticks added with an owner?
         self.handle_limit_per_iteration = limit
         self.drop_outdated_msecs = timeout
-        self.__is_paused = False
+        self.__paused_at = None  # Time of pause(). Might be 0 on virtual clocks.
         self.listeners = [
             event.add_listener(self._on_dump_event, 'ticker.dump'),
             event.add_listener(self.pause, 'ticker.pause'),
@@ -65,7 +105,10 @@ class Ticker(AbstractThread):
         # print 'Init ticker:', self
         # import traceback
         # traceback.print_stack()
-        self.is_idle = True
+        self.idle_timeout = None  # Sleep until add() or unpause() wakes us up.
+        self._tick_lock = RLock()
+        self._is_ticking = False
+        self._next_deadline = None
 
     def teardown(self):
         self.clear()
@@ -74,37 +117,61 @@ class Ticker(AbstractThread):
         # print 'Ticker.__del__(%s)' % self
         event.remove_listeners(self.listeners)
 
-    def get_ticks(self):
-        # print get_ticks()
-        return get_ticks()
+    def set_clock(self, clock):
+        # Move our timeline over to the new clock.
+        diff = (clock.get_ticks() if clock is not None else get_ticks()) - self.get_ticks()
+        with self._tick_lock:
+            for ticker in self.tickers:
+                ticker[2] += diff
+            self._next_deadline = None
+        super(Ticker, self).set_clock(clock)
 
     def _on_dump_event(self, context):
         return self.tickers
 
+    is_idle = property(lambda self: not self._is_ticking)
+
+    def _wakeup_if_earlier(self, timestamp):
+        # Only wake our thread if it would otherwise oversleep the timestamp.
+        # If it's ticking right now we cannot know if it has seen the new
+        # timestamp already. So we make sure that it ticks once more.
+        if self.state != AbstractThread.STATE_RUNNING:
+            return
+        next_deadline = self._next_deadline
+        if self._is_ticking or next_deadline is None or timestamp < next_deadline:
+            self.wakeup()
+
     def pause(self):
-        if not self.__is_paused:
+        if self.__paused_at is None:
             # print 'Ticker.pause(%s)' % self
-            self.__is_paused = get_ticks()
+            self.__paused_at = self.get_ticks()
         # Wait until our tick() is done. Usefull if tick is being called in a thread or via versa.
-        while not self.is_idle:
-            wait(5)
+        with self._tick_lock:
+            pass
 
     def unpause(self):
-        if self.__is_paused:
+        if self.__paused_at is not None:
             # print 'Ticker.unpause(%s)' % self
-            diff = get_ticks() - self.__is_paused
+            diff = self.get_ticks() - self.__paused_at
             for ticker in self.tickers:
                 ticker[2] += diff
-            self.__is_paused = False
-
-    def add(self, func, msecs, delay=0, onetime=False, args=[], kwargs={}, dropable=False):
+            self.__paused_at = None
+            self._next_deadline = None
+            if self.state == AbstractThread.STATE_RUNNING:
+                self.wakeup()
+
+    def add(self, func, msecs, delay=0, onetime=False, args=[], kwargs={}, dropable=False, owner=None):
+        '''
+        Calls func every msecs (or once if onetime) starting after delay.
+        If owner is given the tick gets removed by ownership.release(owner)
+        which covers all tickers and listeners of owner. remove_all_for(owner)
+        only removes it from this ticker.
+        '''
         # print 'Ticker.add(%s, %s, %s, %s, %s)' % (func, msecs, delay, args, kwargs)
 
         # What can we do with inline functions and lambdas?
         is_function = isinstance(func, FunctionType)
-        has_closure = func.__closure__ is not None
-        has_free_vars = func.__code__.co_freevars
-        if is_function and has_closure and has_free_vars:
+        if is_function and func.__closure__ is not None and func.__code__.co_freevars:
             msg = ('Never put simple functions/lambdas with vars referencing '
                    'the parent (e.g. class instance, nodes, sprites etc.) into '
                    'events or tickers! These can effectively block the garbage '
@@ -134,6 +201,9 @@ class Ticker(AbstractThread):
             tick = OnetimeTick((func, msecs, timestamp, args, kwargs, dropable))
         else:
             tick = ReoccuringTick((func, msecs, timestamp, args, kwargs, dropable))
+        if type(func) is Wrapper:
+            # Drop the tick as soon as the instance dies.
+            func.add_death_callback(_get_death_handler(self, tick))
         if len(self.tickers):
             # print len(self.tickers)
             # print tick
@@ -142,54 +212,137 @@ class Ticker(AbstractThread):
             if tick[2] < self.tickers[-1][2]:
                 self.is_dirty = True
         self.tickers.add(tick)
+        self._index_tick(tick)
+        if owner is not None:
+            ownership.add_tick(owner, self, tick)
+            self._has_owned_ticks = True
+        self._wakeup_if_earlier(timestamp)
         return tick
 
+    def _index_tick(self, tick):
+        key = callable_key(tick[0])
+        try:
+            self._index[key][id(tick)] = tick
+        except KeyError:
+            self._index[key] = {id(tick): tick}
+            if key[1] is not None:
+                try:
+                    self._owners[key[1]].add(key)
+                except KeyError:
+                    self._owners[key[1]] = set([key])
+
+    def _unindex_tick(self, tick):
+        key = callable_key(tick[0])
+        ticks = self._index.get(key)
+        if ticks is None:
+            return
+        ticks.pop(id(tick), None)
+        if not ticks:
+            self._unindex_key(key)
+
+    def _unindex_key(self, key):
+        self._index.pop(key, None)
+        if key[1] is not None:
+            keys = self._owners.get(key[1])
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._owners[key[1]]
+
     # @dump_args
     def remove(self, func):
-        remove = self.tickers.remove
-        to_be_removed = []
-        to_be_removed_append = to_be_removed.append
-        result = False
-        for ticker in self.tickers:
-            try:
-                func_ = ticker[0]
-                if type(func_) is Wrapper:
-                    func_ = func_.resolve()
-            except ReferenceError:
-                to_be_removed_append(ticker)
-            else:
-                # TODO perhaps only compare func and inst?
-                if func_ == func:
-                    remove(ticker)
-                    result = True
-                    break
-        remove = self.tickers.remove
-        [remove(ticker) for ticker in to_be_removed]
-        return result
+        '''Removes the earliest tick of func. Returns False if there is none.'''
+        ticks = self._index.get(callable_key(func))
+        if not ticks:
+            return False
+        # Skip ticks of dead instances which are still waiting for removal.
+        ticks = [tick for tick in ticks.values()
+                 if type(tick[0]) is not Wrapper or tick[0].is_alive]
+        if not ticks:
+            return False
+        self.remove_many([min(ticks, key=lambda item: item[2])])
+        return True
+
+    def remove_all_for(self, owner):
+        '''
+        Removes all ticks of methods bound to owner and all ticks added with
+        owner=owner from this ticker. Returns their number. Unlike
+        ownership.release(owner) this leaves other tickers and listeners of
+        owner alone.
+        '''
+        keys = self._owners.pop(id(owner), ())
+        ticks = []
+        for key in keys:
+            ticks.extend(self._index.pop(key, {}).itervalues())
+        if self._has_owned_ticks:
+            owned = ownership.get_ticks(owner, self)
+            if owned:
+                ticks = list(set(ticks).union(owned))
+        self.remove_many(ticks)
+        return len(ticks)
 
     # @dump_args
     def remove_many(self, tickers):
         remove = self.tickers.discard
-        [remove(ticker) for ticker in tickers]
+        unindex = self._unindex_tick
+        for ticker in tickers:
+            remove(ticker)
+            unindex(ticker)
+            if 'owner' in ticker.user_data:
+                ownership.remove_tick(self, ticker)
 
     # @dump_args
     def clear(self):
-        is_paused = self.__is_paused
-        self.__is_paused = True
-        self.tickers.clear()
         # Wait until our tick() is done. Usefull if tick is being called in a thread or via versa.
-        # We use a limit here to avoid dead-locks.
+        # We use a limit here to avoid dead-locks. A tick might be waiting for
+        # the thread calling us (e.g. a scene being torn down by the main thread).
         cur_round, max_rounds = 0, 12
-        while not self.is_idle and cur_round < max_rounds:
+        is_locked = self._tick_lock.acquire(False)
+        while not is_locked and cur_round < max_rounds:
             wait(5)
             cur_round += 1
-        self.__is_paused = is_paused
+            is_locked = self._tick_lock.acquire(False)
+        if not is_locked:
+            log_warning('Clearing ticker %s while it is still ticking.' % self)
+        try:
+            # Replace instead of clearing in place. A tick() which is still
+            # running keeps working on the old ones.
+            tickers, self.tickers = self.tickers, OrderedSet()
+            if self._has_owned_ticks:
+                [ownership.remove_tick(self, ticker) for ticker in tickers
+                 if 'owner' in ticker.user_data]
+                self._has_owned_ticks = False
+            self._dead_ticks = deque()
+            self._index = dict()
+            self._owners = dict()
+            self.is_dirty = False
+            self._next_deadline = None
+        finally:
+            if is_locked:
+                self._tick_lock.release()
 
     def tick(self):
         # print 'Ticker.tick(%s) got %d tickers' % (self, len(self.tickers))
-        if self.__is_paused or not self.is_idle:
+        if self.__paused_at is not None or self._is_ticking:
             return
-        self.is_idle = False
+        # Another thread is ticking us right now.
+        if not self._tick_lock.acquire(False):
+            return
+        self._is_ticking = True
+        try:
+            self._next_deadline = next_deadline = self._tick()
+        finally:
+            self._is_ticking = False
+            self._tick_lock.release()
+        return next_deadline
+
+    def _tick(self):
+        dead_ticks = self._dead_ticks
+        if dead_ticks:
+            dead = []
+            while dead_ticks:
+                dead.append(dead_ticks.popleft())
+            self.remove_many(dead)
         if self.is_dirty:
             # tickers = self.tickers.copy()
             # self.tickers.clear()
@@ -208,13 +361,10 @@ class Ticker(AbstractThread):
         for ticker in takewhile(condition, self.tickers):
             func, msecs, dest_time, args, kwargs, dropable = ticker
 
-            # Resolve weak ref.
-            if type(func) is Wrapper:
-                func = func.resolve()
-
-                if func is None:
-                    mark_outdated(ticker)
-                    continue
+            # Calling a wrapper calls its function with the instance.
+            if type(func) is Wrapper and not func.is_alive:
+                mark_outdated(ticker)
+                continue
 
             # TODO Resolve weak args and kwargs.
             # args = [item.resolve() if type(item) is Wrapper else item for item in args]
@@ -238,13 +388,7 @@ class Ticker(AbstractThread):
 
             # print 'Ticker.tick after %d (%d / %d) msecs: %s(*%s, **%s)' % (msecs, dest_time, dest_time - time, func, args, kwargs)
             # print 'dest_time =', dest_time, '; time =', time
-            spec = getargspec(func)
-            spec_args = spec.args
-            # print '*****'
-            # print spec
-            # print spec_args
-            # print kwargs
-            if 'current_ticker' in spec_args:
+            if wants_current_ticker(func):
                 # print 'found param!'
                 kwargs = kwargs.copy()
                 kwargs['current_ticker'] = ticker
@@ -254,9 +398,6 @@ class Ticker(AbstractThread):
                 func(*args, **kwargs)
             except BreakTickerLoop:
                 break_out = True
-            except Exception:
-                self.is_idle = True  # Release lock (wait(), join() etc.).
-                raise
             if type(ticker) is OnetimeTick:
                 mark_outdated(ticker)
             else:
@@ -268,10 +409,12 @@ class Ticker(AbstractThread):
         # if count or len(to_be_removed):
         #     print 'executed %d tickers ; removed %d tickers' % (count, len(to_be_removed))
 
-        self.is_idle = True
         return self.tickers[0][2] if self.tickers else None
 
     def join(self):
         event.remove_listeners(self.listeners)
         self.clear()
         super(Ticker, self).join()
+
+
+profiler.instrument(Ticker, 'tick')
@@ -13,10 +13,13 @@ import csv
 from types import GeneratorType
 
 from diamond import pyglet
+from diamond import profiler
 from diamond.rect import Rect
 from diamond.vault import Vault
 
 from diamond.matrix import Matrix
+from diamond.collision_grid import CollisionGrid
+from diamond.pathfinding import Pathfinder
 from diamond.node import Node
 
 from diamond.decorators import time
@@ -29,6 +32,10 @@ class DummyFrame(object):
 
 class TileMatrixSector(object):
 
+    # Number of sectors currently alive and built so far (for statistics).
+    alive = 0
+    built = 0
+
     # TODO REWORK!!!
     # we need an index of all the sprites we place in the vertex list.
     # then we can modify vertex lists without sparse data.
@@ -50,6 +57,8 @@ class TileMatrixSector(object):
         self._rgb = (255, 255, 255)
         self._groups = dict()
         self._visible = True
+        TileMatrixSector.alive += 1
+        TileMatrixSector.built += 1
 
         for sheet, matrix in matrices.iteritems():
             vault = vaults[sheet]
@@ -77,6 +86,9 @@ class TileMatrixSector(object):
             # Update color.
             r, g, b = self._rgb
             self._vertex_lists[sheet].colors[:] = [r, g, b, int(self._opacity)] * 4 * len(matrix)
+            if profiler.enabled:
+                # v2i + c4B + t3f per vertex.
+                profiler.count('tilematrix.vertex_bytes', num_coords * (8 + 4 + 12))
 
             # print self._vertex_list
 
@@ -93,6 +105,7 @@ class TileMatrixSector(object):
 
     def __del__(self):
         # print('TileMatrixSector.__del__(%s)' % self)
+        TileMatrixSector.alive -= 1
         for vertex_list in self._vertex_lists.itervalues():
             if vertex_list is not None:
                 vertex_list.delete()
@@ -150,6 +163,8 @@ class TileMatrixSector(object):
                     y2 = y1 + s_h
                     vertices.extend([x1, y1, x2, y1, x2, y2, x1, y2])
                 self._vertex_lists[sheet].vertices[:] = vertices
+                if profiler.enabled:
+                    profiler.count('tilematrix.vertex_bytes', len(vertices) * 4)
         else:
             for sheet, matrix in self._matrices.iteritems():
                 vertices = []
@@ -158,6 +173,8 @@ class TileMatrixSector(object):
                     # print frame
                     vertices.extend([0, 0, 0, 0, 0, 0, 0, 0])
                 self._vertex_lists[sheet].vertices[:] = vertices
+                if profiler.enabled:
+                    profiler.count('tilematrix.vertex_bytes', len(vertices) * 4)
 
     def _set_x(self, x):
         if x != self._x:
@@ -246,6 +263,8 @@ class TileMatrixLayer(Node):
         #     print 'sheet', sheet, matrix
         # print 'sector real pos =', self._x_real, self._y_real
         sector = TileMatrixSector(self._vaults, batch, group, matrices, matrix_size, tile_size)
+        if profiler.enabled:
+            profiler.count('tilematrix.sectors.built')
         sector.visible = self._inherited_visibility
         # sector.set_position(self._x_real + x, self._y_real + y)
         sector.set_position(x, y)
@@ -255,8 +274,7 @@ class TileMatrixLayer(Node):
     def remove_sector(self, id):
         del self._sectors[id]
 
-    def _set_visible(self, visible):
-        super(TileMatrixLayer, self)._set_visible(visible)
+    def _on_inherited_visibility_changed(self):
         for x, y, sector in self._sectors.itervalues():
             sector.visible = self._inherited_visibility
 
@@ -606,6 +624,22 @@ class TileMatrix(Node):
         t_w, t_h = self.__tile_size
         return left * t_w, top * t_h, right * t_w, bottom * t_h
 
+    def get_collision_grid(self, layers, is_solid=None):
+        '''
+        Returns a CollisionGrid over the given layers (e.g. passability
+        layers) of the matrix. Its queries take pixels relative to this
+        tilematrix.
+        '''
+        return CollisionGrid(self.__matrix, layers, self.__tile_size, is_solid)
+
+    def get_pathfinder(self, layers, is_solid=None, workers=2):
+        '''
+        Returns a Pathfinder searching paths between tiles around the solid
+        tiles of the given layers. Call join() on it when done - this also
+        closes its grid.
+        '''
+        return Pathfinder(self.get_collision_grid(layers, is_solid), workers, close_grid=True)
+
     def get_tile_id_at(self, x, y, z):
         value = self.__matrix.get_point(x, y, z)
         if value is not None:
@@ -701,3 +735,6 @@ class TileMatrix(Node):
             return [map(int, row[:3]) + row[3:] for row in reader]
         else:
             return []
+
+
+profiler.instrument(TileMatrix, 'update_sectors')
@@ -0,0 +1,188 @@
+# Benchmarks for the hot paths of the engine.
+#
+# @author    Oktay Acikalin <oktay.acikalin@gmail.com>
+# @copyright Oktay Acikalin
+# @license   MIT (LICENSE.txt)
+
+import os
+import gc
+import sys
+import platform
+from collections import OrderedDict
+from fnmatch import fnmatch
+from itertools import product
+from datetime import datetime
+
+from diamond.clock import monotonic
+from diamond.helper.stats import percentile
+
+
+FORMAT_VERSION = 1
+
+registry = OrderedDict()
+
+
+def benchmark(name, **params):
+    '''
+    Registers a benchmark setup function. Every param is a list of values and
+    the benchmark gets run once for every combination of them. The setup
+    function receives one value per param and has to return a Case.
+    '''
+    def decorator(func):
+        registry[name] = (func, params)
+        return func
+    return decorator
+
+
+class SkipBenchmark(Exception):
+    '''Raised by setup functions if a case can't run here (e.g. without a display).'''
+
+
+class Case(object):
+    '''
+    A prepared benchmark. Calling run() has to do ops operations which are
+    being timed as a whole. teardown() gets called once after measuring.
+    '''
+
+    def __init__(self, run, ops=1, teardown=None):
+        super(Case, self).__init__()
+        self.run = run
+        self.ops = ops
+        self.teardown = teardown
+
+    def __repr__(self):
+        return '<Case(run = %s, ops = %d)>' % (self.run, self.ops)
+
+
+def load_benchmarks():
+    '''
+    Imports all bench_* modules of this package which fills the registry.
+    Modules touching OpenGL have to import it within their setup functions.
+    Otherwise listing or running any benchmark fails without a display.
+    '''
+    path = os.path.dirname(os.path.abspath(__file__))
+    for filename in sorted(os.listdir(path)):
+        name, ext = os.path.splitext(filename)
+        if name.startswith('bench_') and ext == '.py':
+            __import__('%s.%s' % (__name__, name))
+    return registry
+
+
+def get_combinations(params):
+    keys = sorted(params)
+    for values in product(*[params[key] for key in keys]):
+        yield OrderedDict(zip(keys, values))
+
+
+def get_case_id(name, params):
+    if not params:
+        return name
+    return '%s[%s]' % (name, ','.join(
+        '%s=%s' % (key, str(value).replace(' ', '')) for key, value in params.iteritems()))
+
+
+def measure(case, min_time=1.0, min_calls=5, max_calls=1000000, warmup=1):
+    '''
+    Calls the case until it ran for at least min_time seconds and min_calls
+    times. The garbage collector is disabled while timing (like timeit does)
+    for getting comparable numbers.
+    '''
+    run = case.run
+    for count in xrange(warmup):
+        run()
+    samples = []
+    append = samples.append
+    total = 0.0
+    gc.collect()
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        while (total < min_time or len(samples) < min_calls) and len(samples) < max_calls:
+            start = monotonic()
+            run()
+            duration = monotonic() - start
+            total += duration
+            append(duration * 1000.0)
+    finally:
+        if gc_enabled:
+            gc.enable()
+    samples.sort()
+    ops = case.ops * len(samples)
+    return OrderedDict(
+        calls=len(samples),
+        ops=ops,
+        ops_per_call=case.ops,
+        seconds=total,
+        ops_per_sec=ops / total if total else 0.0,
+        msecs_per_call=OrderedDict(
+            min=samples[0],
+            avg=sum(samples) / len(samples),
+            p50=percentile(samples, 50),
+            p95=percentile(samples, 95),
+            p99=percentile(samples, 99),
+            max=samples[-1],
+        ),
+    )
+
+
+def run_benchmarks(patterns=None, min_time=1.0, log=None):
+    '''
+    Runs all registered benchmarks whose name or case ID matches one of the
+    given shell patterns and returns the results as a JSON-ready dict.
+    Cases raising SkipBenchmark on setup are left out of the results.
+    '''
+    results = []
+    for name, (setup, params) in registry.iteritems():
+        for combination in get_combinations(params):
+            case_id = get_case_id(name, combination)
+            if patterns and not any(fnmatch(name, pattern) or fnmatch(case_id, pattern)
+                                    for pattern in patterns):
+                continue
+            try:
+                case = setup(**combination)
+            except SkipBenchmark as excp:
+                if log is not None:
+                    log('%-60s skipped: %s' % (case_id, excp))
+                continue
+            try:
+                result = measure(case, min_time=min_time)
+            finally:
+                if case.teardown is not None:
+                    case.teardown()
+            result['id'] = case_id
+            result['name'] = name
+            result['params'] = combination
+            results.append(result)
+            if log is not None:
+                log('%-60s %14.1f ops/sec  p50 %9.4f  p99 %9.4f msecs' % (
+                    case_id, result['ops_per_sec'],
+                    result['msecs_per_call']['p50'], result['msecs_per_call']['p99']))
+    return OrderedDict(
+        version=FORMAT_VERSION,
+        created=datetime.utcnow().isoformat(),
+        python=sys.version.split()[0],
+        implementation=platform.python_implementation(),
+        platform=platform.platform(),
+        min_time=min_time,
+        results=results,
+    )
+
+
+def compare(baseline, current, threshold=10.0):
+    '''
+    Compares the ops/sec of two result sets. Returns a list of
+    (case ID, baseline ops/sec, current ops/sec, change in percent,
+    is regression) for all cases found in both sets. A case regressed if
+    it got slower by more than threshold percent.
+    '''
+    previous = dict((result['id'], result) for result in baseline['results'])
+    rows = []
+    for result in current['results']:
+        try:
+            before = previous[result['id']]['ops_per_sec']
+        except KeyError:
+            continue
+        after = result['ops_per_sec']
+        change = (after - before) / before * 100.0 if before else 0.0
+        rows.append((result['id'], before, after, change, change < -threshold))
+    return rows
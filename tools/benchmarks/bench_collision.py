@@ -0,0 +1,104 @@
+# Benchmarks for the collision world and grid.
+#
+# @author    Oktay Acikalin <oktay.acikalin@gmail.com>
+# @copyright Oktay Acikalin
+# @license   MIT (LICENSE.txt)
+
+import random
+
+from diamond.collision import CollisionWorld
+from diamond.collision_grid import CollisionGrid
+from diamond.matrix import Matrix
+from diamond.helper.mask import Mask
+from diamond.tools.benchmarks import benchmark, Case
+
+
+class _Body(object):
+
+    def __init__(self, x, y, size):
+        self.rect = [x, y, size, size]
+
+    def get_rect(self):
+        return self.rect
+
+
+@benchmark('collision.tick', bodies=[1000, 10000, 30000], sources=[0.1, 1.0])
+def bench_tick(bodies, sources):
+    '''Moves all bodies and ticks. A part of them are sources hitting each other.'''
+    rnd = random.Random(bodies)
+    # Keep the density the same no matter the amount of bodies.
+    area = int((bodies * 1024) ** 0.5) * 2
+    items = [_Body(rnd.uniform(0, area), rnd.uniform(0, area), 16) for count in xrange(bodies)]
+    world = CollisionWorld('bench.collision', cell_size=32)
+    every = int(1 / sources)
+    for pos, item in enumerate(items):
+        world.add(item, is_source=pos % every == 0)
+    world.tick()
+    step = [1]
+
+    def run():
+        step[0] = offset = -step[0]
+        for item in items:
+            item.rect[0] += offset
+        world.tick()
+
+    return Case(run, ops=bodies)
+
+
+@benchmark('collision.mask_overlap', size=[32, 128])
+def bench_mask_overlap(size):
+    '''Tests two half transparent masks of the given size at 100 offsets.'''
+    rnd = random.Random(size)
+    data = ''.join('\x00\x00\x00' + rnd.choice('\x00\xff') for count in xrange(size * size))
+    mask = Mask.from_alpha(data, size, size)
+    offsets = [(rnd.randint(-size, size), rnd.randint(-size, size)) for count in xrange(100)]
+
+    def run():
+        overlap = mask.overlap
+        for x, y in offsets:
+            overlap(mask, x, y)
+
+    return Case(run, ops=len(offsets))
+
+
+def _make_grid(density, size=200):
+    rnd = random.Random(size)
+    matrix = Matrix()
+    matrix.sector_size = 10, 10
+    for count in xrange(int(size * size * density)):
+        matrix.set_point(rnd.randrange(size), rnd.randrange(size), 0, 'sheet/1')
+    return CollisionGrid(matrix, [0], (16, 16))
+
+
+@benchmark('collision_grid.raycast', density=[0.01, 0.1])
+def bench_grid_raycast(density):
+    '''Casts 100 rays across a 200x200 tiles map with the given share of solid tiles.'''
+    grid = _make_grid(density)
+    rnd = random.Random(0)
+    rays = [[rnd.uniform(0, 3200) for count in xrange(4)] for ray in xrange(100)]
+    # Extract all sectors beforehand.
+    [grid.raycast(*ray) for ray in rays]
+
+    def run():
+        raycast = grid.raycast
+        for x1, y1, x2, y2 in rays:
+            raycast(x1, y1, x2, y2)
+
+    return Case(run, ops=len(rays))
+
+
+@benchmark('collision_grid.sweep_aabb', density=[0.01, 0.1], speed=[8, 64])
+def bench_grid_sweep_aabb(density, speed):
+    '''Moves 100 rects of 24x32 pixels by up to speed pixels per axis.'''
+    grid = _make_grid(density)
+    rnd = random.Random(0)
+    moves = [(rnd.uniform(100, 3000), rnd.uniform(100, 3000), 24, 32,
+              rnd.uniform(-speed, speed), rnd.uniform(-speed, speed)) for count in xrange(100)]
+    [grid.sweep_aabb(*move) for move in moves]
+
+    def run():
+        sweep_aabb = grid.sweep_aabb
+        for x, y, w, h, d_x, d_y in moves:
+            sweep_aabb(x, y, w, h, d_x, d_y)
+
+    return Case(run, ops=len(moves))
@@ -0,0 +1,44 @@
+# Benchmarks for the event system.
+#
+# @author    Oktay Acikalin <oktay.acikalin@gmail.com>
+# @copyright Oktay Acikalin
+# @license   MIT (LICENSE.txt)
+
+from diamond import event
+from diamond.array import Array
+from diamond.tools.benchmarks import benchmark, Case
+
+
+class _Receiver(object):
+
+    def __init__(self):
+        self.calls = 0
+
+    def on_event(self, context):
+        self.calls += 1
+
+
+@benchmark('event.emit', listeners=[10, 100, 1000], filtered=[False, True])
+def bench_emit(listeners, filtered):
+    '''
+    Emits one event with the given amount of listeners. If filtered, every
+    listener filters on a context value and only one of them matches.
+    '''
+    receiver = _Receiver()
+    handles = []
+    for count in xrange(listeners):
+        if filtered:
+            handles.append(event.add_listener(receiver.on_event, 'bench.emit', context__id__eq=count))
+        else:
+            handles.append(event.add_listener(receiver.on_event, 'bench.emit'))
+    context = Array(id=listeners // 2)
+
+    def run():
+        event.emit('bench.emit', context)
+
+    def teardown():
+        event.remove_listeners(handles)
+
+    # Keep the receiver alive - listeners only hold weak references.
+    run.receiver = receiver
+    return Case(run, teardown=teardown)
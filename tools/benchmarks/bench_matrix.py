@@ -0,0 +1,37 @@
+# Benchmarks for the matrix.
+#
+# @author    Oktay Acikalin <oktay.acikalin@gmail.com>
+# @copyright Oktay Acikalin
+# @license   MIT (LICENSE.txt)
+
+from diamond.matrix import Matrix
+from diamond.tools.benchmarks import benchmark, Case
+from diamond.tools.benchmarks.fixtures import make_world
+
+
+@benchmark('matrix.get_rect', size=[(20, 15), (40, 30)], world=[200])
+def bench_get_rect(size, world):
+    '''Fetches a viewport sized rect while scrolling one tile per call.'''
+    matrix = Matrix()
+    matrix.data_path = make_world(world, world)
+    w, h = size
+    state = dict(x=0)
+
+    def run():
+        x = state['x'] = (state['x'] + 1) % (world - w)
+        matrix.get_rect(x, x % (world - h), w, h)
+
+    return Case(run)
+
+
+@benchmark('matrix.save_data', world=[50, 200])
+def bench_save_data(world):
+    '''Writes out a completely loaded world.'''
+    matrix = Matrix()
+    matrix.data_path = make_world(world, world)
+    matrix.get_rect(0, 0, world, world)
+
+    def run():
+        matrix.save_data()
+
+    return Case(run)
@@ -0,0 +1,132 @@
+# Benchmarks for the scene graph. These need a working OpenGL context.
+#
+# @author    Oktay Acikalin <oktay.acikalin@gmail.com>
+# @copyright Oktay Acikalin
+# @license   MIT (LICENSE.txt)
+
+# GL modules get imported after get_window(). See load_benchmarks().
+from diamond.tools.benchmarks import benchmark, Case
+from diamond.tools.benchmarks.fixtures import get_window, make_tilesheet
+
+
+def _make_chain(parent, depth):
+    from diamond.node import Node
+    node = parent
+    for count in xrange(depth):
+        child = Node()
+        node.add_node(child)
+        node = child
+    return node
+
+
+def _make_tree(parent, depth, fanout, sprites, sheet):
+    from diamond.node import Node
+    from diamond.sprite import Sprite
+    nodes = [parent]
+    for level in xrange(depth):
+        children = []
+        for node in nodes:
+            for count in xrange(fanout):
+                child = Node()
+                node.add_node(child)
+                children.append(child)
+        nodes = children
+    for node in nodes:
+        node.add_sprites(Sprite.make_many(sheet, amount=sprites))
+    return nodes
+
+
+@benchmark('node.add_sprites', sprites=[100, 1000], depth=[1, 10])
+def bench_add_sprites(sprites, depth):
+    '''Adds sprites to the leaf of a chain of nodes and removes them again.'''
+    window = get_window()
+    from diamond.node import Node
+    from diamond.sprite import Sprite
+    root = Node()
+    root.add_to(window.root_node)
+    leaf = _make_chain(root, depth)
+    items = Sprite.make_many(make_tilesheet(), amount=sprites)
+
+    def run():
+        leaf.add_sprites(items)
+        leaf.remove_all()
+
+    def teardown():
+        root.remove_all()
+        root.remove_from_parent()
+
+    return Case(run, ops=sprites, teardown=teardown)
+
+
+@benchmark('node.visibility', depth=[3, 6], fanout=[2], sprites=[10])
+def bench_visibility(depth, fanout, sprites):
+    '''Hides and shows the root of a tree with sprites on every leaf.'''
+    window = get_window()
+    from diamond.node import Node, resolve_updates
+    root = Node()
+    root.add_to(window.root_node)
+    _make_tree(root, depth, fanout, sprites, make_tilesheet())
+
+    def run():
+        root.hide()
+        resolve_updates()
+        root.show()
+        resolve_updates()
+
+    def teardown():
+        root.remove_all()
+        root.remove_from_parent()
+        resolve_updates()
+
+    return Case(run, ops=2, teardown=teardown)
+
+
+@benchmark('node.visibility_toggles', depth=[6], fanout=[2], sprites=[10], toggles=[1, 10])
+def bench_visibility_toggles(depth, fanout, sprites, toggles):
+    '''Toggles the visibility of every node several times within one frame.'''
+    window = get_window()
+    from diamond.node import Node, resolve_updates
+    root = Node()
+    root.add_to(window.root_node)
+    leaves = _make_tree(root, depth, fanout, sprites, make_tilesheet())
+    nodes = [root] + leaves
+    resolve_updates()
+
+    def run():
+        for count in xrange(toggles):
+            for node in nodes:
+                node.hide()
+            for node in nodes:
+                node.show()
+        resolve_updates()
+
+    def teardown():
+        root.remove_all()
+        root.remove_from_parent()
+        resolve_updates()
+
+    return Case(run, ops=len(nodes) * toggles * 2, teardown=teardown)
+
+
+@benchmark('node.draw', depth=[6], fanout=[2], sprites=[10], static=[False, True])
+def bench_draw(depth, fanout, sprites, static):
+    '''Draws a tree with sprites on every leaf with and without baking it.'''
+    window = get_window()
+    from diamond.node import Node, resolve_updates
+    root = Node()
+    root.add_to(window.root_node)
+    _make_tree(root, depth, fanout, sprites, make_tilesheet())
+    root.static = static
+    resolve_updates()
+    batch = window._batch
+
+    def run():
+        batch.draw()
+
+    def teardown():
+        root.static = False
+        root.remove_all()
+        root.remove_from_parent()
+        resolve_updates()
+
+    return Case(run, ops=1, teardown=teardown)
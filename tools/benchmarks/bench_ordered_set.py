@@ -0,0 +1,88 @@
+# Benchmarks for the ordered set.
+#
+# @author    Oktay Acikalin <oktay.acikalin@gmail.com>
+# @copyright Oktay Acikalin
+# @license   MIT (LICENSE.txt)
+
+from diamond.helper.ordered_set import OrderedSet
+from diamond.tools.benchmarks import benchmark, Case
+
+
+@benchmark('ordered_set.add_discard', size=[1000, 100000])
+def bench_add_discard(size):
+    '''Adds and removes 1000 items to/from a set of the given size.'''
+    oset = OrderedSet(xrange(size))
+    items = [object() for count in xrange(1000)]
+
+    def run():
+        add = oset.add
+        [add(item) for item in items]
+        discard = oset.discard
+        [discard(item) for item in items]
+
+    return Case(run, ops=2000)
+
+
+@benchmark('ordered_set.first_last', size=[1000, 100000])
+def bench_first_last(size):
+    '''Reads first and last item like the ticker does on every tick and add.'''
+    oset = OrderedSet(xrange(size))
+
+    def run():
+        for count in xrange(1000):
+            oset[0]
+            oset[-1]
+
+    return Case(run, ops=2000)
+
+
+@benchmark('ordered_set.pop_front', size=[1000, 100000])
+def bench_pop_front(size):
+    '''Removes the first item and appends a new one - a moving timeline.'''
+    oset = OrderedSet(xrange(size))
+    counter = [size]
+
+    def run():
+        discard, add = oset.discard, oset.add
+        value = counter[0]
+        for count in xrange(1000):
+            discard(oset[0])
+            add(value)
+            value += 1
+        counter[0] = value
+
+    return Case(run, ops=1000)
+
+
+@benchmark('ordered_set.index', size=[1000, 100000], removed=[False, True])
+def bench_index(size, removed):
+    '''
+    Random access into the middle of the set. If removed, an item gets
+    removed before each access which forces compaction from time to time.
+    '''
+    oset = OrderedSet(xrange(size))
+    counter = [size]
+
+    def run():
+        value = counter[0]
+        middle = size // 2
+        for count in xrange(100):
+            if removed:
+                oset.discard(oset[middle])
+                oset.add(value)
+                value += 1
+            oset[middle]
+        counter[0] = value
+
+    return Case(run, ops=100)
+
+
+@benchmark('ordered_set.iterate', size=[1000, 100000])
+def bench_iterate(size):
+    oset = OrderedSet(xrange(size))
+
+    def run():
+        for item in oset:
+            pass
+
+    return Case(run, ops=size)
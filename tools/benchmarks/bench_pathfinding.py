@@ -0,0 +1,67 @@
+# Benchmarks for the pathfinder.
+#
+# @author    Oktay Acikalin <oktay.acikalin@gmail.com>
+# @copyright Oktay Acikalin
+# @license   MIT (LICENSE.txt)
+
+import random
+import time
+
+from diamond.collision_grid import CollisionGrid
+from diamond.matrix import Matrix
+from diamond.pathfinding import Pathfinder
+from diamond.tools.benchmarks import benchmark, Case
+
+
+def _make_pathfinder(density, size=200, workers=1):
+    rnd = random.Random(size)
+    matrix = Matrix()
+    matrix.sector_size = 10, 10
+    matrix.set_point(size - 1, size - 1, 1, 'floor')  # Sets the boundaries.
+    for count in xrange(int(size * size * density)):
+        matrix.set_point(rnd.randrange(size), rnd.randrange(size), 0, 'sheet/1')
+    return Pathfinder(CollisionGrid(matrix, [0]), workers)
+
+
+def _get_queries(pathfinder, distance, amount, size=200):
+    rnd = random.Random(distance)
+    is_solid = pathfinder.grid.is_solid
+    queries = []
+    while len(queries) < amount:
+        x1, y1 = rnd.randrange(size - distance), rnd.randrange(size - distance)
+        x2, y2 = x1 + distance, y1 + rnd.randrange(distance + 1)
+        if not is_solid(x1, y1) and not is_solid(x2, y2):
+            queries.append(((x1, y1), (x2, y2)))
+    return queries
+
+
+@benchmark('pathfinding.get_path', distance=[8, 150])
+def bench_get_path(distance):
+    '''Searches 20 paths of about distance tiles on a 200x200 tiles map with 20% solid tiles.'''
+    pathfinder = _make_pathfinder(0.2)
+    queries = _get_queries(pathfinder, distance, 20)
+    # Build the abstraction beforehand.
+    [pathfinder.get_path(start, goal) for start, goal in queries]
+
+    def run():
+        get_path = pathfinder.get_path
+        for start, goal in queries:
+            get_path(start, goal)
+
+    return Case(run, ops=len(queries), teardown=pathfinder.join)
+
+
+@benchmark('pathfinding.find_path', workers=[1, 4])
+def bench_find_path(workers):
+    '''Hands 50 paths of about 100 tiles to the workers and waits for the results.'''
+    pathfinder = _make_pathfinder(0.2, workers=workers)
+    queries = _get_queries(pathfinder, 100, 50)
+    [pathfinder.get_path(start, goal) for start, goal in queries]
+
+    def run():
+        [pathfinder.find_path(start, goal) for start, goal in queries]
+        while pathfinder.is_busy():
+            pathfinder.tick()
+            time.sleep(0.0001)
+
+    return Case(run, ops=len(queries), teardown=pathfinder.join)
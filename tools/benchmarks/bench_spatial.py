@@ -0,0 +1,77 @@
+# Benchmarks for the spatial index.
+#
+# @author    Oktay Acikalin <oktay.acikalin@gmail.com>
+# @copyright Oktay Acikalin
+# @license   MIT (LICENSE.txt)
+
+import random
+
+from diamond.spatial import SpatialHash
+from diamond.tools.benchmarks import benchmark, Case
+
+
+def _make_items(amount, size=32, area=4096):
+    rnd = random.Random(amount)
+    items = []
+    for item in xrange(amount):
+        x, y = rnd.uniform(0, area), rnd.uniform(0, area)
+        items.append((item, (x, y, x + size, y + size)))
+    return items
+
+
+@benchmark('spatial.query_point', items=[1000, 10000], indexed=[False, True])
+def bench_query_point(items, indexed):
+    '''Picks 100 points - once with the index and once by looking at every item.'''
+    entries = _make_items(items)
+    rnd = random.Random(0)
+    points = [(rnd.uniform(0, 4096), rnd.uniform(0, 4096)) for count in xrange(100)]
+    if indexed:
+        index = SpatialHash(32)
+        for item, rect in entries:
+            index.update(item, rect)
+
+        def run():
+            query_point = index.query_point
+            for x, y in points:
+                query_point(x, y)
+    else:
+        def run():
+            for x, y in points:
+                [item for item, (x1, y1, x2, y2) in entries if x1 <= x < x2 and y1 <= y < y2]
+
+    return Case(run, ops=len(points))
+
+
+@benchmark('spatial.query_radius', items=[1000, 10000], radius=[64, 256])
+def bench_query_radius(items, radius):
+    '''Looks for the items around 100 points like an area effect would.'''
+    index = SpatialHash(32)
+    for item, rect in _make_items(items):
+        index.update(item, rect)
+    rnd = random.Random(0)
+    points = [(rnd.uniform(0, 4096), rnd.uniform(0, 4096)) for count in xrange(100)]
+
+    def run():
+        query_radius = index.query_radius
+        for x, y in points:
+            query_radius(x, y, radius)
+
+    return Case(run, ops=len(points))
+
+
+@benchmark('spatial.update', items=[1000, 10000])
+def bench_update(items):
+    '''Moves every item a bit like sprites walking around.'''
+    index = SpatialHash(32)
+    entries = _make_items(items)
+    for item, rect in entries:
+        index.update(item, rect)
+    step = [0]
+
+    def run():
+        step[0] = offset = 1 - step[0]
+        update = index.update
+        for item, (x1, y1, x2, y2) in entries:
+            update(item, (x1 + offset, y1 + offset, x2 + offset, y2 + offset))
+
+    return Case(run, ops=items)
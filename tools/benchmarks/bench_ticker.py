@@ -0,0 +1,71 @@
+# Benchmarks for the ticker.
+#
+# @author    Oktay Acikalin <oktay.acikalin@gmail.com>
+# @copyright Oktay Acikalin
+# @license   MIT (LICENSE.txt)
+
+from diamond.ticker import Ticker
+from diamond.clock import VirtualClock
+from diamond.tools.benchmarks import benchmark, Case
+
+
+def _noop():
+    pass
+
+
+@benchmark('ticker.tick', ticks=[1000, 10000, 100000])
+def bench_tick(ticks):
+    '''
+    One frame (16 msecs) of a ticker holding the given amount of ticks with
+    intervals between 16 and 160 msecs. Roughly every third tick is due.
+    '''
+    clock = VirtualClock(manual=True)
+    ticker = Ticker(limit=ticks, clock=clock)
+    for count in xrange(ticks):
+        ticker.add(_noop, 16 * (1 + count % 10))
+
+    def run():
+        clock.step(16)
+        ticker.tick()
+
+    return Case(run, teardown=ticker.join)
+
+
+@benchmark('ticker.add', ticks=[1000, 10000])
+def bench_add(ticks):
+    ticker = Ticker(limit=ticks)
+
+    def run():
+        add = ticker.add
+        for count in xrange(ticks):
+            add(_noop, 16 * (1 + count % 10))
+        ticker.clear()
+
+    return Case(run, ops=ticks, teardown=ticker.join)
+
+
+class _Owner(object):
+
+    def update(self):
+        pass
+
+    def animate(self):
+        pass
+
+
+@benchmark('ticker.remove_all_for', owners=[100, 1000, 10000])
+def bench_remove_all_for(owners):
+    '''Tears down the ticks of all owners - like a scene teardown does.'''
+    ticker = Ticker(limit=owners)
+    instances = [_Owner() for count in xrange(owners)]
+
+    def run():
+        add = ticker.add
+        for owner in instances:
+            add(owner.update, 16)
+            add(owner.animate, 100)
+        remove_all_for = ticker.remove_all_for
+        for owner in instances:
+            remove_all_for(owner)
+
+    return Case(run, ops=owners, teardown=ticker.join)
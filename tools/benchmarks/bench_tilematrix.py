@@ -0,0 +1,43 @@
+# Benchmarks for the tilematrix. These need a working OpenGL context.
+#
+# @author    Oktay Acikalin <oktay.acikalin@gmail.com>
+# @copyright Oktay Acikalin
+# @license   MIT (LICENSE.txt)
+
+# GL modules get imported after get_window(). See load_benchmarks().
+from diamond.tools.benchmarks import benchmark, Case
+from diamond.tools.benchmarks.fixtures import get_window, make_tilesheet, make_world
+
+
+@benchmark('tilematrix.update_sectors', speed=[1, 8, 32], sector_size=[(10, 10)])
+def bench_update_sectors(speed, sector_size):
+    '''
+    Scrolls a tilematrix diagonally by speed pixels per call and bounces
+    off the borders of the world. Sectors get built and dropped on the way.
+    '''
+    window = get_window()
+    from diamond.tilematrix import TileMatrix
+    sheet = make_tilesheet()
+    world = 200
+    tilematrix = TileMatrix()
+    tilematrix.add_sheet(sheet, 'bench_sheet')
+    tilematrix.load_matrix(make_world(world, world, sector_size=sector_size))
+    tilematrix.set_sector_size(*sector_size)
+    tilematrix.add_to(window.root_node)
+    t_w, t_h = sheet.tile_size
+    limit = min(world * t_w - window.width, world * t_h - window.height)
+    state = dict(pos=0, direction=speed)
+
+    def run():
+        pos = state['pos'] + state['direction']
+        if pos < 0 or pos > limit:
+            state['direction'] = -state['direction']
+            pos = state['pos'] + state['direction']
+        state['pos'] = pos
+        tilematrix.set_position(-pos, -pos)
+
+    def teardown():
+        tilematrix.remove_all()
+        tilematrix.remove_from_parent()
+
+    return Case(run, teardown=teardown)
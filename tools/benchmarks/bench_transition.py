@@ -0,0 +1,27 @@
+# Benchmarks for transitions.
+#
+# @author    Oktay Acikalin <oktay.acikalin@gmail.com>
+# @copyright Oktay Acikalin
+# @license   MIT (LICENSE.txt)
+
+from diamond.transition import Transition
+from diamond.tools.benchmarks import benchmark, Case
+
+
+def _callback(value):
+    pass
+
+
+def _get_args(value):
+    return [value]
+
+
+@benchmark('transition.range', steps=[100, 1000, 10000], dynamic_args=[False, True])
+def bench_range(steps, dynamic_args):
+    '''Generates a range transition with one tick per 10 msecs step.'''
+    args = _get_args if dynamic_args else [0]
+
+    def run():
+        Transition.range(_callback, args, range=(0, steps), msecs=steps * 10)
+
+    return Case(run)
@@ -0,0 +1,133 @@
+# Synthetic tilesheets, worlds and a headless window for the benchmarks.
+#
+# @author    Oktay Acikalin <oktay.acikalin@gmail.com>
+# @copyright Oktay Acikalin
+# @license   MIT (LICENSE.txt)
+
+import os
+import zlib
+import struct
+import atexit
+import shutil
+import tempfile
+from types import ModuleType
+from collections import OrderedDict
+
+from diamond.tools.benchmarks import SkipBenchmark
+
+
+_temp_dirs = []
+_window = None
+_window_error = None  # Message of the first failed window creation.
+
+
+def _cleanup():
+    for path in _temp_dirs:
+        shutil.rmtree(path, ignore_errors=True)
+    del _temp_dirs[:]
+
+
+atexit.register(_cleanup)
+
+
+def make_temp_dir():
+    path = tempfile.mkdtemp(prefix='diamond-bench-')
+    _temp_dirs.append(path)
+    return path
+
+
+def get_window(width=640, height=480):
+    '''
+    Returns a shared headless window. Needed by everything touching GL.
+    Call it before importing any GL module. Skips the case if there is no
+    display to open a window on.
+    '''
+    global _window, _window_error
+    # Don't try again on a half imported pyglet.gl. It would hide the cause.
+    if _window_error is not None:
+        raise SkipBenchmark(_window_error)
+    if _window is None:
+        try:
+            from diamond.window import Window
+            _window = Window(width, height, headless=True)
+        except Exception as excp:
+            _window_error = 'No OpenGL context available (%s: %s).' % (
+                type(excp).__name__, excp)
+            raise SkipBenchmark(_window_error)
+    return _window
+
+
+def write_png(filename, width, height, get_pixel):
+    '''Writes an RGBA PNG. get_pixel(x, y) has to return 4 bytes.'''
+    raw = ''.join(
+        '\x00' + ''.join(get_pixel(x, y) for x in xrange(width))
+        for y in xrange(height)
+    )
+
+    def chunk(tag, data):
+        checksum = zlib.crc32(tag + data) & 0xffffffff
+        return struct.pack('>I', len(data)) + tag + data + struct.pack('>I', checksum)
+
+    with open(filename, 'wb') as output:
+        output.write('\x89PNG\r\n\x1a\n')
+        output.write(chunk('IHDR', struct.pack('>IIBBBBB', width, height, 8, 6, 0, 0, 0)))
+        output.write(chunk('IDAT', zlib.compress(raw)))
+        output.write(chunk('IEND', ''))
+
+
+def make_tilesheet(name='bench_sheet', tile_size=(32, 32), columns=8, rows=8):
+    '''
+    Creates a tilesheet image on disk and returns a vault module for it
+    which looks like the ones generated by tools/tilesheet_maker.py.
+    '''
+    path = make_temp_dir()
+    t_w, t_h = tile_size
+    filename = '%s.png' % name
+
+    def get_pixel(x, y):
+        tile = (x // t_w) + (y // t_h) * columns
+        return struct.pack('4B', tile * 37 % 256, tile * 91 % 256, tile * 13 % 256, 255)
+
+    write_png(os.path.join(path, filename), t_w * columns, t_h * rows, get_pixel)
+
+    sprites = OrderedDict()
+    for y in xrange(rows):
+        for x in xrange(columns):
+            rect = [x * t_w, y * t_h, t_w, t_h]
+            sprites['%d,%d' % (x, y)] = {'none': [[rect, [x * t_w, y * t_h], [0, 0], 60]]}
+
+    module = ModuleType(name)
+    module.__file__ = os.path.join(path, '%s.py' % name)
+    module.filename = filename
+    module.sprites = sprites
+    module.tile_size = list(tile_size)
+    return module
+
+
+def make_world(width, height, layers=2, sector_size=(10, 10), sheet='bench_sheet', columns=8, rows=8):
+    '''
+    Writes a matrix data path filled with width x height tiles on every
+    layer and returns its path. Layers above the first one are sparse.
+    '''
+    path = make_temp_dir()
+    s_w, s_h = sector_size
+    with open(os.path.join(path, 'config.ini'), 'w') as output:
+        output.write('[general]\nsector_size = %d,%d\n' % sector_size)
+    with open(os.path.join(path, 'b.csv'), 'w') as output:
+        output.write('0,0,%d,%d\n' % (height - 1, width - 1))
+    for s_y in xrange(0, (height + s_h - 1) // s_h):
+        for s_x in xrange(0, (width + s_w - 1) // s_w):
+            lines = []
+            for z in xrange(layers):
+                for y in xrange(s_h):
+                    for x in xrange(s_w):
+                        m_x, m_y = s_x * s_w + x, s_y * s_h + y
+                        if m_x >= width or m_y >= height:
+                            continue
+                        if z and (m_x + m_y + z) % 4:
+                            continue
+                        tile = '%s/%d,%d' % (sheet, (m_x + z) % columns, (m_y + z) % rows)
+                        lines.append('%d,%d,%d,"%s"\n' % (x, y, z, tile))
+            with open(os.path.join(path, 's.%d,%d.csv' % (s_x, s_y)), 'w') as output:
+                output.writelines(lines)
+    return path
@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+#
+# Runs the engine benchmarks and optionally compares them against a baseline.
+#
+# @author    Oktay Acikalin <oktay.acikalin@gmail.com>
+# @copyright Oktay Acikalin
+# @license   MIT (LICENSE.txt)
+
+import os
+import sys
+import json
+import textwrap
+import argparse
+
+# Make sure that our diamond engine can be found.
+engine_path = os.path.join(os.path.dirname(__file__), '..', '..', '..')
+sys.path.insert(0, os.path.abspath(engine_path))
+
+from diamond.tools.benchmarks import load_benchmarks, get_combinations, get_case_id, run_benchmarks, compare
+
+
+APP_NAME = 'Diamond Benchmarks'
+APP_VERSION = '0.1'
+
+
+def log(message):
+    sys.stderr.write('%s\n' % message)
+    sys.stderr.flush()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=textwrap.dedent('''
+        %s (%s)
+
+        Measures ops/sec and latency percentiles of the engine hot paths.
+        Benchmarks touching OpenGL open a hidden window and are being skipped
+        if there is no display. On servers run them within a virtual X
+        server, e.g.:
+        > xvfb-run -s "-screen 0 1024x768x24" run.py -o results.json
+
+        Gate changes by comparing against results of an earlier run:
+        > run.py -o new.json --compare results.json --threshold 10
+        ''') % (APP_NAME, APP_VERSION),
+        prog='run.py',
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument('patterns', action='store', nargs='*',
+                        metavar='PATTERN',
+                        help='Only run benchmarks whose name or case ID matches (e.g. "ticker.*").',
+    )
+    parser.add_argument('-l', '--list', dest='list', action='store_true',
+                        default=False,
+                        help='List all benchmark cases and exit.',
+    )
+    parser.add_argument('-t', '--min-time', dest='min_time', action='store',
+                        type=float, default=1.0,
+                        help='Minimum seconds to spend on each case (default: %(default)s).',
+    )
+    parser.add_argument('-o', '--output', dest='output', action='store',
+                        default=None,
+                        help='Write the JSON results into this file instead of stdout.',
+    )
+    parser.add_argument('-c', '--compare', dest='compare', action='store',
+                        default=None, metavar='BASELINE',
+                        help='Compare against the JSON results of an earlier run.',
+    )
+    parser.add_argument('--threshold', dest='threshold', action='store',
+                        type=float, default=10.0,
+                        help='Allowed slowdown in percent before failing a comparison (default: %(default)s).',
+    )
+    parser.add_argument('--version', action='version',
+                        version='%(prog)s ' + APP_VERSION,
+                        help='Show program\'s version number and exit.')
+    args = parser.parse_args()
+
+    registry = load_benchmarks()
+
+    if args.list:
+        for name, (setup, params) in registry.iteritems():
+            for combination in get_combinations(params):
+                print get_case_id(name, combination)
+        return 0
+
+    results = run_benchmarks(args.patterns, min_time=args.min_time, log=log)
+    data = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as output:
+            output.write(data)
+    else:
+        print data
+
+    if args.compare:
+        with open(args.compare) as input:
+            baseline = json.load(input)
+        rows = compare(baseline, results, threshold=args.threshold)
+        regressions = [row for row in rows if row[4]]
+        log('')
+        for case_id, before, after, change, is_regression in rows:
+            log('%-60s %14.1f -> %14.1f ops/sec  %+7.1f%%%s' % (
+                case_id, before, after, change, '  REGRESSION' if is_regression else ''))
+        if regressions:
+            log('%d of %d cases got slower by more than %.1f%%.' % (
+                len(regressions), len(rows), args.threshold))
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+#
+# Builds the alpha masks of all frames of vaults for collision tests.
+#
+# @author    Oktay Acikalin <oktay.acikalin@gmail.com>
+# @copyright Oktay Acikalin
+# @license   MIT (LICENSE.txt)
+
+import os
+import imp
+import json
+import textwrap
+import argparse
+
+from diamond.vault import Vault, merge_piggyback_rects, get_masks_filename, get_mask_key, \
+    get_image_hash, build_mask, MASKS_FORMAT_VERSION
+
+
+APP_NAME = 'Mask Builder'
+APP_VERSION = '0.1'
+
+
+def get_frame_rects(vault):
+    '''Yields the rect of every frame of every sprite of a vault module.'''
+    for actions in vault.sprites.itervalues():
+        for frames in actions.itervalues():
+            for frame in frames:
+                if frame == -1:  # Reverse loop marker.
+                    continue
+                rect = frame[0]
+                if type(rect[0]) is list:
+                    rect = merge_piggyback_rects(rect, frame[1], frame[2])[0]
+                yield rect
+
+
+def build(vault, threshold=1):
+    '''
+    Returns the masks of all frames of a vault module. Masks are bit packed
+    rows (see diamond.helper.mask.Mask.to_data) stored per rect together
+    with the tight bounding rect of their solid pixels. The hash of the
+    image lets the vault ignore the masks after the image changed.
+    '''
+    image_data = Vault.load_image_data(vault)
+    frames = dict()
+    for rect in get_frame_rects(vault):
+        key = get_mask_key(rect)
+        if key in frames:
+            continue
+        mask = build_mask(image_data, rect, threshold)
+        frames[key] = dict(
+            bounds=mask.get_bounding_rect(),
+            mask=mask.to_data(),
+        )
+    return dict(version=MASKS_FORMAT_VERSION, threshold=threshold,
+                image=get_image_hash(vault), frames=frames)
+
+
+def write(data, filename):
+    with open(filename, 'wb') as output:
+        output.write('{"version": %d, "threshold": %d, "image": %s, "frames": {\n' % (
+            data['version'], data['threshold'], json.dumps(data['image'])))
+        # One frame per line keeps diffs readable.
+        output.write(',\n'.join(
+            '%s: %s' % (json.dumps(key), json.dumps(value, sort_keys=True))
+            for key, value in sorted(data['frames'].iteritems())
+        ))
+        output.write('\n}}\n')
+
+
+def load_vault(filename):
+    name = os.path.splitext(os.path.basename(filename))[0]
+    return imp.load_source('mask_builder_%s' % name, filename)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=textwrap.dedent('''
+        %s (%s)
+
+        Builds the alpha masks of all frames of the given vaults. They are
+        being written next to each vault and picked up by the collision
+        tests instead of reading the image data at runtime.
+        The following example would produce tilesheet.masks.json:
+        > mask_builder.py tilesheet.py
+        ''') % (APP_NAME, APP_VERSION),
+        prog='mask_builder.py',
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument('vaults', action='store', nargs='+',
+                        metavar='VAULT',
+                        help='Filepaths of the vault modules (.py).',
+    )
+    parser.add_argument('-t', '--threshold', dest='threshold', action='store',
+                        type=int, default=1, metavar='ALPHA',
+                        help='Pixels with at least this alpha are solid (default: 1).',
+    )
+    parser.add_argument('--version', action='version',
+                        version='%(prog)s ' + APP_VERSION,
+                        help='Show program\'s version number and exit.')
+    args = parser.parse_args()
+
+    for filename in args.vaults:
+        vault = load_vault(filename)
+        data = build(vault, args.threshold)
+        output = get_masks_filename(vault)
+        write(data, output)
+        print 'Wrote %d masks into %s.' % (len(data['frames']), output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,216 @@
+#!/usr/bin/env python
+#
+# Converts cProfile stats and diamond profiler traces into callgrind files.
+#
+# @author    Oktay Acikalin <oktay.acikalin@gmail.com>
+# @copyright Oktay Acikalin
+# @license   MIT (LICENSE.txt)
+
+import os
+import re
+import sys
+import json
+import marshal
+import textwrap
+import argparse
+from collections import deque
+
+
+APP_NAME = 'Profile to Calltree Converter'
+APP_VERSION = '0.1'
+
+# Matches the events as written by diamond.profiler - one per line.
+TRACE_EVENT = re.compile(
+    r'^\{"name": ("(?:[^"\\]|\\.)*"), "ph": "X", "pid": \d+, "tid": (\d+), "ts": (\d+), "dur": (\d+)\},?$')
+
+# How many finished zones per thread are kept for finding their parent.
+TRACE_PENDING = 4096
+
+
+class CallgrindWriter(object):
+    '''
+    Writes callgrind data as it comes in. File and function names are being
+    compressed (only written out on their first use) which keeps the output
+    small. Costs of a function may be spread over several blocks - the
+    viewers sum them up. Thus nothing has to be collected in memory.
+    '''
+
+    def __init__(self, output, events='Microseconds', creator=APP_NAME):
+        super(CallgrindWriter, self).__init__()
+        self.output = output
+        self.total = 0
+        self._ids = dict(fl=dict(), fn=dict())
+        output.write('# callgrind format\nversion: 1\ncreator: %s\nevents: %s\n\n' % (creator, events))
+
+    def _name(self, kind, name):
+        ids = self._ids[kind]
+        try:
+            return '(%d)' % ids[name]
+        except KeyError:
+            id = ids[name] = len(ids) + 1
+            return '(%d) %s' % (id, name)
+
+    def add_cost(self, filename, function, line, cost):
+        '''Adds cost spent in function itself.'''
+        name = self._name
+        self.output.write('fl=%s\nfn=%s\n%d %d\n' % (
+            name('fl', filename), name('fn', function), line, cost))
+        self.total += cost
+
+    def add_call(self, filename, function, line, callee_filename, callee, callee_line, calls, cost):
+        '''Adds a call from function to callee with the inclusive cost of callee.'''
+        name = self._name
+        self.output.write('fl=%s\nfn=%s\ncfl=%s\ncfn=%s\ncalls=%d %d\n%d %d\n' % (
+            name('fl', filename), name('fn', function), name('fl', callee_filename),
+            name('fn', callee), calls, callee_line, line, cost))
+
+    def close(self):
+        self.output.write('\ntotals: %d\n' % self.total)
+
+
+def _get_label(func):
+    filename, line, function = func
+    if filename == '~':
+        # Builtins have no file.
+        return '<builtin>', 0, function
+    return filename, line, '%s (%s:%d)' % (function, os.path.basename(filename), line)
+
+
+def convert_cprofile(input, writer, unit=1000000):
+    '''
+    Converts stats written by cProfile (or pstats.Stats.dump_stats). The
+    stats are already aggregated per function, thus their size only depends
+    on the amount of code touched and not on the length of the session.
+    '''
+    stats = marshal.load(input)
+    labels = dict()
+
+    def label(func):
+        try:
+            return labels[func]
+        except KeyError:
+            result = labels[func] = _get_label(func)
+            return result
+
+    add_cost, add_call = writer.add_cost, writer.add_call
+    for func, (cc, nc, tt, ct, callers) in stats.iteritems():
+        filename, line, name = label(func)
+        add_cost(filename, name, line, int(tt * unit))
+        for caller, value in callers.iteritems():
+            caller_filename, caller_line, caller_name = label(caller)
+            if isinstance(value, tuple):
+                calls, inclusive = value[1], value[3]
+            else:
+                # Old profile module only counts calls per caller.
+                calls, inclusive = value, ct * value / max(nc, 1)
+            add_call(caller_filename, caller_name, caller_line,
+                     filename, name, line, calls, int(inclusive * unit))
+
+
+def convert_trace(input, writer, filename='<trace>'):
+    '''
+    Converts a trace of diamond.profiler (see profiler.start_trace). Zones
+    are being written when they end which puts children before their
+    parents. Each thread therefore keeps the latest finished zones until
+    one turns out to be their parent. Costs get summed up per zone and per
+    call edge. Thus memory stays bounded by TRACE_PENDING and the number of
+    zones, no matter how long the trace is. Costs are in microseconds.
+    '''
+    match = TRACE_EVENT.match
+    loads = json.loads
+    pending = dict()  # tid -> deque of (start, end, name)
+    names = dict()
+    costs = dict()  # name -> self cost
+    calls = dict()  # (caller, callee) -> [calls, inclusive cost]
+    for line in input:
+        result = match(line)
+        if result is None:
+            line = line.strip().rstrip(',').lstrip('[')
+            if not line.startswith('{'):
+                continue
+            try:
+                event = loads(line.rstrip(']'))
+            except ValueError:
+                continue
+            if event.get('ph') != 'X':
+                continue
+            name, tid, start, dur = event['name'], event['tid'], int(event['ts']), int(event['dur'])
+        else:
+            name, tid, start, dur = result.groups()
+            try:
+                name = names[name]
+            except KeyError:
+                name = names[name] = loads(name)
+            start, dur = int(start), int(dur)
+        end = start + dur
+        try:
+            stack = pending[tid]
+        except KeyError:
+            stack = pending[tid] = deque(maxlen=TRACE_PENDING)
+        children = 0
+        while stack and stack[-1][0] >= start and stack[-1][1] <= end:
+            child_start, child_end, child_name = stack.pop()
+            child_dur = child_end - child_start
+            children += child_dur
+            try:
+                edge = calls[name, child_name]
+                edge[0] += 1
+                edge[1] += child_dur
+            except KeyError:
+                calls[name, child_name] = [1, child_dur]
+        costs[name] = costs.get(name, 0) + max(0, dur - children)
+        stack.append((start, end, name))
+    for name, cost in sorted(costs.iteritems()):
+        writer.add_cost(filename, name, 0, cost)
+    for (name, child_name), (count, cost) in sorted(calls.iteritems()):
+        writer.add_call(filename, name, 0, filename, child_name, 0, count, cost)
+
+
+def convert(filenames, output):
+    '''Converts all files (cProfile stats or traces) into one callgrind output.'''
+    writer = CallgrindWriter(output)
+    for filename in filenames:
+        with open(filename, 'rb') as input:
+            head = input.read(1)
+            input.seek(0)
+            if head == '[':
+                convert_trace(input, writer, filename)
+            else:
+                convert_cprofile(input, writer)
+    writer.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=textwrap.dedent('''
+        %s (%s)
+
+        Converts cProfile stats (e.g. profiler-stats.dat) and traces of the
+        frame profiler (--trace) into callgrind files for KCachegrind.
+        > profile2calltree.py -o callgrind.out profiler-stats.dat
+        ''') % (APP_NAME, APP_VERSION),
+        prog='profile2calltree.py',
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument('files', action='store', nargs='+',
+                        metavar='FILE',
+                        help='Files to convert.',
+    )
+    parser.add_argument('-o', '--output', dest='output', action='store',
+                        default='-', metavar='FILE',
+                        help='Write callgrind data into FILE (default: stdout).',
+    )
+    parser.add_argument('--version', action='version',
+                        version='%(prog)s ' + APP_VERSION,
+                        help='Show program\'s version number and exit.')
+    args = parser.parse_args()
+
+    if args.output == '-':
+        convert(args.files, sys.stdout)
+    else:
+        with open(args.output, 'w') as output:
+            convert(args.files, output)
+
+
+if __name__ == '__main__':
+    main()
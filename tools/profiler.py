@@ -1,6 +1,7 @@
 #!/usr/bin/env python
 #
-# TODO
+# Runs the main() of a module with cProfile and writes the results as
+# callgrind file (results/callgrind.out) for e.g. KCachegrind.
 #
 # @author    Oktay Acikalin <oktay.acikalin@gmail.com>
 # @copyright Oktay Acikalin
@@ -8,7 +9,9 @@
 
 import sys
 import os
-import hotshot
+import cProfile
+
+from profile2calltree import convert
 
 
 module_path = os.path.dirname(sys.argv[1])
@@ -24,9 +27,11 @@ def run():
 
 if not os.path.exists('results'):
     os.makedirs('results')
-filename = 'results/pythongrind.prof'
-prof = hotshot.Profile(filename, lineevents=1)
-prof.runcall(run)
-prof.close()
-path = os.path.dirname(__file__)
-os.system('%s/hotshot2calltree.py -o results/callgrind.out results/pythongrind.prof' % path)
+filename = 'results/profile.dat'
+prof = cProfile.Profile()
+try:
+    prof.runcall(run)
+finally:
+    prof.dump_stats(filename)
+    with open('results/callgrind.out', 'w') as output:
+        convert([filename], output)
@@ -0,0 +1,147 @@
+#!/usr/bin/env python
+#
+# Reports frame pacing statistics of telemetry files written by diamond.telemetry.
+#
+# @author    Oktay Acikalin <oktay.acikalin@gmail.com>
+# @copyright Oktay Acikalin
+# @license   MIT (LICENSE.txt)
+
+import os
+import sys
+import json
+import textwrap
+import argparse
+
+# Make sure that our diamond engine can be found.
+engine_path = os.path.join(os.path.dirname(__file__), '..', '..')
+sys.path.insert(0, os.path.abspath(engine_path))
+
+from diamond.telemetry import read_records
+from diamond.helper.stats import percentile
+
+
+APP_NAME = 'Telemetry Report'
+APP_VERSION = '0.1'
+
+
+def analyze(records, target_fps=60.0, hitch_factor=2.0):
+    '''
+    Returns percentiles of frame and update times and the number of hitches.
+    A frame is a hitch if it took longer than hitch_factor times the frame
+    budget of target_fps.
+    '''
+    budget = 1000.0 / target_fps
+    hitch_msecs = budget * hitch_factor
+    frames, updates = [], []
+    hitches = 0
+    longest_hitch_streak = streak = 0
+    gc_max = [0, 0, 0]
+    last = None
+    for record in records:
+        msecs = record['frame_msecs']
+        frames.append(msecs)
+        updates.append(record['update_msecs'])
+        if msecs > hitch_msecs:
+            hitches += 1
+            streak += 1
+            longest_hitch_streak = max(longest_hitch_streak, streak)
+        else:
+            streak = 0
+        gc_max = [max(gc_max[pos], record['gc%d' % pos]) for pos in xrange(3)]
+        last = record
+    if last is None:
+        return None
+    frames_sorted = sorted(frames)
+    updates_sorted = sorted(updates)
+    duration = sum(frames) / 1000.0
+    return dict(
+        frames=len(frames),
+        seconds=duration,
+        avg_fps=len(frames) / duration if duration else 0.0,
+        frame_msecs=dict(
+            p50=percentile(frames_sorted, 50),
+            p95=percentile(frames_sorted, 95),
+            p99=percentile(frames_sorted, 99),
+            max=frames_sorted[-1],
+        ),
+        update_msecs=dict(
+            p50=percentile(updates_sorted, 50),
+            p95=percentile(updates_sorted, 95),
+            p99=percentile(updates_sorted, 99),
+            max=updates_sorted[-1],
+        ),
+        budget_msecs=budget,
+        over_budget=sum(1 for msecs in frames if msecs > budget),
+        hitch_msecs=hitch_msecs,
+        hitches=hitches,
+        longest_hitch_streak=longest_hitch_streak,
+        dropped_update_steps=last['dropped_update_steps'],
+        dropped_records=last['dropped_records'],
+        max_gc_counts=gc_max,
+    )
+
+
+def print_report(filename, report):
+    print '%s:' % filename
+    if report is None:
+        print '  no records found'
+        return
+    print '  %d frames in %.1f secs (avg %.1f fps)' % (
+        report['frames'], report['seconds'], report['avg_fps'])
+    for key in ('frame_msecs', 'update_msecs'):
+        stats = report[key]
+        print '  %-13s p50 %8.2f  p95 %8.2f  p99 %8.2f  max %8.2f' % (
+            key.replace('_msecs', ' msecs:'), stats['p50'], stats['p95'], stats['p99'], stats['max'])
+    print '  over budget (%.2f msecs): %d frames' % (report['budget_msecs'], report['over_budget'])
+    print '  hitches (> %.2f msecs): %d (longest streak: %d frames)' % (
+        report['hitch_msecs'], report['hitches'], report['longest_hitch_streak'])
+    print '  dropped update steps: %d, dropped records: %d' % (
+        report['dropped_update_steps'], report['dropped_records'])
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=textwrap.dedent('''
+        %s (%s)
+
+        Reports frame time percentiles and hitch counts of telemetry files
+        (JSON lines or binary) written by SceneManager.set_telemetry().
+        > telemetry_report.py --target-fps 60 session.tel
+        ''') % (APP_NAME, APP_VERSION),
+        prog='telemetry_report.py',
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument('files', action='store', nargs='+',
+                        metavar='FILE',
+                        help='Telemetry files to analyze.',
+    )
+    parser.add_argument('--target-fps', dest='target_fps', action='store',
+                        type=float, default=60.0,
+                        help='Frame rate to measure the frame budget against (default: %(default)s).',
+    )
+    parser.add_argument('--hitch-factor', dest='hitch_factor', action='store',
+                        type=float, default=2.0,
+                        help='Frames longer than this many budgets count as hitch (default: %(default)s).',
+    )
+    parser.add_argument('--json', dest='json', action='store_true',
+                        default=False,
+                        help='Output the reports as JSON.',
+    )
+    parser.add_argument('--version', action='version',
+                        version='%(prog)s ' + APP_VERSION,
+                        help='Show program\'s version number and exit.')
+    args = parser.parse_args()
+
+    reports = dict()
+    for filename in args.files:
+        with open(filename, 'rb') as input:
+            reports[filename] = analyze(read_records(input), args.target_fps, args.hitch_factor)
+    if args.json:
+        print json.dumps(reports, indent=2)
+    else:
+        for filename in args.files:
+            print_report(filename, reports[filename])
+
+
+if __name__ == '__main__':
+    main()
@@ -216,7 +216,9 @@ class TransitionManager(Ticker):
             # exit()
         timestamp = previous_timestamp
         tick = None
+        first_timestamp = None
         tickers_append = self.tickers.add
+        index_tick = self._index_tick
         # print 'previous_timestamp =', previous_timestamp,
         # print 'tickers in queue =', self.stacks[stack]
         for step in transition:
@@ -268,6 +270,11 @@ class TransitionManager(Ticker):
             tick = OnetimeTick((func, timestamp, timestamp, args, kwargs, dropable))
             tick.user_data['stack'] = stack
             tickers_append(tick)
+            index_tick(tick)
+            if first_timestamp is None:
+                first_timestamp = timestamp
+        if first_timestamp is not None:
+            self._wakeup_if_earlier(first_timestamp)
         if tick is not None:
             latest_tick = self.stacks[stack.name]
             if not latest_tick.tick or latest_tick.tick[2] <= timestamp:
@@ -7,7 +7,9 @@
 import os
 from collections import OrderedDict
 from weakref import WeakValueDictionary, proxy, ProxyTypes
+from threading import RLock, Condition
 import json
+import hashlib
 
 # import pygame.image
 # import pygame.surface
@@ -21,6 +23,15 @@ import json
 
 from diamond import pyglet
 from diamond.rect import Rect
+from diamond.helper.mask import Mask
+from diamond.helper.logging import log_warning
+
+
+# Default budget for textures kept in the vault cache (in bytes).
+DEFAULT_TEXTURE_BUDGET = 256 * 1024 * 1024
+
+# Version of the masks files written by tools/mask_builder.py.
+MASKS_FORMAT_VERSION = 2
 
 
 # def load_image(filename, gamma=1.0):
@@ -48,6 +59,49 @@ from diamond.rect import Rect
 #     return image_cache[cache_id]
 
 
+def merge_piggyback_rects(rects, hotspots, deltas):
+    '''Returns the rect covering all images of a piggyback frame and its delta.'''
+    merged = []
+    for pos, rect in enumerate(rects):
+        hotspot = hotspots[pos]
+        delta = deltas[pos]
+        x = hotspot[0] - rect[0] + delta[0]
+        y = hotspot[1] - rect[1] + delta[1]
+        merged.append(Rect(x, y, rect[2], rect[3]))
+    merged = merged[0].unionall(merged)
+    return (rects[0][0], rects[0][1], merged.x + merged.w, merged.y + merged.h), merged.topleft
+
+
+def get_masks_filename(vault):
+    '''Returns the filename of the masks built for a vault module (see tools/mask_builder.py).'''
+    return '%s.masks.json' % os.path.splitext(vault.__file__)[0]
+
+
+def get_image_filename(vault):
+    return os.path.join(os.path.dirname(vault.__file__), vault.filename)
+
+
+def get_image_hash(vault):
+    '''Returns the MD5 of the image of a vault module. Tells whether its masks are outdated.'''
+    with open(get_image_filename(vault), 'rb') as input:
+        return hashlib.md5(input.read()).hexdigest()
+
+
+def get_mask_key(rect):
+    '''Masks are being stored per rect. Frames showing the same rect share them.'''
+    return '%d,%d,%d,%d' % tuple(rect)
+
+
+def build_mask(image_data, rect, threshold=1):
+    '''Builds the alpha mask of a rect (top left origin) of RGBA image data.'''
+    x, y, w, h = rect
+    pitch = image_data.width * 4
+    # Rows of pyglet images go from bottom to top.
+    y = image_data.height - y - h
+    data = image_data.get_data('RGBA', pitch)[y * pitch:(y + h) * pitch]
+    return Mask.from_alpha(data[x * 4:], w, h, pitch=pitch, threshold=threshold, flip_y=True)
+
+
 class VaultSpriteActionFrame(object):
 
     def __init__(self, vault_sprite_action, rect, hotspot, delta, duration, events=None):
@@ -60,19 +114,11 @@ class VaultSpriteActionFrame(object):
         if type(rect[0]) is list:
             # Calculate global rect.
             self.rects = rect
-            rects = []
-            for pos, rect_ in enumerate(rect):
-                hotspot_ = hotspot[pos]
-                delta_ = delta[pos]
-                x = hotspot_[0] - rect_[0] + delta_[0]
-                y = hotspot_[1] - rect_[1] + delta_[1]
-                rects.append(Rect(x, y, rect_[2], rect_[3]))
-            rects = rects[0].unionall(rects)
-            rect = (rect[0][0], rect[0][1], rects.x + rects.w, rects.y + rects.h)
+            rect, delta_ = merge_piggyback_rects(rect, hotspot, delta)
             self.hotspots = hotspot
             hotspot = rect[0], rect[1]
             self.deltas = delta
-            delta = rects.topleft
+            delta = delta_
             self.is_piggyback = True
         else:
             self.is_piggyback = False
@@ -86,6 +132,7 @@ class VaultSpriteActionFrame(object):
         # self.surfaces = {}
         # self.masks = {}
         self.pos_modifier = None
+        self._mask = None
         self.__recalc_pos_modifier()
         if events is None:
             self.events = []
@@ -160,13 +207,30 @@ class VaultSpriteActionFrame(object):
     #         self.__bounding_rect[min_alpha] = surface.get_bounding_rect(min_alpha)
     #     return self.__bounding_rect[min_alpha].copy()
 
-    # def get_mask(self, gamma=1.0):
-    #     gamma_s = str(gamma)
-    #     if gamma_s not in self.masks:
-    #         surface = self.get_surface(gamma)
-    #         mask = pygame.mask.from_surface(surface)
-    #         self.masks[gamma_s] = mask
-    #     return self.masks[gamma_s]
+    def get_mask(self):
+        '''
+        Returns the alpha mask (see diamond.helper.mask) of the frame. It
+        gets taken from the masks built for the vault (see
+        tools/mask_builder.py) or from its image data on first use.
+        '''
+        mask = self._mask
+        if mask is None:
+            vault = self.vault_sprite_action.vault_sprite.vault
+            data = vault.get_mask_data().get(get_mask_key(self.rect))
+            if data is not None:
+                mask = Mask.from_data(data['mask'])
+            else:
+                mask = vault.build_mask(self.rect)
+            self._mask = mask
+        return mask
+
+    def get_bounding_rect(self):
+        '''Returns the tight rect (x, y, w, h) around all solid pixels of the frame.'''
+        vault = self.vault_sprite_action.vault_sprite.vault
+        data = vault.get_mask_data().get(get_mask_key(self.rect))
+        if data is not None:
+            return tuple(data['bounds'])
+        return self.get_mask().get_bounding_rect()
 
     def get_action(self):
         return self.vault_sprite_action
@@ -295,30 +359,23 @@ class VaultSprite(object):
 
 class Vault(object):
 
-    __instances = WeakValueDictionary()
-
-    def __init__(self, vault):
+    def __init__(self, vault, image_data=None):
         super(Vault, self).__init__()
         self.texture_module = vault
         self.texture_filename = vault.filename
         if self.texture_filename is not None:
-            pyglet.resource.path.insert(0, os.path.dirname(vault.__file__))
-            pyglet.resource.reindex()
-            self.image = pyglet.resource.image(self.texture_filename, flip_y=True)
-            pyglet.resource.path.pop(0)
-            pyglet.resource.reindex()
-            # Now modify our texture for better tiling.
-            gl = pyglet.gl
-            texture = self.image
-            gl.glBindTexture(texture.target, texture.id)
-            gl.glTexParameteri(texture.target, gl.GL_TEXTURE_MIN_FILTER, gl.GL_NEAREST)
-            gl.glTexParameteri(texture.target, gl.GL_TEXTURE_MAG_FILTER, gl.GL_NEAREST)
-            gl.glTexParameteri(texture.target, gl.GL_TEXTURE_WRAP_S, gl.GL_CLAMP_TO_BORDER_ARB)
-            gl.glTexParameteri(texture.target, gl.GL_TEXTURE_WRAP_T, gl.GL_CLAMP_TO_BORDER_ARB)
-            gl.glTexParameteri(texture.target, gl.GL_TEXTURE_WRAP_R, gl.GL_CLAMP_TO_BORDER_ARB)
-            gl.glBindTexture(texture.target, 0)
+            if image_data is None:
+                image_data = self.load_image_data(vault)
+            self.image = self.create_texture(image_data)
+            # We assume RGBA here which is what we upload (see load_image_data).
+            self.texture_bytes = self.image.width * self.image.height * 4
         else:
             self.image = None
+            self.texture_bytes = 0
+        # Only kept around once masks are being asked for.
+        self._image_data = None
+        self._mask_data = None
+        self._mask_threshold = 1  # Taken from the masks file if there is one.
         self.sprites = OrderedDict()
         for name, actions in vault.sprites.iteritems():
             self.sprites[name] = VaultSprite(name, actions, self)
@@ -326,29 +383,94 @@ class Vault(object):
     # def __del__(self):
     #     print 'Vault.__del__(%s)' % self
 
+    @staticmethod
+    def load_image_data(vault):
+        '''
+        Decodes the image of the given vault module into RGBA image data.
+        This does not touch OpenGL and thus can be called from any thread.
+        '''
+        image_data = pyglet.image.load(get_image_filename(vault)).get_image_data()
+        # Convert here instead of letting pyglet do it during upload.
+        pitch = image_data.width * 4
+        image_data.set_data('RGBA', pitch, image_data.get_data('RGBA', pitch))
+        return image_data
+
+    def get_image_data(self):
+        '''Returns the RGBA image data of the texture. Loads it if necessary.'''
+        if self._image_data is None:
+            self._image_data = self.load_image_data(self.texture_module)
+        return self._image_data
+
+    def get_mask_data(self):
+        '''
+        Returns the masks built for this vault (rect key -> dict(mask,
+        bounds)). Loads them on first use. Empty if there are none or if
+        they have been built by another version or for another image. Masks
+        missing are being built at runtime with the threshold of the file.
+        '''
+        if self._mask_data is None:
+            self._mask_data = dict()
+            vault = self.texture_module
+            filename = get_masks_filename(vault)
+            if os.path.exists(filename):
+                with open(filename, 'rb') as input:
+                    data = json.load(input)
+                if data.get('version') != MASKS_FORMAT_VERSION or \
+                        data.get('image') != get_image_hash(vault):
+                    log_warning('Ignoring outdated masks %s. Run tools/mask_builder.py again.' % filename)
+                else:
+                    self._mask_threshold = data['threshold']
+                    self._mask_data = data['frames']
+        return self._mask_data
+
+    def build_mask(self, rect, threshold=None):
+        '''
+        Builds the alpha mask of a rect of the image of this vault. Uses
+        the threshold of the masks file by default.
+        '''
+        if threshold is None:
+            self.get_mask_data()
+            threshold = self._mask_threshold
+        return build_mask(self.get_image_data(), rect, threshold)
+
+    @staticmethod
+    def create_texture(image_data):
+        '''
+        Uploads decoded image data into a texture setup for tiling.
+        This has to be called from within the thread owning the GL context.
+        '''
+        texture = image_data.get_texture(rectangle=True)
+        # Now modify our texture for better tiling.
+        gl = pyglet.gl
+        gl.glBindTexture(texture.target, texture.id)
+        gl.glTexParameteri(texture.target, gl.GL_TEXTURE_MIN_FILTER, gl.GL_NEAREST)
+        gl.glTexParameteri(texture.target, gl.GL_TEXTURE_MAG_FILTER, gl.GL_NEAREST)
+        gl.glTexParameteri(texture.target, gl.GL_TEXTURE_WRAP_S, gl.GL_CLAMP_TO_BORDER_ARB)
+        gl.glTexParameteri(texture.target, gl.GL_TEXTURE_WRAP_T, gl.GL_CLAMP_TO_BORDER_ARB)
+        gl.glTexParameteri(texture.target, gl.GL_TEXTURE_WRAP_R, gl.GL_CLAMP_TO_BORDER_ARB)
+        gl.glBindTexture(texture.target, 0)
+        return texture.get_transform(flip_y=True)
+
     def __repr__(self):
         return '<Vault(' \
             'texture_filename = %s, sprites = %s)>' % (
             self.texture_filename, len(self.sprites))
 
     @classmethod
-    def get_instance(cls, vault):
-        cache_id = id(vault)
-        try:
-            cls.__instances[cache_id]
-            # print 'return cached vault instance for', vault
-            return cls.__instances[cache_id]
-        except KeyError:
-            pass
-        instance = cls(vault)
-        cls.__instances[cache_id] = instance
-        # print 'generate new vault instance for', vault
-        return instance
+    def get_instance(cls, vault, pin=False):
+        '''
+        Returns the shared instance for the given vault module.
+        The instance is being served from the vault cache and only loaded if
+        necessary. Set pin to True if it should survive cache evictions. It
+        only pins vaults not being pinned yet. Thus calling it repeatedly
+        doesn't stack pins and a single cache.unpin() releases it again.
+        '''
+        return cache.get(vault, cls, pin_once=pin)
 
     @classmethod
     def clear_instance_cache(cls):
         # print 'Vault.clear_instance_cache()'
-        del cls.__instances[:]
+        cache.clear()
 
     def get_sprites(self):
         return self.sprites
@@ -439,6 +561,201 @@ class Vault(object):
         json.dump(json_data, open(json_filename, 'wb'))
 
 
+class VaultCache(object):
+    '''
+    Keeps vault instances (and thereby their textures) around after the last
+    sprite using them went away. This avoids reloading textures on every
+    scene change.
+
+    Pinned vaults are never evicted. All other vaults are kept in LRU order
+    until the sum of their texture sizes exceeds the budget (in bytes).
+    Evicted vaults which are still in use are being tracked weakly and get
+    readmitted without reloading them.
+    '''
+
+    def __init__(self, budget=DEFAULT_TEXTURE_BUDGET):
+        super(VaultCache, self).__init__()
+        self.lock = RLock()
+        self._loaded = Condition(self.lock)  # Notified whenever a load is done.
+        self._loading = set()  # vault modules being loaded right now
+        self._budget = budget
+        self._entries = OrderedDict()  # vault module -> instance (oldest first)
+        self._pins = dict()  # vault module -> pin count
+        self._alive = WeakValueDictionary()  # vault module -> instance
+        self._bytes = 0
+        self.stats = dict(loads=0, hits=0, evictions=0, evicted_bytes=0)
+
+    def __repr__(self):
+        return '<VaultCache(entries = %d, pinned = %d, bytes = %d, budget = %d)>' % (
+            len(self._entries), len(self._pins), self._bytes, self._budget)
+
+    def __contains__(self, vault):
+        return vault in self._entries or vault in self._alive
+
+    def _admit(self, vault, instance):
+        self._entries[vault] = instance
+        self._alive[vault] = instance
+        self._bytes += instance.texture_bytes
+
+    def _touch(self, vault):
+        # Move entry to the end which marks it as the most recently used one.
+        self._entries[vault] = self._entries.pop(vault)
+
+    def _evict(self):
+        if self._bytes <= self._budget:
+            return
+        for vault in self._entries.keys():
+            if vault in self._pins:
+                continue
+            instance = self._entries.pop(vault)
+            self._bytes -= instance.texture_bytes
+            self.stats['evictions'] += 1
+            self.stats['evicted_bytes'] += instance.texture_bytes
+            if self._bytes <= self._budget:
+                break
+
+    def _lookup(self, vault):
+        if vault in self._entries:
+            self._touch(vault)
+            return self._entries[vault]
+        instance = self._alive.get(vault)
+        if instance is not None:
+            # Got evicted earlier but is still in use. Take it back.
+            self._admit(vault, instance)
+        return instance
+
+    def _add_pin(self, vault, pin, pin_once):
+        if pin or (pin_once and vault not in self._pins):
+            self._pins[vault] = self._pins.get(vault, 0) + 1
+
+    def get(self, vault, factory=None, pin=False, pin_once=False):
+        '''
+        Returns the instance of the given vault module. Loads it by calling
+        factory(vault) if it cannot be found within the cache. Adds a pin if
+        pin is True (see pin()). pin_once only adds a pin if the vault isn't
+        pinned yet.
+
+        Loading happens outside of the lock. Other threads only wait for it
+        if they want the same vault.
+        '''
+        with self.lock:
+            instance = self._lookup(vault)
+            while instance is None and vault in self._loading:
+                # Another thread is loading it right now.
+                self._loaded.wait()
+                instance = self._lookup(vault)
+            if instance is not None:
+                self.stats['hits'] += 1
+                self._add_pin(vault, pin, pin_once)
+                self._evict()
+                return instance
+            self._loading.add(vault)
+        try:
+            instance = (factory or Vault)(vault)
+        except:
+            with self.lock:
+                self._loading.discard(vault)
+                self._loaded.notify_all()
+            raise
+        with self.lock:
+            self._loading.discard(vault)
+            self._loaded.notify_all()
+            existing = self._lookup(vault)
+            if existing is not None:
+                # Got put() into the cache meanwhile.
+                instance = existing
+            else:
+                self.stats['loads'] += 1
+                self._admit(vault, instance)
+            self._add_pin(vault, pin, pin_once)
+            self._evict()
+            return instance
+
+    def put(self, vault, instance):
+        '''Puts an already loaded instance into the cache.'''
+        with self.lock:
+            if vault in self._entries:
+                self._bytes -= self._entries[vault].texture_bytes
+                del self._entries[vault]
+            self.stats['loads'] += 1
+            self._admit(vault, instance)
+            self._evict()
+
+    def pin(self, vault, factory=None):
+        '''
+        Loads the vault if necessary and protects it from being evicted.
+        Pins are being counted. Every pin needs its own unpin().
+        '''
+        return self.get(vault, factory, pin=True)
+
+    def unpin(self, vault):
+        '''Releases a pin. Evicts vaults if we are above the budget now.'''
+        with self.lock:
+            count = self._pins.get(vault, 0) - 1
+            if count > 0:
+                self._pins[vault] = count
+            else:
+                self._pins.pop(vault, None)
+                self._evict()
+
+    def is_pinned(self, vault):
+        return vault in self._pins
+
+    def preload(self, vaults, pin=False, factory=None):
+        '''
+        Loads all given vault modules in advance. Use this before switching
+        to a scene which needs them. Returns the list of instances.
+        '''
+        method = self.pin if pin else self.get
+        return [method(vault, factory) for vault in vaults]
+
+    def warm(self, vaults):
+        '''
+        Marks the given vault modules as recently used without loading
+        missing ones. Use this for keeping the vaults of the current scene
+        while preloading the vaults of the next one.
+        '''
+        with self.lock:
+            for vault in vaults:
+                self._lookup(vault)
+            self._evict()
+
+    def set_budget(self, budget):
+        with self.lock:
+            self._budget = budget
+            self._evict()
+
+    budget = property(lambda self: self._budget, set_budget)
+    bytes = property(lambda self: self._bytes)
+
+    def get_stats(self):
+        with self.lock:
+            stats = self.stats.copy()
+            stats.update(
+                entries=len(self._entries),
+                pinned=len(self._pins),
+                alive=len(self._alive),
+                bytes=self._bytes,
+                budget=self._budget,
+            )
+            return stats
+
+    def clear(self, keep_pinned=False):
+        with self.lock:
+            if keep_pinned:
+                for vault in self._entries.keys():
+                    if vault not in self._pins:
+                        self._bytes -= self._entries.pop(vault).texture_bytes
+            else:
+                self._entries.clear()
+                self._pins.clear()
+                self._alive.clear()
+                self._bytes = 0
+
+
+cache = VaultCache()
+
+
 class EmptyVault():
     filename = None
     sprites = OrderedDict()
@@ -4,14 +4,17 @@
 # @copyright Oktay Acikalin
 # @license   MIT (LICENSE.txt)
 
+import os
+
 from diamond import pyglet
-from diamond.node import Node
+from diamond import profiler
+from diamond.node import Node, resolve_updates
 from diamond import event
 from diamond.array import Array
 from diamond.fbo import FBO
 
 # Load this into our namespace for easier reference.
-from pyglet.window import key
+from pyglet.window import key, mouse
 
 
 class Window(pyglet.window.Window):
@@ -19,16 +22,32 @@ class Window(pyglet.window.Window):
     # When resizing the viewport and its nearly the window size use it instead.
     viewport_resize_correction_threshold = 50
 
-    def __init__(self, width=640, height=480, adapt_width=False, adapt_height=False, **kwargs):
-        if 'config' not in kwargs:
+    def __init__(self, width=640, height=480, adapt_width=False, adapt_height=False, headless=None, **kwargs):
+        # A headless window is never shown, does not wait for vsync and asks
+        # for the most basic config only. Together with a virtual X server
+        # (e.g. xvfb-run) and a software GL (e.g. Mesa llvmpipe) this allows
+        # running scenes on CI servers and within benchmarks.
+        if headless is None:
+            headless = os.environ.get('DIAMOND_HEADLESS', '') not in ('', '0')
+        self.is_headless = headless
+        if headless:
+            kwargs['visible'] = False
+            kwargs['vsync'] = False
+            kwargs.pop('fullscreen', None)
+            if 'config' not in kwargs:
+                kwargs['config'] = pyglet.gl.Config(double_buffer=True)
+        elif 'config' not in kwargs:
             kwargs['config'] = pyglet.gl.Config(
                 # major_version=3, minor_version=0,  # TODO Do we really need OpenGL 3?
                 sample_buffers=1, samples=4,
                 double_buffer=True,
             )
 
-        screen = pyglet.window.get_platform().get_default_display().get_default_screen()
-        view_size = screen.width, screen.height
+        if headless:
+            view_size = width, height
+        else:
+            screen = pyglet.window.get_platform().get_default_display().get_default_screen()
+            view_size = screen.width, screen.height
 
         screen_size = width, height
         if adapt_width:
@@ -57,12 +76,20 @@ class Window(pyglet.window.Window):
         else:
             fullscreen = False
 
+        self.viewport = (0, 0) + tuple(screen_size)  # Gets updated by on_resize.
         super(Window, self).__init__(**kwargs)
+        if headless:
+            # Some platforms ignore the visible flag when creating the context.
+            self.set_visible(False)
+            # Nothing runs the pyglet event loop which would call it for us.
+            self.on_resize(*screen_size)
         self._batch = pyglet.graphics.Batch()
         self.root_node = Node()
         self.root_node.window = self
 
         self.fps_display = pyglet.window.FPSDisplay(self)
+        self.hud = None
+        self._hud_enabled_profiler = False
 
         self.fbo = FBO(*screen_size)
         self._setup_fbo_dl()
@@ -174,7 +201,8 @@ class Window(pyglet.window.Window):
             v_height = height
 
         # print 'viewport =', (x, y, int(v_width), int(v_height))
-        gl.glViewport(x, y, int(v_width), int(v_height))
+        self.viewport = x, y, int(v_width), int(v_height)
+        gl.glViewport(*self.viewport)
 
         gl.glOrtho(0, w, h, 0, -1, 1)
         gl.glMatrixMode(gl.GL_MODELVIEW)
@@ -183,15 +211,45 @@ class Window(pyglet.window.Window):
         pyglet.gl.glClearColor(red, green, blue, 1.0)
 
     def on_draw(self):
+        resolve_updates()
         self.fbo.attach()
         self.clear()
         self._batch.draw()
-        self.fps_display.draw()
+        if self.hud is None:
+            self.fps_display.draw()
         self.fbo.detach()
 
         pyglet.gl.glCallList(self._fbo_dl)
         # self._fbo_batch.draw()
 
+        if self.hud is not None:
+            self.hud.draw()
+
+    def show_hud(self, **kwargs):
+        '''Shows the performance HUD (see diamond.hud). Enables the profiler if necessary.'''
+        if self.hud is not None:
+            return
+        from diamond.hud import Hud
+        if not profiler.enabled:
+            profiler.enable()
+            self._hud_enabled_profiler = True
+        self.hud = Hud(self, **kwargs)
+
+    def hide_hud(self):
+        if self.hud is None:
+            return
+        self.hud.delete()
+        self.hud = None
+        if self._hud_enabled_profiler:
+            profiler.disable()
+            self._hud_enabled_profiler = False
+
+    def toggle_hud(self):
+        if self.hud is None:
+            self.show_hud()
+        else:
+            self.hide_hud()
+
     # TODO Decission required: Do we want to overwrite the close handler?
 
     def on_key_press(self, symbol, modifiers):
@@ -208,18 +266,50 @@ class Window(pyglet.window.Window):
             modifiers=key.modifiers_string(modifiers),
         ))
 
-    # TODO implement mouse events.
-    # def on_mouse_motion(self, x, y, dx, dy):
-    #     print 'mouse motion:', x, y, dx, dy
+    def translate_screen_to_view(self, x, y):
+        '''
+        Translates window coordinates (origin bottom left) into view
+        coordinates (origin top left, scaled to the screen size) as being
+        used by the nodes.
+        '''
+        v_x, v_y, v_w, v_h = self.viewport
+        w, h = self._screen_size
+        return (x - v_x) * w / float(v_w), (v_y + v_h - y) * h / float(v_h)
+
+    def on_mouse_motion(self, x, y, dx, dy):
+        self.on_mouse_drag(x, y, dx, dy, 0, 0)
 
-    # def on_mouse_press(self, x, y, button, modifiers):
-    #     print 'mouse button down:', x, y, button, modifiers
+    def on_mouse_drag(self, x, y, dx, dy, buttons, modifiers):
+        v_x, v_y = self.translate_screen_to_view(x, y)
+        o_x, o_y = self.translate_screen_to_view(x - dx, y - dy)
+        event.emit('window.mouse.motion', Array(
+            window=self,
+            x=v_x,
+            y=v_y,
+            dx=v_x - o_x,
+            dy=v_y - o_y,
+            buttons=mouse.buttons_string(buttons),
+        ))
 
-    # def on_mouse_release(self, x, y, button, modifiers):
-    #     print 'mouse button up:', x, y, button, modifiers
+    def on_mouse_press(self, x, y, button, modifiers):
+        x, y = self.translate_screen_to_view(x, y)
+        event.emit('window.mouse.button.down', Array(
+            window=self,
+            x=x,
+            y=y,
+            button=mouse.buttons_string(button),
+            modifiers=key.modifiers_string(modifiers),
+        ))
 
-    # def on_mouse_drag(self, x, y, dx, dy, buttons, modifiers):
-    #     print 'mouse drag:', x, y, dx, dy, buttons, modifiers
+    def on_mouse_release(self, x, y, button, modifiers):
+        x, y = self.translate_screen_to_view(x, y)
+        event.emit('window.mouse.button.up', Array(
+            window=self,
+            x=x,
+            y=y,
+            button=mouse.buttons_string(button),
+            modifiers=key.modifiers_string(modifiers),
+        ))
 
     # def on_mouse_enter(self, x, y):
     #     print 'mouse enter:', x, y
@@ -232,3 +322,9 @@ class Window(pyglet.window.Window):
 
     def toggle_fullscreen(self):
         self.set_fullscreen(fullscreen=not self._fullscreen)
+
+
+profiler.instrument(Window, 'on_draw')
+# The number of calls per frame equals the number of draw calls.
+profiler.instrument(pyglet.graphics.vertexdomain.VertexDomain, 'draw', 'gl.draw')
+profiler.instrument(pyglet.graphics.vertexdomain.IndexedVertexDomain, 'draw', 'gl.draw')